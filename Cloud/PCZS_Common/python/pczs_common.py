@@ -0,0 +1,339 @@
+# Cloud/PCZS_Common/python/pczs_common.py
+# Shared code for the PCZS Lambda functions, deployed as the PCZS_Common layer
+# (the layer's python/ directory is on sys.path inside Lambda).
+import os
+import gzip
+import json
+import time
+import zlib
+import base64
+import decimal
+import hashlib
+import datetime
+import email.utils
+import threading
+import concurrent.futures
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
+
+# Global CORS headers
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': 'http://pczs-dashboard.s3-website.us-east-2.amazonaws.com',
+    'Access-Control-Allow-Credentials': True,
+    'Content-Type': 'application/json'
+}
+
+# One config for every AWS client: fail fast instead of waiting out API Gateway's
+# 29 s limit, keep connections warm between invocations, and allow enough pooled
+# connections for the handlers' worker threads.
+BOTO_CONFIG = Config(
+    connect_timeout=float(os.environ.get('PCZS_CONNECT_TIMEOUT', '2')),
+    read_timeout=float(os.environ.get('PCZS_READ_TIMEOUT', '5')),
+    retries={'max_attempts': 3, 'mode': 'standard'},
+    max_pool_connections=int(os.environ.get('PCZS_MAX_POOL_CONNECTIONS', '16')),
+    tcp_keepalive=True
+)
+
+# Partition key layout of PCZS_Telemetry (must match on every writer and reader):
+#   workspace  workspace_id as is (one partition per workspace)
+#   day        workspace_id#YYYY-MM-DD, a new partition each day
+#   shard      workspace_id#0 .. #N-1, spreading each workspace's writes over N partitions
+TELEMETRY_KEY_LAYOUT = os.environ.get('PCZS_TELEMETRY_KEY_LAYOUT', 'workspace')
+TELEMETRY_SHARDS = int(os.environ.get('PCZS_TELEMETRY_SHARDS', '4'))
+# How far back (days) a latest-reading lookup searches day partitions
+LATEST_LOOKBACK_DAYS = 7
+# A latest-state item not refreshed for this long (two device sample intervals) may be
+# behind the telemetry table, e.g. while the stream handler lags or retries
+LATEST_STALE_SECONDS = float(os.environ.get('PCZS_LATEST_STALE_SECONDS', '20'))
+
+# Responses smaller than this aren't worth compressing
+COMPRESS_MIN_BYTES = int(os.environ.get('PCZS_COMPRESS_MIN_BYTES', '1024'))
+
+# Set PCZS_LOG_EVENTS=full to log whole events again when debugging
+LOG_FULL_EVENTS = os.environ.get('PCZS_LOG_EVENTS') == 'full'
+
+_session = None
+_clients = {}
+_resources = {}
+_lock = threading.Lock()
+
+# Fix for Decimal serialization
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, decimal.Decimal):
+            return float(o)
+        return super(DecimalEncoder, self).default(o)
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+    return _session
+
+def client(service):
+    """boto3 client for a service, created on first use and reused by later invocations"""
+    if service not in _clients:
+        with _lock:
+            if service not in _clients:
+                _clients[service] = _get_session().client(service, config=BOTO_CONFIG)
+    return _clients[service]
+
+def resource(service):
+    """boto3 resource for a service, created on first use and reused by later invocations"""
+    if service not in _resources:
+        with _lock:
+            if service not in _resources:
+                _resources[service] = _get_session().resource(service, config=BOTO_CONFIG)
+    return _resources[service]
+
+class LazyTable:
+    """DynamoDB Table that is only built when a handler first uses it"""
+    def __init__(self, name):
+        self.name = name
+        self._table = None
+
+    def __getattr__(self, attr):
+        if self._table is None:
+            self._table = resource('dynamodb').Table(self.name)
+        return getattr(self._table, attr)
+
+def telemetry_partition(workspace_id, timestamp):
+    """Partition key value a telemetry item is stored under"""
+    if TELEMETRY_KEY_LAYOUT == 'day':
+        return f'{workspace_id}#{timestamp[:10]}'
+    if TELEMETRY_KEY_LAYOUT == 'shard':
+        # Derived from the timestamp, so a re-sent sample overwrites itself instead of duplicating
+        return f'{workspace_id}#{zlib.crc32(timestamp.encode()) % TELEMETRY_SHARDS}'
+    return workspace_id
+
+def telemetry_partitions(workspace_id, since):
+    """Every partition that can hold a workspace's items newer than `since`, oldest first for 'day'"""
+    if TELEMETRY_KEY_LAYOUT == 'day':
+        first = datetime.date.fromisoformat(since[:10])
+        # Device timestamps are local time, which can be a day ahead of the Lambda's UTC clock
+        last = datetime.date.today() + datetime.timedelta(days=1)
+        return [f'{workspace_id}#{first + datetime.timedelta(days=d)}' for d in range((last - first).days + 1)]
+    if TELEMETRY_KEY_LAYOUT == 'shard':
+        return [f'{workspace_id}#{shard}' for shard in range(TELEMETRY_SHARDS)]
+    return [workspace_id]
+
+def stored_telemetry_item(item):
+    """A telemetry item keyed for the configured layout, ready to write"""
+    if TELEMETRY_KEY_LAYOUT == 'workspace':
+        return item
+    return dict(item, workspace_id=telemetry_partition(item['workspace_id'], item['timestamp']))
+
+def unsharded_item(item):
+    """Undo stored_telemetry_item() on an item read back, so callers see the plain workspace_id"""
+    if TELEMETRY_KEY_LAYOUT != 'workspace' and '#' in item.get('workspace_id', ''):
+        item['workspace_id'] = item['workspace_id'].split('#', 1)[0]
+    return item
+
+def query_latest_telemetry(table_name, workspace_id):
+    """Newest item for a workspace straight from the telemetry table, or None
+
+    Shard partitions are queried in parallel and the newest result wins; day
+    partitions are tried newest first. Uses the client, so it is thread-safe.
+    """
+    since = (datetime.datetime.now() - datetime.timedelta(days=LATEST_LOOKBACK_DAYS)).isoformat()
+    partitions = telemetry_partitions(workspace_id, since)
+
+    def newest(partition):
+        response = resource('dynamodb').meta.client.query(
+            TableName=table_name,
+            KeyConditionExpression=Key('workspace_id').eq(partition),
+            ScanIndexForward=False,  # Sort in descending order (newest first)
+            Limit=1  # Get only the most recent record
+        )
+        return response['Items'][0] if response['Items'] else None
+
+    if TELEMETRY_KEY_LAYOUT == 'shard':
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(partitions)) as pool:
+            items = [item for item in pool.map(newest, partitions) if item]
+        item = max(items, key=lambda i: i['timestamp'], default=None)
+    else:
+        item = next((item for item in map(newest, reversed(partitions)) if item), None)
+    return unsharded_item(item) if item else None
+
+def latest_is_stale(item):
+    """True if a PCZS_TelemetryLatest item has not been refreshed for LATEST_STALE_SECONDS
+
+    Uses the item's refreshed_at (Lambda clock, epoch seconds) rather than its
+    timestamp, which is the device's local time.
+    """
+    return time.time() - float(item.get('refreshed_at', 0)) > LATEST_STALE_SECONDS
+
+def latest_state_item(item, table_name, workspace_id):
+    """A PCZS_TelemetryLatest item, or the telemetry table's newest item if that is newer
+
+    Only a missing or stale item costs a query. refreshed_at is removed from
+    whatever is returned.
+    """
+    if item is None or latest_is_stale(item):
+        queried = query_latest_telemetry(table_name, workspace_id)
+        if item is None or (queried is not None and queried['timestamp'] > item['timestamp']):
+            return queried
+    item.pop('refreshed_at', None)
+    return item
+
+def etag_for(*parts):
+    """Weak ETag from the values that identify a response's version"""
+    digest = hashlib.blake2b('|'.join(map(str, parts)).encode('utf-8'), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+def http_date(timestamp):
+    """HTTP-date for a naive UTC ISO timestamp, as written by the Lambda functions"""
+    when = datetime.datetime.fromisoformat(timestamp).replace(tzinfo=datetime.timezone.utc)
+    return email.utils.format_datetime(when, usegmt=True)
+
+def request_headers(event):
+    return {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+
+def request_body(event, default='{}'):
+    """Request body text; API Gateway base64-encodes it when it matches a binary media type"""
+    body = event.get('body')
+    if not body:
+        return default
+    if event.get('isBase64Encoded'):
+        return base64.b64decode(body).decode('utf-8')
+    return body
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match comparison; weak comparison, as RFC 9110 requires for GET"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag.removeprefix('W/') in (tag.removeprefix('W/') for tag in tags)
+
+def accepted_encoding(accept_encoding):
+    """'gzip' or 'deflate' if the client accepts one (gzip preferred), else None"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for coding in ('gzip', 'deflate'):
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
+
+def finish_response(event, response):
+    """Conditional GET and compression for an API Gateway proxy response
+
+    Successful GETs get an ETag (the handler's own, else a hash of the body)
+    and answer 304 when If-None-Match already has it. Bodies of at least
+    COMPRESS_MIN_BYTES are gzip/deflate encoded when Accept-Encoding allows,
+    and returned base64-encoded for API Gateway.
+    """
+    headers = dict(response.get('headers') or {})
+    request = request_headers(event)
+    if response.get('statusCode') == 200 and event.get('httpMethod') == 'GET':
+        etag = headers.setdefault('ETag', etag_for(response.get('body', '')))
+        headers['Cache-Control'] = 'no-cache'  # browsers keep the body but revalidate every time
+        headers['Vary'] = 'Accept-Encoding'
+        if etag_matches(request.get('if-none-match'), etag):
+            headers.pop('Content-Type', None)
+            return {'statusCode': 304, 'headers': headers, 'body': ''}
+
+    body = response.get('body')
+    coding = accepted_encoding(request.get('accept-encoding'))
+    if coding and isinstance(body, str) and not response.get('isBase64Encoded') and len(body) >= COMPRESS_MIN_BYTES:
+        raw = body.encode('utf-8')
+        # zlib.compress produces the zlib-wrapped stream HTTP calls "deflate"
+        encoded = gzip.compress(raw, compresslevel=6) if coding == 'gzip' else zlib.compress(raw, 6)
+        headers['Content-Encoding'] = coding
+        headers['Vary'] = 'Accept-Encoding'
+        return dict(response, headers=headers, body=base64.b64encode(encoded).decode('ascii'), isBase64Encoded=True)
+    return dict(response, headers=headers)
+
+def log_event(event):
+    """Log a one-line summary of an invocation instead of the whole event"""
+    if LOG_FULL_EVENTS:
+        print(f"Received event: {event}")
+    elif 'httpMethod' in event:
+        params = sorted((event.get('queryStringParameters') or {}).keys())
+        print(f"Received {event['httpMethod']} {event.get('path')} params={params} body={len(event.get('body') or '')}B")
+    elif event.get('Records'):
+        print(f"Received {len(event['Records'])} {event['Records'][0].get('eventSource')} records")
+    else:
+        print(f"Received event with keys {sorted(event)}")
+
+class TTLCache:
+    """Per-container cache of recent reads
+
+    Warm Lambda containers keep module state between invocations, so repeated
+    polls for the same key within `ttl` seconds are served from memory, and
+    concurrent misses for one key share a single backend load.
+    """
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}  # key -> (expires, value)
+        self._loading = {}  # key -> Future of the load in progress
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = concurrent.futures.Future()
+        if not owner:
+            return future.result()
+
+        try:
+            value = load()
+        except Exception as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[key]
+            self._store(key, value)
+        future.set_result(value)
+        return value
+
+    def put(self, key, value):
+        """Replace a key's value, e.g. after this container wrote it"""
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        if len(self._entries) >= self.max_entries:
+            now = time.monotonic()
+            self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+            while len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def get_many(self, keys, load_many):
+        """Values for several keys; the misses are loaded together by load_many(keys) -> {key: value}"""
+        now = time.monotonic()
+        values, missing = {}, []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry and entry[0] > now:
+                    values[key] = entry[1]
+                else:
+                    missing.append(key)
+        if missing:
+            loaded = load_many(missing)
+            with self._lock:
+                expires = time.monotonic() + self.ttl
+                for key in missing:
+                    values[key] = loaded.get(key)
+                    if len(self._entries) < self.max_entries:
+                        self._entries[key] = (expires, values[key])
+        return values
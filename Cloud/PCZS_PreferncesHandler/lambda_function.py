@@ -1,33 +1,33 @@
 # Cloud/lambda_function.py
+import os
 import json
-import boto3
 import datetime
-import decimal
-from boto3.dynamodb.conditions import Key
-from botocore.exceptions import ClientError
-
-# Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb')
-preferences_table = dynamodb.Table('PCZS_UserPreferences')
-telemetry_table = dynamodb.Table('PCZS_Telemetry')
-
-# Global CORS headers
-CORS_HEADERS = {
-    'Access-Control-Allow-Origin': 'http://pczs-dashboard.s3-website.us-east-2.amazonaws.com',
-    'Access-Control-Allow-Credentials': True,
-    'Content-Type': 'application/json'
-}
-
-# Fix for Decimal serialization
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, decimal.Decimal):
-            return float(o)
-        return super(DecimalEncoder, self).default(o)
+
+from pczs_common import (CORS_HEADERS, DecimalEncoder, LazyTable, TTLCache, client, etag_for, finish_response,
+                         http_date, latest_state_item, log_event, request_body)
+
+# DynamoDB tables, built on first use (see the PCZS_Common layer)
+preferences_table = LazyTable('PCZS_UserPreferences')
+telemetry_table = LazyTable('PCZS_Telemetry')
+latest_table = LazyTable('PCZS_TelemetryLatest')
+
+# How long a warm container reuses a workspace's latest reading (devices sample every 10 s)
+LATEST_CACHE_TTL = float(os.environ.get('PCZS_LATEST_CACHE_TTL', '5'))
+# How long a warm container reuses a user's preferences; saves through this container update it at once
+PREFERENCES_CACHE_TTL = float(os.environ.get('PCZS_PREFERENCES_CACHE_TTL', '5'))
+
+# IoT thing that receives a workspace's comfort settings. Gateway deployments
+# use one thing per workspace, e.g. PCZS_THING_NAME_FORMAT='PCZS-{workspace_id}'
+THING_NAME_FORMAT = os.environ.get('PCZS_THING_NAME_FORMAT', 'PCZS')
+
+latest_cache = TTLCache(LATEST_CACHE_TTL)
+preferences_cache = TTLCache(PREFERENCES_CACHE_TTL)
 
 def lambda_handler(event, context):
-    print(f"Received event: {event}")
-    
+    log_event(event)
+    return finish_response(event, route_api_request(event))
+
+def route_api_request(event):
     path = event.get('path', '')
     http_method = event.get('httpMethod', '')
 
@@ -59,14 +59,9 @@ def get_preferences(event):
                 'body': json.dumps({'error': 'Missing required parameters: user_id and workspace_id'})
             }
         
-        response = preferences_table.get_item(
-            Key={
-                'user_id': user_id,
-                'workspace_id': workspace_id
-            }
-        )
+        item = preferences_cache.get((user_id, workspace_id), lambda: read_preferences(user_id, workspace_id))
         
-        if 'Item' not in response:
+        if item is None:
             default_preferences = {
                 'user_id': user_id,
                 'workspace_id': workspace_id,
@@ -77,14 +72,18 @@ def get_preferences(event):
             }
             return {
                 'statusCode': 200,
-                'headers': CORS_HEADERS,
+                'headers': dict(CORS_HEADERS, ETag=etag_for(user_id, workspace_id, 'default')),
                 'body': json.dumps(default_preferences)
             }
         
+        # Every save stamps a new timestamp, so it doubles as the version
+        headers = dict(CORS_HEADERS, ETag=etag_for(user_id, workspace_id, item.get('timestamp')))
+        if 'timestamp' in item:
+            headers['Last-Modified'] = http_date(item['timestamp'])
         return {
             'statusCode': 200,
-            'headers': CORS_HEADERS,
-            'body': json.dumps(response['Item'], cls=DecimalEncoder)
+            'headers': headers,
+            'body': json.dumps(item, cls=DecimalEncoder)
         }
     except Exception as e:
         print(f"Error getting preferences: {e}")
@@ -96,7 +95,7 @@ def get_preferences(event):
 
 def save_preferences(event):
     try:
-        body = json.loads(event.get('body', '{}'))
+        body = json.loads(request_body(event))
 
         required_fields = ['user_id', 'workspace_id', 'preferred_temp', 'temp_threshold',
                            'preferred_humidity', 'humidity_threshold']
@@ -111,6 +110,7 @@ def save_preferences(event):
 
         body['timestamp'] = datetime.datetime.now().isoformat()
         preferences_table.put_item(Item=body)
+        preferences_cache.put((body['user_id'], body['workspace_id']), body)
         update_device_shadow(body)
 
         return {
@@ -138,13 +138,9 @@ def get_telemetry(event):
                 'body': json.dumps({'error': 'Missing required parameter: workspace_id'})
             }
 
-        response = telemetry_table.query(
-            KeyConditionExpression=Key('workspace_id').eq(workspace_id),
-            ScanIndexForward=False,
-            Limit=1
-        )
+        item = latest_cache.get(workspace_id, lambda: read_latest_telemetry(workspace_id))
 
-        if not response['Items']:
+        if item is None:
             return {
                 'statusCode': 404,
                 'headers': CORS_HEADERS,
@@ -153,8 +149,8 @@ def get_telemetry(event):
 
         return {
             'statusCode': 200,
-            'headers': CORS_HEADERS,
-            'body': json.dumps(response['Items'][0], cls=DecimalEncoder)
+            'headers': dict(CORS_HEADERS, ETag=etag_for(workspace_id, item['timestamp'])),
+            'body': json.dumps(item, cls=DecimalEncoder)
         }
     except Exception as e:
         print(f"Error getting telemetry: {e}")
@@ -164,10 +160,17 @@ def get_telemetry(event):
             'body': json.dumps({'error': str(e)})
         }
 
+def read_preferences(user_id, workspace_id):
+    response = preferences_table.get_item(Key={'user_id': user_id, 'workspace_id': workspace_id})
+    return response.get('Item')
+
+def read_latest_telemetry(workspace_id):
+    """Newest telemetry item: the latest-state item kept by PCZS_TelemetryHandler, else (missing or stale) a query"""
+    response = latest_table.get_item(Key={'workspace_id': workspace_id})
+    return latest_state_item(response.get('Item'), telemetry_table.name, workspace_id)
+
 def update_device_shadow(preferences):
     try:
-        iot_client = boto3.client('iot-data')
-
         comfort_settings = {
             'preferred_temp': preferences['preferred_temp'],
             'temp_threshold': preferences['temp_threshold'],
@@ -181,8 +184,9 @@ def update_device_shadow(preferences):
             }
         }
 
-        iot_client.update_thing_shadow(
-            thingName='PCZS',
+        # Reuses the container's client and its open connection instead of building one per save
+        client('iot-data').update_thing_shadow(
+            thingName=THING_NAME_FORMAT.format(workspace_id=preferences['workspace_id']),
             payload=json.dumps(shadow_payload)
         )
         print(f"Updated device shadow with new comfort settings: {comfort_settings}")
@@ -1,32 +1,101 @@
 # Cloud/PCZS_TelemetryHandler/lambda_function.py
+import os
 import json
-import boto3
+import time
+import base64
+import heapq
+import struct
 import decimal
 import datetime
-from boto3.dynamodb.conditions import Key, Attr
+import itertools
+import concurrent.futures
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeDeserializer
 from botocore.exceptions import ClientError
 
-# Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb')
-telemetry_table = dynamodb.Table('PCZS_Telemetry')
+from pczs_common import (CORS_HEADERS, TELEMETRY_KEY_LAYOUT, DecimalEncoder, LazyTable, TTLCache, etag_for,
+                         finish_response, latest_is_stale, latest_state_item, log_event, request_body, resource,
+                         stored_telemetry_item, telemetry_partitions, unsharded_item)
 
-# Global CORS headers
-CORS_HEADERS = {
-    'Access-Control-Allow-Origin': 'http://pczs-dashboard.s3-website.us-east-2.amazonaws.com',
-    'Access-Control-Allow-Credentials': True,
-    'Content-Type': 'application/json'
-}
+# DynamoDB tables, built on first use (see the PCZS_Common layer)
+telemetry_table = LazyTable('PCZS_Telemetry')
+rollup_table = LazyTable('PCZS_TelemetryRollup')
+latest_table = LazyTable('PCZS_TelemetryLatest')
 
-# Fix for Decimal serialization
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, decimal.Decimal):
-            return float(o)
-        return super(DecimalEncoder, self).default(o)
+# How long a warm container reuses a workspace's latest reading (devices sample every 10 s)
+LATEST_CACHE_TTL = float(os.environ.get('PCZS_LATEST_CACHE_TTL', '5'))
+
+# Per-sample columns carried by batched telemetry messages (see Sensors/telemetry_batch.py)
+BATCH_COLUMNS = ('temperature', 'humidity', 'occupied', 'fan_state')
+
+# Fields /telemetry/history can return, and the largest page it reads at once
+HISTORY_FIELDS = ('workspace_id', 'timestamp', 'temperature', 'humidity', 'occupied', 'fan_state')
+HISTORY_MAX_PAGE = 1000
+HISTORY_WORKERS = 8
+DOWNSAMPLE_FIELDS = ('timestamp', 'temperature', 'humidity', 'occupied', 'fan_state')
+# Bounds on one unpaginated response, well inside Lambda's 6 MB response limit
+HISTORY_UNPAGINATED_MAX_HOURS = 48
+HISTORY_UNPAGINATED_MAX_ITEMS = 20000
+
+# Bucket sizes (seconds) accepted by /telemetry/history?resolution=
+HISTORY_RESOLUTIONS = {'1m': 60, '5m': 300, '15m': 900, '1h': 3600, '1d': 86400}
+
+# Rollup tiers kept up to date from the PCZS_Telemetry stream:
+# tier -> (bucket seconds, length of the ISO timestamp prefix that identifies a bucket)
+ROLLUP_TIERS = {'1m': (60, 16), '1h': (3600, 13)}
+ROLLUP_FIELDS = ('temperature', 'humidity')
+# Seconds one raw sample stands for when adding up occupied/fan-on time (device SAMPLE_INTERVAL)
+ROLLUP_SAMPLE_SECONDS = 10
+# Attributes rollup_contribution() reads, for rebuilding rollups from raw items
+ROLLUP_SOURCE_FIELDS = ('timestamp', 'temperature', 'humidity', 'occupied', 'fan_state', 'samples', 'window_seconds',
+                        'occupancy_duty', 'fan_on_seconds') + tuple(f'{f}_{s}' for f in ROLLUP_FIELDS for s in ('min', 'max'))
+# Upper bound for an inclusive timestamp range with no real end
+RAW_OPEN_END = '9999'
+# DynamoDB stream sequence numbers are up to 40 digits
+STREAM_SEQUENCE_DIGITS = 40
+
+# POST /telemetry/batch limits: records per request, items per BatchWriteItem call,
+# attempts at unprocessed items and concurrent BatchWriteItem calls
+BATCH_MAX_RECORDS = 5000
+BATCH_WRITE_CHUNK = 25
+BATCH_WRITE_ATTEMPTS = 5
+BATCH_WRITE_WORKERS = 8
+
+# GET/POST /telemetry/latest: workspaces per request, keys per BatchGetItem call and worker threads
+LATEST_MAX_WORKSPACES = 1000
+LATEST_BATCH_GET_KEYS = 100
+LATEST_WORKERS = 8
+LATEST_COLUMNS = ('timestamp', 'temperature', 'humidity', 'occupied', 'fan_state')
+
+# Compact binary telemetry, version 1 (see Sensors/wire_format.py):
+# version, flags (bit 0 occupied, bit 1 fan), epoch seconds, ms, UTC offset minutes,
+# temperature in 0.01 °C, humidity in 0.01 %
+TELEMETRY_WIRE_V1 = struct.Struct('>BBIHhhH')
+
+latest_cache = TTLCache(LATEST_CACHE_TTL)
 
 def lambda_handler(event, context):
-    print(f"Received event: {event}")
-    
+    log_event(event)
+
+    # New PCZS_Telemetry items from the table's DynamoDB stream
+    if event.get('Records') and event['Records'][0].get('eventSource') == 'aws:dynamodb':
+        return process_telemetry_stream(event)
+
+    # Batched telemetry forwarded by the IoT rule on pczs/+/telemetry/batch
+    if 'ts_base' in event and 'ts_offsets' in event:
+        return ingest_telemetry_batch(event)
+
+    # Binary telemetry forwarded by the IoT rule on pczs/+/telemetry/bin
+    if 'data' in event and 'workspace_id' in event:
+        return ingest_telemetry_binary(event)
+
+    # Single samples, when a sharded key layout routes pczs/+/telemetry through this function
+    if 'workspace_id' in event and 'timestamp' in event and 'httpMethod' not in event:
+        return ingest_telemetry_sample(event)
+
+    return finish_response(event, route_api_request(event))
+
+def route_api_request(event):
     path = event.get('path', '')
     http_method = event.get('httpMethod', '')
 
@@ -35,9 +104,15 @@ def lambda_handler(event, context):
             return get_latest_telemetry(event)
         elif http_method == 'POST':
             return store_telemetry(event)
+    elif path == '/telemetry/latest':
+        if http_method in ('GET', 'POST'):
+            return get_latest_telemetry_many(event)
     elif path == '/telemetry/history':
         if http_method == 'GET':
             return get_telemetry_history(event)
+    elif path == '/telemetry/batch':
+        if http_method == 'POST':
+            return store_telemetry_batch(event)
 
     return {
         'statusCode': 404,
@@ -57,24 +132,21 @@ def get_latest_telemetry(event):
                 'body': json.dumps({'error': 'Missing required parameter: workspace_id'})
             }
 
-        # Query the latest telemetry record for this workspace
-        response = telemetry_table.query(
-            KeyConditionExpression=Key('workspace_id').eq(workspace_id),
-            ScanIndexForward=False,  # Sort in descending order (newest first)
-            Limit=1  # Get only the most recent record
-        )
+        # Shared by every viewer polling this workspace from this container
+        item = latest_cache.get(workspace_id, lambda: read_latest_telemetry(workspace_id))
 
-        if not response['Items']:
+        if item is None:
             return {
                 'statusCode': 404,
                 'headers': CORS_HEADERS,
                 'body': json.dumps({'error': 'No telemetry data found for the specified workspace'})
             }
 
+        # The reading's timestamp is its version, so a poll with nothing new gets a 304
         return {
             'statusCode': 200,
-            'headers': CORS_HEADERS,
-            'body': json.dumps(response['Items'][0], cls=DecimalEncoder)
+            'headers': dict(CORS_HEADERS, ETag=etag_for(workspace_id, item['timestamp'])),
+            'body': json.dumps(item, cls=DecimalEncoder)
         }
     except Exception as e:
         print(f"Error getting telemetry: {e}")
@@ -84,9 +156,108 @@ def get_latest_telemetry(event):
             'body': json.dumps({'error': str(e)})
         }
 
+def read_latest_telemetry(workspace_id):
+    """Newest telemetry item for a workspace, or None
+
+    Reads the materialized latest-state item kept by the stream handler, and
+    only queries PCZS_Telemetry for workspaces that don't have one yet or whose
+    item has not been refreshed for LATEST_STALE_SECONDS.
+    """
+    response = latest_table.get_item(Key={'workspace_id': workspace_id})
+    return latest_state_item(response.get('Item'), telemetry_table.name, workspace_id)
+
+def get_latest_telemetry_many(event):
+    try:
+        if event.get('httpMethod') == 'POST':
+            body = json.loads(request_body(event))
+            workspace_ids = body.get('workspace_ids') if isinstance(body, dict) else None
+        else:
+            query_params = event.get('queryStringParameters', {}) or {}
+            workspace_ids = query_params.get('workspace_ids', '').split(',')
+
+        if not isinstance(workspace_ids, list) or not all(isinstance(w, str) for w in workspace_ids):
+            workspace_ids = []
+        workspace_ids = list(dict.fromkeys(w.strip() for w in workspace_ids if w.strip()))
+        if not 0 < len(workspace_ids) <= LATEST_MAX_WORKSPACES:
+            return {
+                'statusCode': 400,
+                'headers': CORS_HEADERS,
+                'body': json.dumps({'error': f'workspace_ids must list 1 to {LATEST_MAX_WORKSPACES} workspaces'})
+            }
+
+        items = latest_cache.get_many(workspace_ids, read_latest_telemetry_many)
+        return {
+            'statusCode': 200,
+            'headers': CORS_HEADERS,
+            'body': json.dumps(latest_columns(workspace_ids, items), cls=DecimalEncoder, separators=(',', ':'))
+        }
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'error': f'Invalid JSON: {e}'})
+        }
+    except Exception as e:
+        print(f"Error getting latest telemetry: {e}")
+        return {
+            'statusCode': 500,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'error': str(e)})
+        }
+
+def latest_columns(workspace_ids, items):
+    """Columnar response: one array per field, aligned with workspace_ids; no-data workspaces go in missing"""
+    found = [w for w in workspace_ids if items.get(w) is not None]
+    columns = {'workspace_ids': found}
+    for column in LATEST_COLUMNS:
+        columns[column] = [items[w].get(column) for w in found]
+    columns['missing'] = [w for w in workspace_ids if items.get(w) is None]
+    return columns
+
+def read_latest_telemetry_many(workspace_ids):
+    """{workspace_id: newest item or None}, using BatchGetItem on the latest-state items
+
+    Chunks of 100 keys are fetched on a small thread pool; workspaces without
+    a latest-state item, or whose item is stale, fall back to per-workspace
+    queries on a second pool. Each pool is sized to its own work.
+    """
+    chunks = [workspace_ids[i:i + LATEST_BATCH_GET_KEYS] for i in range(0, len(workspace_ids), LATEST_BATCH_GET_KEYS)]
+    found = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(LATEST_WORKERS, max(len(chunks), 1))) as pool:
+        for items in pool.map(batch_get_latest, chunks):
+            found.update(items)
+
+    missing = [w for w in workspace_ids if w not in found or latest_is_stale(found[w])]
+    if missing:
+        def read(workspace_id):
+            return latest_state_item(found.get(workspace_id), telemetry_table.name, workspace_id)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(LATEST_WORKERS, len(missing))) as pool:
+            for workspace_id, item in zip(missing, pool.map(read, missing)):
+                found[workspace_id] = item
+    for item in found.values():
+        if item is not None:
+            item.pop('refreshed_at', None)
+    return found
+
+def batch_get_latest(workspace_ids):
+    """Latest-state items for up to 100 workspaces; keys still unprocessed after retries are left out"""
+    client = resource('dynamodb').meta.client
+    request = {latest_table.name: {'Keys': [{'workspace_id': w} for w in workspace_ids]}}
+    found = {}
+    for attempt in range(BATCH_WRITE_ATTEMPTS):
+        response = client.batch_get_item(RequestItems=request)
+        for item in response['Responses'].get(latest_table.name, []):
+            found[item['workspace_id']] = item
+        request = response.get('UnprocessedKeys')
+        if not request:
+            break
+        time.sleep(min(0.05 * 2 ** attempt, 1.0))  # Back off before retrying throttled keys
+    return found
+
 def store_telemetry(event):
     try:
-        body = json.loads(event.get('body', '{}'))
+        body = json.loads(request_body(event))
 
         required_fields = ['workspace_id', 'timestamp', 'temperature', 'humidity']
         
@@ -99,7 +270,7 @@ def store_telemetry(event):
                 }
 
         # Store telemetry data in DynamoDB
-        telemetry_table.put_item(Item=body)
+        telemetry_table.put_item(Item=stored_telemetry_item(body))
 
         return {
             'statusCode': 200,
@@ -114,6 +285,120 @@ def store_telemetry(event):
             'body': json.dumps({'error': str(e)})
         }
 
+def store_telemetry_batch(event):
+    try:
+        # Numbers are parsed straight to Decimal, which is what DynamoDB needs
+        try:
+            body = json.loads(request_body(event), parse_float=decimal.Decimal,
+                              parse_constant=lambda c: decimal.Decimal('NaN'))
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': CORS_HEADERS,
+                'body': json.dumps({'error': f'Invalid JSON: {e}'})
+            }
+        records = body.get('records') if isinstance(body, dict) else body
+        if not isinstance(records, list) or not 0 < len(records) <= BATCH_MAX_RECORDS:
+            return {
+                'statusCode': 400,
+                'headers': CORS_HEADERS,
+                'body': json.dumps({'error': f'Body must be a list (or {{"records": [...]}}) of 1 to {BATCH_MAX_RECORDS} records'})
+            }
+
+        items, errors = validate_telemetry_records(records)
+        errors.extend(write_telemetry_items([(index, stored_telemetry_item(item)) for index, item in items]))
+        errors.sort(key=lambda e: e['index'])
+
+        stored = len(records) - len(errors)
+        return {
+            'statusCode': 200 if not errors else (207 if stored else 400),
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'stored': stored, 'failed': len(errors), 'errors': errors})
+        }
+    except Exception as e:
+        print(f"Error storing telemetry batch: {e}")
+        return {
+            'statusCode': 500,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'error': str(e)})
+        }
+
+def validate_telemetry_records(records):
+    """Check every record in one pass: ([(index, item)], [{'index', 'error'}])"""
+    items, errors, seen = [], [], set()
+    for index, record in enumerate(records):
+        error = None
+        if not isinstance(record, dict):
+            error = 'Record must be an object'
+        elif not isinstance(record.get('workspace_id'), str) or not record['workspace_id']:
+            error = 'Missing required field: workspace_id'
+        elif not isinstance(record.get('timestamp'), str):
+            error = 'Missing required field: timestamp'
+        else:
+            try:
+                datetime.datetime.fromisoformat(record['timestamp'])
+            except ValueError:
+                error = 'timestamp must be an ISO 8601 date-time'
+        if error is None:
+            for field in ('temperature', 'humidity'):
+                value = record.get(field)
+                if isinstance(value, int) and not isinstance(value, bool):
+                    record[field] = value = decimal.Decimal(value)
+                if not isinstance(value, decimal.Decimal) or not value.is_finite():
+                    error = f'{field} must be a finite number'
+                    break
+        if error is None:
+            for field in ('occupied', 'fan_state'):
+                if field in record and not isinstance(record[field], bool):
+                    error = f'{field} must be true or false'
+                    break
+        if error is None:
+            key = (record['workspace_id'], record['timestamp'])
+            if key in seen:
+                error = 'Duplicate workspace_id/timestamp in this batch'
+            seen.add(key)
+
+        if error is None:
+            items.append((index, record))
+        else:
+            errors.append({'index': index, 'error': error})
+    return items, errors
+
+def write_telemetry_items(indexed_items):
+    """Write (index, item) pairs in BatchWriteItem chunks; returns per-record errors
+
+    batch_writer() retries unprocessed items too but can't say which records
+    failed, so chunks are sent with the resource's client directly.
+    """
+    chunks = [indexed_items[i:i + BATCH_WRITE_CHUNK] for i in range(0, len(indexed_items), BATCH_WRITE_CHUNK)]
+    if not chunks:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(BATCH_WRITE_WORKERS, len(chunks))) as pool:
+        return [error for errors in pool.map(write_telemetry_chunk, chunks) for error in errors]
+
+def write_telemetry_chunk(chunk):
+    client = resource('dynamodb').meta.client  # accepts/returns plain Python types like the Table resource
+    pending = chunk
+    for attempt in range(BATCH_WRITE_ATTEMPTS):
+        try:
+            response = client.batch_write_item(
+                RequestItems={telemetry_table.name: [{'PutRequest': {'Item': item}} for _, item in pending]}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ValidationException' and len(pending) > 1:
+                # One bad item rejects the whole call; write them singly to find it
+                return [error for entry in pending for error in write_telemetry_chunk([entry])]
+            message = e.response['Error'].get('Message', str(e))
+            return [{'index': index, 'error': message} for index, _ in pending]
+
+        unprocessed = response.get('UnprocessedItems', {}).get(telemetry_table.name, [])
+        if not unprocessed:
+            return []
+        keys = {(r['PutRequest']['Item']['workspace_id'], r['PutRequest']['Item']['timestamp']) for r in unprocessed}
+        pending = [(index, item) for index, item in pending if (item['workspace_id'], item['timestamp']) in keys]
+        time.sleep(min(0.05 * 2 ** attempt, 1.0))  # Back off before retrying throttled items
+    return [{'index': index, 'error': 'Not written after retries (throttled)'} for index, _ in pending]
+
 def get_telemetry_history(event):
     try:
         query_params = event.get('queryStringParameters', {}) or {}
@@ -127,17 +412,78 @@ def get_telemetry_history(event):
                 'body': json.dumps({'error': 'Missing required parameter: workspace_id'})
             }
 
+        fields = parse_history_fields(query_params.get('fields'))
+        if fields is None:
+            return {
+                'statusCode': 400,
+                'headers': CORS_HEADERS,
+                'body': json.dumps({'error': f'fields must be a comma-separated subset of: {", ".join(HISTORY_FIELDS)}'})
+            }
+
         # Calculate time threshold (e.g., last 24 hours)
         time_threshold = (datetime.datetime.now() - datetime.timedelta(hours=hours)).isoformat()
 
-        # Query telemetry history
-        response = telemetry_table.query(
-            KeyConditionExpression=Key('workspace_id').eq(workspace_id) & 
-                                   Key('timestamp').gt(time_threshold),
-            ScanIndexForward=True  # Sort in ascending order (oldest first)
-        )
+        # Downsampled mode: one summary per time bucket instead of every sample
+        resolution = query_params.get('resolution')
+        if resolution:
+            if resolution not in HISTORY_RESOLUTIONS or 'limit' in query_params or 'next_token' in query_params:
+                return {
+                    'statusCode': 400,
+                    'headers': CORS_HEADERS,
+                    'body': json.dumps({'error': f'resolution must be one of {", ".join(HISTORY_RESOLUTIONS)} '
+                                                 'and cannot be combined with limit/next_token'})
+                }
+            bucket_seconds = HISTORY_RESOLUTIONS[resolution]
+            # Prefer the rollup tier; raw items fill in what it does not cover, or all of it if it is empty
+            buckets = history_from_rollups(workspace_id, time_threshold, bucket_seconds)
+            if not buckets:
+                buckets = downsample_telemetry(
+                    iter_telemetry_history(workspace_id, time_threshold, DOWNSAMPLE_FIELDS),
+                    bucket_seconds
+                )
+            return {
+                'statusCode': 200 if buckets else 404,
+                'headers': CORS_HEADERS,
+                'body': json.dumps(buckets)
+            }
+
+        # Paginated mode: one page per request, continued with next_token
+        if 'limit' in query_params or 'next_token' in query_params:
+            limit = min(max(int(query_params.get('limit', HISTORY_MAX_PAGE)), 1), HISTORY_MAX_PAGE)
+            try:
+                cursors = decode_history_token(query_params.get('next_token'), workspace_id)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': CORS_HEADERS,
+                    'body': json.dumps({'error': f'Invalid next_token: {e}'})
+                }
+            items, cursors = query_history_page(workspace_id, time_threshold, fields, limit, cursors)
+            return {
+                'statusCode': 200,
+                'headers': CORS_HEADERS,
+                'body': json.dumps({
+                    'items': items,
+                    'next_token': encode_history_token(workspace_id, cursors)
+                }, cls=DecimalEncoder)
+            }
 
-        if not response['Items']:
+        # Unpaginated mode keeps the original response shape but now reads every page, up to a bound
+        too_much = {
+            'statusCode': 400,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'error': f'Unpaginated history is limited to {HISTORY_UNPAGINATED_MAX_HOURS} hours '
+                                         f'and {HISTORY_UNPAGINATED_MAX_ITEMS} items; use limit/next_token to page '
+                                         'through longer windows, or resolution to downsample them'})
+        }
+        if hours > HISTORY_UNPAGINATED_MAX_HOURS:
+            return too_much
+        items = list(itertools.islice(iter_telemetry_history(workspace_id, time_threshold, fields),
+                                      HISTORY_UNPAGINATED_MAX_ITEMS + 1))
+        if len(items) > HISTORY_UNPAGINATED_MAX_ITEMS:
+            return too_much
+
+        if not items:
             return {
                 'statusCode': 404,
                 'headers': CORS_HEADERS,
@@ -147,7 +493,13 @@ def get_telemetry_history(event):
         return {
             'statusCode': 200,
             'headers': CORS_HEADERS,
-            'body': json.dumps(response['Items'], cls=DecimalEncoder)
+            'body': json.dumps(items, cls=DecimalEncoder)
+        }
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'error': f'Invalid parameter: {e}'})
         }
     except Exception as e:
         print(f"Error getting telemetry history: {e}")
@@ -155,4 +507,551 @@ def get_telemetry_history(event):
             'statusCode': 500,
             'headers': CORS_HEADERS,
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
+
+def downsample_telemetry(items, bucket_seconds):
+    """Summarise time-ordered telemetry items into fixed buckets with vectorized NumPy
+
+    Returns one dict per non-empty bucket: sample count, mean/min/max temperature
+    and humidity, the fraction of samples that were occupied and the fan duty cycle.
+    """
+    # NumPy is only needed here, so other routes don't pay for importing it
+    import numpy as np
+
+    # Collect columns directly rather than keeping every item around
+    timestamps, temperature, humidity, occupied, fan = [], [], [], [], []
+    for item in items:
+        timestamps.append(item['timestamp'])
+        temperature.append(float(item.get('temperature', 'nan')))
+        humidity.append(float(item.get('humidity', 'nan')))
+        occupied.append(bool(item.get('occupied', False)))
+        fan.append(bool(item.get('fan_state', False)))
+    if not timestamps:
+        return []
+
+    seconds = np.array(timestamps, dtype='datetime64[ms]').astype('int64') // 1000
+    bucket = seconds // bucket_seconds
+    # Items arrive sorted by timestamp, so each bucket is a contiguous run
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    counts = np.diff(np.r_[starts, len(bucket)])
+
+    def column_stats(values):
+        values = np.array(values, dtype=float)
+        present = ~np.isnan(values)
+        n = np.add.reduceat(present, starts)
+        total = np.add.reduceat(np.where(present, values, 0.0), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / n
+        return mean, np.fmin.reduceat(values, starts), np.fmax.reduceat(values, starts)
+
+    temp_mean, temp_min, temp_max = column_stats(temperature)
+    hum_mean, hum_min, hum_max = column_stats(humidity)
+    occupied_fraction = np.add.reduceat(np.array(occupied, dtype=float), starts) / counts
+    fan_duty = np.add.reduceat(np.array(fan, dtype=float), starts) / counts
+    bucket_starts = np.datetime_as_string((bucket[starts] * bucket_seconds).astype('datetime64[s]'))
+
+    def rounded(value):
+        return None if np.isnan(value) else round(float(value), 2)
+
+    return [
+        {
+            'timestamp': str(bucket_starts[i]),
+            'samples': int(counts[i]),
+            'temperature': rounded(temp_mean[i]),
+            'temperature_min': rounded(temp_min[i]),
+            'temperature_max': rounded(temp_max[i]),
+            'humidity': rounded(hum_mean[i]),
+            'humidity_min': rounded(hum_min[i]),
+            'humidity_max': rounded(hum_max[i]),
+            'occupied_fraction': round(float(occupied_fraction[i]), 3),
+            'fan_duty': round(float(fan_duty[i]), 3)
+        }
+        for i in range(len(starts))
+    ]
+
+def history_from_rollups(workspace_id, since, bucket_seconds):
+    """History buckets built from the coarsest rollup tier that fits, or None if there is none"""
+    tiers = [tier for tier, (width, _) in ROLLUP_TIERS.items() if bucket_seconds % width == 0]
+    if not tiers:
+        return None
+    tier = max(tiers, key=lambda t: ROLLUP_TIERS[t][0])
+    try:
+        rollups = list(iter_rollups(workspace_id, tier, since))
+    except ClientError as e:
+        print(f"Rollup tier unavailable, reading raw telemetry: {e}")
+        return None
+    if not rollups:
+        return None
+
+    # The stream may have been connected partway through the window, and it lags the
+    # newest samples, so parts of the window are rebuilt from raw items: everything
+    # up to the second rollup item when the first one starts late (it may be partial
+    # too), and the last rollup item onwards, since it may still be filling
+    head = []
+    if rollups[0]['bucket'] > rollup_bucket(since, tier):
+        if len(rollups) == 1:
+            return combine_rollups(raw_rollups(workspace_id, tier, since), bucket_seconds)
+        head = raw_rollups(workspace_id, tier, since, rollups[1]['bucket'])
+        rollups = rollups[1:]
+    tail = raw_rollups(workspace_id, tier, rollups[-1]['bucket'])
+    return combine_rollups(head + rollups[:-1] + tail, bucket_seconds)
+
+def raw_rollups(workspace_id, tier, start, end=None):
+    """Rollup items for one tier computed from raw telemetry in [start, end), for spans the stream has not covered"""
+    grouped = {}
+    for item in iter_telemetry_history(workspace_id, start, ROLLUP_SOURCE_FIELDS, until=end or RAW_OPEN_END):
+        if end and item['timestamp'] >= end:
+            continue
+        contribution = rollup_contribution(item)
+        if contribution is not None:
+            grouped.setdefault(rollup_bucket(item['timestamp'], tier), []).append(contribution)
+    return [dict(combine_contributions(contributions), bucket=bucket) for bucket, contributions in grouped.items()]
+
+def iter_rollups(workspace_id, tier, since):
+    """Yield a workspace's rollup items for one tier from the bucket holding `since` onwards"""
+    kwargs = {
+        'KeyConditionExpression': Key('series').eq(f'{workspace_id}#{tier}') &
+                                  Key('bucket').gte(rollup_bucket(since, tier)),
+        'ScanIndexForward': True
+    }
+    while True:
+        response = rollup_table.query(**kwargs)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def combine_rollups(rollups, bucket_seconds):
+    """Merge time-ordered rollup items into history buckets shaped like downsample_telemetry()'s"""
+    epoch = datetime.datetime(1970, 1, 1)
+    merged = {}
+    for rollup in rollups:
+        seconds = int((datetime.datetime.fromisoformat(rollup['bucket']) - epoch).total_seconds())
+        start = seconds - seconds % bucket_seconds
+        bucket = merged.get(start)
+        if bucket is None:
+            merged[start] = dict(rollup)
+            continue
+        for name in ('count', 'seconds', 'occupied_seconds', 'fan_seconds') + tuple(f'{f}_sum' for f in ROLLUP_FIELDS):
+            bucket[name] += rollup[name]
+        # min/max are written after the counters, so an item can briefly lack them
+        for field in ROLLUP_FIELDS:
+            lows = [v for v in (bucket.get(f'{field}_min'), rollup.get(f'{field}_min')) if v is not None]
+            highs = [v for v in (bucket.get(f'{field}_max'), rollup.get(f'{field}_max')) if v is not None]
+            bucket[f'{field}_min'] = min(lows, default=None)
+            bucket[f'{field}_max'] = max(highs, default=None)
+
+    buckets = []
+    for start, totals in merged.items():
+        bucket = {
+            'timestamp': (epoch + datetime.timedelta(seconds=start)).isoformat(),
+            'samples': int(totals['count'])
+        }
+        for field in ROLLUP_FIELDS:
+            bucket[field] = round(float(totals[f'{field}_sum'] / totals['count']), 2)
+            for extreme in (f'{field}_min', f'{field}_max'):
+                bucket[extreme] = round(float(totals[extreme]), 2) if totals.get(extreme) is not None else None
+        bucket['occupied_fraction'] = round(float(totals['occupied_seconds'] / totals['seconds']), 3)
+        bucket['fan_duty'] = round(float(totals['fan_seconds'] / totals['seconds']), 3)
+        buckets.append(bucket)
+    return buckets
+
+def parse_history_fields(fields_param):
+    """Requested history fields (timestamp always included), or None if any are unknown"""
+    if not fields_param:
+        return list(HISTORY_FIELDS)
+    fields = [f.strip() for f in fields_param.split(',') if f.strip()]
+    if any(f not in HISTORY_FIELDS for f in fields):
+        return None
+    return ['timestamp'] + [f for f in fields if f != 'timestamp']
+
+def history_query_args(partition, since, fields, until=None):
+    """Query arguments for one partition's history; names are aliased since 'timestamp' is reserved
+
+    With `until`, the range is since..until inclusive (DynamoDB has no open upper bound with gt).
+    """
+    names = {f'#f{i}': field for i, field in enumerate(fields)}
+    timestamps = Key('timestamp').gt(since) if until is None else Key('timestamp').between(since, until)
+    return {
+        'TableName': telemetry_table.name,
+        'KeyConditionExpression': Key('workspace_id').eq(partition) & timestamps,
+        'ProjectionExpression': ', '.join(names),
+        'ExpressionAttributeNames': names,
+        'ScanIndexForward': True  # Sort in ascending order (oldest first)
+    }
+
+def query_partition(partition, since, fields, limit, after=None, until=None):
+    """Up to `limit` items of one partition after timestamp `after`: (items, whether more may follow)"""
+    kwargs = history_query_args(partition, since, fields, until)
+    kwargs['Limit'] = limit
+    if after:
+        kwargs['ExclusiveStartKey'] = {'workspace_id': partition, 'timestamp': after}
+    response = resource('dynamodb').meta.client.query(**kwargs)
+    return response['Items'], 'LastEvaluatedKey' in response
+
+def iter_partition(partition, since, fields, until=None):
+    """Every item of one partition after `since`, oldest first, one DynamoDB page at a time"""
+    after = None
+    while True:
+        items, more = query_partition(partition, since, fields, HISTORY_MAX_PAGE, after, until)
+        yield from items
+        if not more or not items:
+            return
+        after = items[-1]['timestamp']
+
+def query_history_page(workspace_id, since, fields, limit, cursors=None):
+    """One page of history across the workspace's partitions: (items, cursors for the next page or None)
+
+    `cursors` maps each partition that may still hold items to the last
+    timestamp already returned from it (None before the first page).
+    """
+    if cursors is None:
+        cursors = {partition: None for partition in telemetry_partitions(workspace_id, since)}
+    cursors = dict(cursors)
+    page = []
+
+    if TELEMETRY_KEY_LAYOUT == 'shard':
+        # Shards overlap in time: read a page from each in parallel and merge by timestamp
+        partitions = list(cursors)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(partitions)) as pool:
+            results = list(pool.map(lambda p: query_partition(p, since, fields, limit, cursors[p]), partitions))
+        merged = heapq.merge(*[[(item['timestamp'], partition, item) for item in items]
+                               for partition, (items, _) in zip(partitions, results)])
+        for timestamp, partition, item in itertools.islice(merged, limit):
+            cursors[partition] = timestamp
+            page.append(item)
+        for partition, (items, more) in zip(partitions, results):
+            if not more and (not items or cursors[partition] == items[-1]['timestamp']):
+                del cursors[partition]
+    else:
+        # Workspace and day partitions don't overlap in time, so read them in order until the page is full
+        for partition in list(cursors):
+            items, more = query_partition(partition, since, fields, limit - len(page), cursors[partition])
+            page.extend(items)
+            if items:
+                cursors[partition] = items[-1]['timestamp']
+            if more:
+                break  # This partition isn't finished (page full, or DynamoDB's 1 MB limit)
+            del cursors[partition]
+
+    return [unsharded_item(item) for item in page], cursors or None
+
+def iter_telemetry_history(workspace_id, since, fields=HISTORY_FIELDS, until=None):
+    """Yield history items oldest first, scatter-gathering across the workspace's partitions"""
+    fields = list(fields)
+    partitions = telemetry_partitions(workspace_id, since)
+    if len(partitions) == 1:
+        # Stream a single partition, holding only one DynamoDB page in memory at a time
+        yield from (unsharded_item(item) for item in iter_partition(partitions[0], since, fields, until))
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(HISTORY_WORKERS, len(partitions))) as pool:
+        results = list(pool.map(lambda p: list(iter_partition(p, since, fields, until)), partitions))
+    for item in heapq.merge(*results, key=lambda i: i['timestamp']):
+        yield unsharded_item(item)
+
+def encode_history_token(workspace_id, cursors):
+    """Opaque continuation token for the per-partition cursors"""
+    if not cursors:
+        return None
+    raw = json.dumps({'w': workspace_id, 'c': cursors}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_history_token(token, workspace_id):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        key = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('malformed token')
+    if not isinstance(key, dict) or key.get('w') != workspace_id or not isinstance(key.get('c'), dict):
+        raise ValueError('token does not belong to this workspace')
+    cursors = key['c']
+    if not cursors or not all(
+        (partition == workspace_id or partition.startswith(workspace_id + '#')) and
+        (after is None or isinstance(after, str))
+        for partition, after in cursors.items()
+    ):
+        raise ValueError('token does not belong to this workspace')
+    return cursors
+
+def expand_telemetry_batch(batch):
+    """Expand a columnar telemetry batch from the device into one DynamoDB item per sample"""
+    base = datetime.datetime.fromisoformat(batch['ts_base'])
+    columns = [c for c in BATCH_COLUMNS if c in batch]
+    items = []
+    for i, offset in enumerate(batch['ts_offsets']):
+        item = {
+            'workspace_id': batch['workspace_id'],
+            'timestamp': (base + datetime.timedelta(milliseconds=offset)).isoformat()
+        }
+        for column in columns:
+            value = batch[column][i]
+            if value is None:
+                continue
+            # DynamoDB rejects Python floats, store numbers as Decimal
+            if isinstance(value, float):
+                value = decimal.Decimal(str(value))
+            item[column] = value
+        items.append(item)
+    return items
+
+def ingest_telemetry_batch(batch):
+    try:
+        items = expand_telemetry_batch(batch)
+        with telemetry_table.batch_writer(overwrite_by_pkeys=['workspace_id', 'timestamp']) as writer:
+            for item in items:
+                writer.put_item(Item=stored_telemetry_item(item))
+        print(f"Stored {len(items)} telemetry samples for {batch['workspace_id']}")
+        return {'success': True, 'stored': len(items)}
+    except Exception as e:
+        print(f"Error storing telemetry batch: {e}")
+        raise
+
+def decode_telemetry_binary(data, workspace_id):
+    """Decode a packed telemetry sample into the same item the JSON path stores"""
+    if not data or data[0] != 1:
+        raise ValueError(f"Unsupported telemetry wire version: {data[0] if data else None}")
+    _, flags, seconds, millis, offset, temperature, humidity = TELEMETRY_WIRE_V1.unpack(data)
+    tz = datetime.timezone(datetime.timedelta(minutes=offset))
+    # Rebuild the device's local timestamp so the sort key format is unchanged
+    when = datetime.datetime.fromtimestamp(seconds, tz) + datetime.timedelta(milliseconds=millis)
+    return {
+        'workspace_id': workspace_id,
+        'timestamp': when.replace(tzinfo=None).isoformat(),
+        'temperature': decimal.Decimal(temperature) / 100,
+        'humidity': decimal.Decimal(humidity) / 100,
+        'occupied': bool(flags & 0x01),
+        'fan_state': bool(flags & 0x02)
+    }
+
+def ingest_telemetry_binary(event):
+    try:
+        item = decode_telemetry_binary(base64.b64decode(event['data']), event['workspace_id'])
+        telemetry_table.put_item(Item=stored_telemetry_item(item))
+        return {'success': True, 'stored': 1}
+    except Exception as e:
+        print(f"Error storing binary telemetry: {e}")
+        raise
+
+def ingest_telemetry_sample(sample):
+    try:
+        # The rule delivers parsed JSON; DynamoDB needs Decimal instead of float
+        item = json.loads(json.dumps(sample), parse_float=decimal.Decimal)
+        telemetry_table.put_item(Item=stored_telemetry_item(item))
+        return {'success': True, 'stored': 1}
+    except Exception as e:
+        print(f"Error storing telemetry sample: {e}")
+        raise
+
+def rollup_bucket(timestamp, tier):
+    """Start of the tier's bucket holding an ISO timestamp, e.g. 2026-10-17T09:42:00 for '1m'"""
+    prefix = ROLLUP_TIERS[tier][1]
+    return timestamp[:prefix] + ':00:00'[:19 - prefix]
+
+def rollup_contribution(item):
+    """What one telemetry item adds to a rollup bucket, or None if it has no readings
+
+    Raw samples count once and stand for ROLLUP_SAMPLE_SECONDS. On-device
+    aggregates (Sensors/aggregation.py) carry their own sample count and window
+    and are credited whole to the bucket their window starts in.
+    """
+    if any(field not in item for field in ROLLUP_FIELDS):
+        return None
+    if 'window_seconds' in item:
+        count = decimal.Decimal(item['samples'])
+        seconds = decimal.Decimal(item['window_seconds'])
+        occupied_seconds = decimal.Decimal(str(item.get('occupancy_duty', 0))) * seconds
+        fan_seconds = decimal.Decimal(str(item.get('fan_on_seconds', 0)))
+    else:
+        count = decimal.Decimal(1)
+        seconds = decimal.Decimal(ROLLUP_SAMPLE_SECONDS)
+        occupied_seconds = seconds if item.get('occupied') else decimal.Decimal(0)
+        fan_seconds = seconds if item.get('fan_state') else decimal.Decimal(0)
+    contribution = {
+        'count': count,
+        'seconds': seconds,
+        'occupied_seconds': occupied_seconds,
+        'fan_seconds': fan_seconds
+    }
+    for field in ROLLUP_FIELDS:
+        value = decimal.Decimal(str(item[field]))
+        contribution[f'{field}_sum'] = value * count
+        contribution[f'{field}_min'] = decimal.Decimal(str(item.get(f'{field}_min', value)))
+        contribution[f'{field}_max'] = decimal.Decimal(str(item.get(f'{field}_max', value)))
+    return contribution
+
+def accumulate_rollups(records):
+    """Group stream records' rollup contributions by (series, bucket, source partition) for every tier
+
+    Returns {(series, bucket, partition): [(sequence_number, contribution), ...]}.
+    """
+    rollups = {}
+    for sequence_number, partition, item in records:
+        contribution = rollup_contribution(item)
+        if contribution is None:
+            continue
+        for tier in ROLLUP_TIERS:
+            key = (f"{item['workspace_id']}#{tier}", rollup_bucket(item['timestamp'], tier), partition)
+            rollups.setdefault(key, []).append((sequence_number, contribution))
+    return rollups
+
+def combine_contributions(contributions):
+    """Fold rollup contributions into one set of totals"""
+    totals = dict(contributions[0])
+    for contribution in contributions[1:]:
+        for name, value in contribution.items():
+            if name.endswith('_min'):
+                totals[name] = min(totals[name], value)
+            elif name.endswith('_max'):
+                totals[name] = max(totals[name], value)
+            else:
+                totals[name] += value
+    return totals
+
+def stream_records(event):
+    """Telemetry items inserted into PCZS_Telemetry, from a DynamoDB stream event
+
+    Only INSERTs count: a MODIFY is a sample written twice under the same key
+    (e.g. a re-sent batch) and was already added when it was first inserted.
+    Returns (sequence_number, partition, item) triples; the partition is the
+    stored partition key, before unsharded_item() strips any day/shard suffix.
+    """
+    deserializer = TypeDeserializer()
+    records = []
+    for record in event['Records']:
+        if record.get('eventName') != 'INSERT' or 'NewImage' not in record.get('dynamodb', {}):
+            continue
+        item = {name: deserializer.deserialize(value) for name, value in record['dynamodb']['NewImage'].items()}
+        partition = item['workspace_id']
+        records.append((stream_sequence(record), partition, unsharded_item(item)))
+    return records
+
+def stream_sequence(record):
+    """A record's SequenceNumber, zero-padded so that string order is numeric order"""
+    return record['dynamodb']['SequenceNumber'].zfill(STREAM_SEQUENCE_DIGITS)
+
+def update_latest_state(items):
+    """Write each workspace's newest item to PCZS_TelemetryLatest unless a newer one is already there
+
+    refreshed_at records when (Lambda clock) the item was written, so readers can
+    tell a latest-state item that may be behind the telemetry table.
+    """
+    newest = {}
+    for item in items:
+        current = newest.get(item['workspace_id'])
+        if current is None or item['timestamp'] > current['timestamp']:
+            newest[item['workspace_id']] = item
+    for item in newest.values():
+        try:
+            latest_table.put_item(
+                Item=dict(item, refreshed_at=int(time.time())),
+                ConditionExpression='attribute_not_exists(#ts) OR #ts < :ts',
+                ExpressionAttributeNames={'#ts': 'timestamp'},
+                ExpressionAttributeValues={':ts': item['timestamp']}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+    return len(newest)
+
+def apply_rollup(series, bucket, partition, contributions):
+    """Add one source partition's contributions to a rollup item, exactly once
+
+    The item keeps the last applied stream sequence number of each partition
+    that feeds it (seq#<partition>; sequence numbers only order records within
+    one partition). The ADD only goes through if every record being added is
+    newer than that, so a retried stream batch does not count the same records
+    twice. If the item is already past some of them, only the newer ones are added.
+
+    min/max are written after the ADD, from every contribution rather than only
+    the pending ones, so a retry also finishes min/max that an attempt which
+    failed after its ADD left unwritten (setting them again is harmless).
+    """
+    seq_name = f'seq#{partition}'
+    extremes = combine_contributions([contribution for _, contribution in contributions])
+    applied = None
+    while True:
+        pending = [(sequence_number, contribution) for sequence_number, contribution in contributions
+                   if applied is None or sequence_number > applied]
+        if not pending:
+            break
+        totals = combine_contributions([contribution for _, contribution in pending])
+        counters = [name for name in totals if not name.endswith(('_min', '_max'))]
+        names = {f'#a{i}': name for i, name in enumerate(counters)}
+        names['#seq'] = seq_name
+        values = {f':a{i}': totals[name] for i, name in enumerate(counters)}
+        values[':workspace'] = series.rsplit('#', 1)[0]
+        values[':first'] = min(sequence_number for sequence_number, _ in pending)
+        values[':seq'] = max(sequence_number for sequence_number, _ in pending)
+        try:
+            stored = rollup_table.update_item(
+                Key={'series': series, 'bucket': bucket},
+                UpdateExpression='SET workspace_id = :workspace, #seq = :seq ADD '
+                                 + ', '.join(f'#a{i} :a{i}' for i in range(len(counters))),
+                ConditionExpression='attribute_not_exists(#seq) OR #seq < :first',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ReturnValues='ALL_NEW'
+            )['Attributes']
+            break
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        # Some of these records were applied by an earlier attempt at this batch
+        stored = rollup_table.get_item(Key={'series': series, 'bucket': bucket}, ConsistentRead=True).get('Item', {})
+        applied = stored.get(seq_name)
+
+    # DynamoDB has no atomic min/max, so use a conditional SET that loses cleanly to a concurrent better value
+    for name in (n for n in extremes if n.endswith(('_min', '_max'))):
+        value = extremes[name]
+        comparison = '>' if name.endswith('_min') else '<'
+        if name in stored and not (value < stored[name] if comparison == '>' else value > stored[name]):
+            continue
+        try:
+            rollup_table.update_item(
+                Key={'series': series, 'bucket': bucket},
+                UpdateExpression='SET #b = :v',
+                ConditionExpression=f'attribute_not_exists(#b) OR #b {comparison} :v',
+                ExpressionAttributeNames={'#b': name},
+                ExpressionAttributeValues={':v': value}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+def process_telemetry_stream(event):
+    """Update latest-state and rollup items from a stream batch
+
+    Failures are reported per record (the event source mapping uses
+    ReportBatchItemFailures), so Lambda retries from the oldest failed record
+    instead of the whole batch. Rollup updates are idempotent, so records
+    after it that were already applied are skipped on the retry.
+    """
+    records = stream_records(event)
+    failed = []
+    try:
+        latest = update_latest_state([item for _, _, item in records])
+    except Exception as e:
+        print(f"Error updating latest telemetry state: {e}")
+        latest = 0
+        failed.append(stream_sequence(event['Records'][0]))
+
+    rollups = accumulate_rollups(records)
+    for (series, bucket, partition), contributions in rollups.items():
+        try:
+            apply_rollup(series, bucket, partition, contributions)
+        except Exception as e:
+            print(f"Error updating rollup {series} {bucket}: {e}")
+            failed.append(min(sequence_number for sequence_number, _ in contributions))
+
+    print(f"Updated {latest} latest-state and {len(rollups)} rollup items from {len(event['Records'])} stream records"
+          + (f", {len(failed)} failed" if failed else ""))
+    if not failed:
+        return {'batchItemFailures': []}
+    oldest = min(failed)
+    # Report the record's own SequenceNumber, not the padded form used for comparisons
+    identifier = next(record['dynamodb']['SequenceNumber'] for record in event['Records']
+                      if stream_sequence(record) == oldest)
+    return {'batchItemFailures': [{'itemIdentifier': identifier}]}
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - On-Device Rolling Aggregation
+Summarises raw telemetry samples into fixed 1- or 5-minute windows so a
+device can publish one aggregate instead of every 10-second sample.
+Samples are held in fixed-size `array` ring buffers, so memory use does
+not grow with uptime.
+"""
+import datetime
+import math
+from array import array
+
+AGGREGATE_FIELDS = ("temperature", "humidity")
+DEFAULT_EWMA_ALPHA = 0.3
+
+
+class RingBuffer:
+    """Fixed-capacity ring of floats backed by array('d')"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = array("d", bytes(8 * capacity))
+        self._next = 0
+        self._count = 0
+
+    def append(self, value):
+        self._data[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def values(self):
+        """Contents oldest first"""
+        if self._count < self.capacity:
+            return self._data[:self._count]
+        return self._data[self._next:] + self._data[:self._next]
+
+    def __len__(self):
+        return self._count
+
+
+def slope_per_minute(times, values):
+    """Least-squares slope of values over times (seconds), in units per minute"""
+    n = len(times)
+    if n < 2:
+        return 0.0
+    mean_t = sum(times) / n
+    mean_v = sum(values) / n
+    var_t = sum((t - mean_t) ** 2 for t in times)
+    if var_t == 0:
+        return 0.0
+    cov = sum((t - mean_t) * (v - mean_v) for t, v in zip(times, values))
+    return cov / var_t * 60.0
+
+
+class WindowAggregator:
+    """Aggregates samples into wall-clock aligned windows of `window` seconds
+
+    add(sample) takes a read_sensors() telemetry dict and returns the
+    aggregate of the previous window once a sample lands in a new one.
+    The aggregate keeps the raw payload's fields (`temperature`/`humidity`
+    are window means, `occupied`/`fan_state` the latest state) so the
+    existing table and dashboard keep working, and adds min/max/EWMA/slope,
+    occupancy duty cycle and fan-on seconds.
+    """
+
+    def __init__(self, window=60, sample_interval=10, ewma_alpha=DEFAULT_EWMA_ALPHA):
+        self.window = window
+        self.ewma_alpha = ewma_alpha
+        # Room for extra samples triggered by occupancy changes
+        capacity = max(4, 2 * math.ceil(window / sample_interval))
+        self._times = RingBuffer(capacity)
+        self._values = {field: RingBuffer(capacity) for field in AGGREGATE_FIELDS}
+        self._ewma = {}  # carried across windows
+        self._window_start = None
+        self._samples = 0
+        self._last = None  # (epoch seconds, sample)
+        self._occupied_seconds = 0.0
+        self._fan_seconds = 0.0
+
+    def add(self, sample):
+        t = datetime.datetime.fromisoformat(sample["timestamp"]).timestamp()
+        window_start = t - t % self.window
+        aggregate = None
+        if self._window_start is None:
+            self._window_start = window_start
+        elif window_start > self._window_start:
+            # Credit the time up to the boundary to the closing window, the rest to the new one
+            boundary = self._window_start + self.window
+            self._accumulate(boundary)
+            aggregate = self._emit(boundary)
+            self._window_start = window_start
+            self._last = (max(window_start, self._last[0]), self._last[1])
+        self._accumulate(t)
+        self._last = (t, sample)
+
+        self._samples += 1
+        self._times.append(t - self._window_start)
+        for field in AGGREGATE_FIELDS:
+            value = float(sample[field])
+            self._values[field].append(value)
+            previous = self._ewma.get(field)
+            self._ewma[field] = value if previous is None else previous + self.ewma_alpha * (value - previous)
+        return aggregate
+
+    def _accumulate(self, until):
+        """Add occupied/fan-on time since the last sample, assuming state held until `until`"""
+        if self._last is None:
+            return
+        since, sample = self._last
+        elapsed = max(0.0, until - since)
+        if sample.get("occupied"):
+            self._occupied_seconds += elapsed
+        if sample.get("fan_state"):
+            self._fan_seconds += elapsed
+
+    def flush(self):
+        """Aggregate of the current partial window (e.g. at shutdown), or None"""
+        if not self._samples:
+            return None
+        self._accumulate(self._last[0])
+        return self._emit(self._last[0])
+
+    def _emit(self, end):
+        latest = self._last[1]
+        times = self._times.values()
+        elapsed = max(end - self._window_start, 1e-9)
+        aggregate = {
+            "workspace_id": latest["workspace_id"],
+            "timestamp": datetime.datetime.fromtimestamp(self._window_start).isoformat(),
+            "window_seconds": self.window,
+            "samples": self._samples,
+            "occupied": latest["occupied"],
+            "fan_state": latest["fan_state"],
+            "occupancy_duty": round(min(1.0, self._occupied_seconds / elapsed), 3),
+            "fan_on_seconds": round(self._fan_seconds, 1),
+        }
+        for field in AGGREGATE_FIELDS:
+            values = self._values[field].values()
+            aggregate[field] = round(sum(values) / len(values), 1)
+            aggregate[f"{field}_min"] = round(min(values), 1)
+            aggregate[f"{field}_max"] = round(max(values), 1)
+            aggregate[f"{field}_ewma"] = round(self._ewma[field], 2)
+            aggregate[f"{field}_slope"] = round(slope_per_minute(times, values), 3)  # per minute
+
+        self._samples = 0
+        self._occupied_seconds = 0.0
+        self._fan_seconds = 0.0
+        self._times.clear()
+        for buffer in self._values.values():
+            buffer.clear()
+        return aggregate
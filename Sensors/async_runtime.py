@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - asyncio Device Runtime
+Runs sampling, occupancy-triggered samples, publishing and shadow handling
+as independent tasks so a slow one never holds up the others
+"""
+import asyncio
+import collections
+import concurrent.futures
+import time
+import traceback
+
+DEFAULT_PUBLISH_BACKLOG = 10  # samples waiting for the publisher task
+
+class LoopStats:
+    """Rolling timing measurements (seconds) printed as p50/p95/max every `report_every` seconds
+
+    With a MetricsRegistry, every timing also goes into a `pczs_<metric>_seconds`
+    histogram and every count into a `pczs_<metric>_total` counter.
+    """
+
+    def __init__(self, name, report_every=300, window=1000, metrics=None):
+        self.name = name
+        self.report_every = report_every
+        self.window = window
+        self.metrics = metrics
+        self.counts = collections.Counter()
+        self._values = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        self._last_report = time.monotonic()
+
+    def record(self, metric, value):
+        self._values[metric].append(value)
+        if self.metrics is not None:
+            self.metrics.histogram(f"pczs_{metric}_seconds", f"{metric} ({self.name})").observe(value)
+
+    def count(self, metric, amount=1):
+        self.counts[metric] += amount
+        if self.metrics is not None:
+            self.metrics.counter(f"pczs_{metric}_total", f"{metric} ({self.name})").inc(amount)
+
+    def summary(self):
+        result = {}
+        for metric, values in self._values.items():
+            if not values:
+                continue
+            ordered = sorted(values)
+            result[metric] = {
+                "count": len(ordered),
+                "p50": ordered[len(ordered) // 2],
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max": ordered[-1],
+            }
+        return result
+
+    def maybe_report(self):
+        if time.monotonic() - self._last_report < self.report_every:
+            return
+        self._last_report = time.monotonic()
+        for metric, s in sorted(self.summary().items()):
+            print(f"[{self.name}] {metric}: n={s['count']} p50={s['p50'] * 1000:.1f}ms "
+                  f"p95={s['p95'] * 1000:.1f}ms max={s['max'] * 1000:.1f}ms")
+
+
+def wrap_crt_future(future):
+    """Bridge an awscrt (concurrent.futures) future into the running asyncio loop"""
+    return asyncio.wrap_future(future)
+
+
+async def wait_crt_ack(future, timeout):
+    """Await a PUBACK future for at most `timeout` seconds (raises asyncio.TimeoutError)
+
+    awscrt holds QoS1 publishes until it reconnects, so an unbounded await
+    would stall its caller for the whole outage. The publish itself is left
+    alone on timeout; only the wait is given up.
+    """
+    wrapped = wrap_crt_future(future)
+    # Retrieve a late failure so asyncio doesn't log it as never retrieved
+    wrapped.add_done_callback(lambda f: f.cancelled() or f.exception())
+    await asyncio.wait_for(asyncio.shield(wrapped), timeout)
+
+
+class DeviceRuntime:
+    """asyncio scheduler for a sensor script
+
+    The script supplies these hooks:
+        sample()             blocking; reads sensors and returns (telemetry, shadow)
+        record(t)            fast; persists telemetry (TelemetryQueue) as soon as
+                             it is sampled, before anything waits on the network
+        publish(t, s)        coroutine; publishes what else a sample needs (the
+                             shadow update) and should bound its own waits
+        handle_shadow(p, t)  blocking but fast; applies a shadow delta payload
+                             received at monotonic time t
+    Blocking sensor reads run on their own thread so they can't delay publishing
+    or a fan decision made from a shadow delta. Display updates are handled by
+    DisplayWorker and never touch the event loop. At most `max_publish_backlog`
+    samples wait for the publisher; beyond that the oldest is dropped, since its
+    telemetry is already recorded and a newer shadow state supersedes it.
+    """
+
+    def __init__(self, sample, publish, handle_shadow=None, sample_interval=10, stats=None, record=None,
+                 max_publish_backlog=DEFAULT_PUBLISH_BACKLOG):
+        self.sample = sample
+        self.record = record
+        self.publish = publish
+        self.handle_shadow = handle_shadow
+        self.sample_interval = sample_interval
+        self.max_publish_backlog = max_publish_backlog
+        self.stats = stats or LoopStats("async-runtime")
+        self.loop = None
+        self.sensor_executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="pczs-sensors")
+        self._sample_now = None
+        self._publish_queue = None
+        self._shadow_queue = None
+
+    def publish_backlog(self):
+        """Samples waiting for the publisher task"""
+        return self._publish_queue.qsize() if self._publish_queue is not None else 0
+
+    # Thread-safe entry points for GPIO and awscrt callbacks
+
+    def trigger_sample(self):
+        """Take a sample right away (e.g. on an occupancy transition)"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._sample_now.set)
+
+    def submit_shadow_delta(self, payload):
+        """Hand a shadow delta from the MQTT thread to the shadow task"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._shadow_queue.put_nowait, (time.monotonic(), payload))
+
+    # Tasks
+
+    async def _sampler(self):
+        next_tick = self.loop.time()
+        while True:
+            started = self.loop.time()
+            self.stats.record("sample_jitter", abs(started - next_tick))
+            try:
+                telemetry, shadow = await self.loop.run_in_executor(self.sensor_executor, self.sample)
+                self.stats.record("sample_duration", self.loop.time() - started)
+                if self.record is not None:
+                    self.record(telemetry)
+                if self._publish_queue.full():
+                    self._publish_queue.get_nowait()
+                    self.stats.count("publish_backlog_dropped")
+                self._publish_queue.put_nowait((telemetry, shadow))
+            except Exception as e:
+                self.stats.count("sample_errors")
+                print(f"Error reading sensors: {e}")
+                traceback.print_exc()
+            self.stats.maybe_report()
+
+            # Fixed-rate schedule; an occupancy change pulls the next sample forward
+            next_tick += self.sample_interval
+            if next_tick < self.loop.time():
+                next_tick = self.loop.time()
+            try:
+                await asyncio.wait_for(self._sample_now.wait(), timeout=next_tick - self.loop.time())
+                next_tick = self.loop.time()
+            except asyncio.TimeoutError:
+                pass
+            self._sample_now.clear()
+
+    async def _publisher(self):
+        while True:
+            telemetry, shadow = await self._publish_queue.get()
+            started = self.loop.time()
+            try:
+                await self.publish(telemetry, shadow)
+                self.stats.record("publish_latency", self.loop.time() - started)
+            except Exception as e:
+                self.stats.count("publish_errors")
+                print(f"Error publishing telemetry: {e}")
+
+    async def _shadow_handler(self):
+        while True:
+            received, payload = await self._shadow_queue.get()
+            try:
+                self.handle_shadow(payload, received)
+            except Exception as e:
+                self.stats.count("shadow_errors")
+                print(f"Error handling delta: {e}")
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self._sample_now = asyncio.Event()
+        self._publish_queue = asyncio.Queue(maxsize=self.max_publish_backlog)
+        self._shadow_queue = asyncio.Queue()
+        tasks = [
+            asyncio.create_task(self._sampler(), name="sampler"),
+            asyncio.create_task(self._publisher(), name="publisher"),
+        ]
+        if self.handle_shadow is not None:
+            tasks.append(asyncio.create_task(self._shadow_handler(), name="shadow"))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.sensor_executor.shutdown(wait=False)
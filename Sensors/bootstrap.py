@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Device Boot Helpers
+Stable MQTT client IDs for persistent sessions, concurrent subscribes, and a
+boot timer that reports how long the device took to get its first message out
+"""
+import importlib
+import socket
+import threading
+import time
+
+PROCESS_STARTED = time.monotonic()  # import this module first so heavy imports are counted
+
+
+def preload(*modules):
+    """Import `modules` on a background thread
+
+    Most of an import's time on a Pi is reading the SD card, so this overlaps
+    with the main thread's own imports. A later `import` of the same module
+    just waits for the background one to finish.
+    """
+    def run():
+        for name in modules:
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                print(f"Preload of {name} failed: {e}")
+
+    thread = threading.Thread(target=run, name="pczs-preload", daemon=True)
+    thread.start()
+    return thread
+
+
+def stable_client_id(prefix):
+    """Client ID that survives restarts, so the broker can keep our session
+
+    Uses /etc/machine-id (unique per Pi image), falling back to the hostname.
+    """
+    try:
+        with open("/etc/machine-id") as f:
+            machine_id = f.read().strip()[:12]
+    except OSError:
+        machine_id = ""
+    return f"{prefix}-{machine_id or socket.gethostname()}"
+
+
+def subscribe_all(connection, qos, subscriptions, timeout=10.0):
+    """Send every SUBSCRIBE at once and wait for all SUBACKs together
+
+    `subscriptions` is a list of (topic, callback). A callback of None leaves the
+    topic's messages to the connection's on_message() handler. Returns the
+    SUBACK results in order.
+    """
+    futures = []
+    for topic, callback in subscriptions:
+        print(f"Subscribing to {topic}...")
+        future, _ = connection.subscribe(topic=topic, qos=qos, callback=callback)
+        futures.append(future)
+    return [future.result(timeout) for future in futures]
+
+
+def connect_in_background(connection, on_connected, retry_initial=1.0, retry_max=60.0):
+    """Keep trying the first connect on a daemon thread instead of blocking boot
+
+    awscrt only reconnects by itself once a connection has been up, so a device
+    that boots offline would otherwise never connect. `on_connected(result)` runs
+    on the connect thread after the first CONNACK. Returns the thread.
+    """
+    def run():
+        delay = retry_initial
+        while True:
+            try:
+                result = connection.connect().result()
+                break
+            except Exception as e:
+                print(f"Connect failed ({e}); retrying in {delay:.0f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, retry_max)
+        try:
+            on_connected(result)
+        except Exception as e:
+            print(f"Error after connecting: {e}")
+
+    thread = threading.Thread(target=run, name="pczs-connect", daemon=True)
+    thread.start()
+    return thread
+
+
+class BootTimer:
+    """Records the time of each boot stage relative to process start"""
+
+    def __init__(self, started=PROCESS_STARTED):
+        self.started = started
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def mark(self, stage):
+        """Record `stage` the first time it happens; returns seconds since start"""
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = time.monotonic() - self.started
+            return self.stages[stage]
+
+    def watch_first_publish(self, future):
+        """Mark `first_publish` (and print the boot report) when the first PUBACK arrives"""
+        if "first_publish" in self.stages:
+            return future
+
+        def on_done(f):
+            if f.exception() is None and "first_publish" not in self.stages:
+                self.mark("first_publish")
+                self.report()
+
+        future.add_done_callback(on_done)
+        return future
+
+    def report(self):
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: item[1])
+        print("Boot timings: " + ", ".join(f"{stage}={seconds:.2f}s" for stage, seconds in stages))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Background DHT22 Sampler
+Reads the DHT22 on its own thread, retrying failed reads with backoff, and
+serves a median-filtered value from a small ring buffer of good samples
+"""
+import collections
+import statistics
+import threading
+import time
+
+DHT22_MIN_INTERVAL = 2.0  # the sensor can't be read faster than this
+DEFAULT_INTERVAL = 5.0
+DEFAULT_MAX_BACKOFF = 30.0
+DEFAULT_BUFFER_SIZE = 5
+DEFAULT_MAX_AGE = 60.0
+
+# Readings outside these ranges are glitches, not weather
+TEMP_RANGE = (-40.0, 80.0)
+HUMIDITY_RANGE = (0.0, 100.0)
+
+
+class DHT22Sampler(threading.Thread):
+    """Owns the DHT22: nothing else should touch `dht_sensor` once this is started"""
+
+    def __init__(self, dht_sensor, interval=DEFAULT_INTERVAL, max_backoff=DEFAULT_MAX_BACKOFF,
+                 buffer_size=DEFAULT_BUFFER_SIZE, max_age=DEFAULT_MAX_AGE):
+        super().__init__(name="pczs-dht22", daemon=True)
+        self.dht_sensor = dht_sensor
+        self.interval = max(interval, DHT22_MIN_INTERVAL)
+        self.max_backoff = max_backoff
+        self.max_age = max_age
+        self.reads = 0
+        self.failures = 0
+        self._samples = collections.deque(maxlen=buffer_size)  # (monotonic time, temp, humidity)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _read_once(self):
+        try:
+            temperature = self.dht_sensor.temperature
+            humidity = self.dht_sensor.humidity
+        except RuntimeError as e:
+            # Checksum/timing errors are routine for the DHT22, just retry
+            print(f"DHT22 reading error: {e}")
+            return None
+        if temperature is None or humidity is None:
+            return None
+        if not (TEMP_RANGE[0] <= temperature <= TEMP_RANGE[1]
+                and HUMIDITY_RANGE[0] <= humidity <= HUMIDITY_RANGE[1]):
+            print(f"DHT22 reading out of range: {temperature}°C, {humidity}%")
+            return None
+        return temperature, humidity
+
+    def run(self):
+        delay = 0.0
+        backoff = DHT22_MIN_INTERVAL
+        while not self._stopped.wait(delay):
+            self.reads += 1
+            try:
+                reading = self._read_once()
+            except Exception as e:
+                print(f"Unexpected DHT22 error: {e}")
+                reading = None
+            if reading is None:
+                self.failures += 1
+                delay = backoff
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            with self._lock:
+                self._samples.append((time.monotonic(), reading[0], reading[1]))
+            delay = self.interval
+            backoff = DHT22_MIN_INTERVAL
+
+    def latest(self):
+        """Return (temperature, humidity, age_seconds) filtered over recent good samples
+
+        Returns (None, None, None) when there is no sample younger than max_age.
+        """
+        now = time.monotonic()
+        with self._lock:
+            recent = [s for s in self._samples if now - s[0] <= self.max_age]
+        if not recent:
+            return None, None, None
+        temperature = round(statistics.median(s[1] for s in recent), 1)
+        humidity = round(statistics.median(s[2] for s in recent), 1)
+        return temperature, humidity, now - recent[-1][0]
+
+    def stop(self):
+        self._stopped.set()
+        if self.is_alive():
+            self.join(timeout=5.0)
+        try:
+            self.dht_sensor.exit()
+        except Exception:
+            pass
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - SenseHat Display Worker
+Runs LED matrix updates on a dedicated thread so callers (including MQTT
+callbacks) never wait for scrolling text or letter flashes
+"""
+import threading
+import time
+
+# Priorities (lower runs first)
+PRIORITY_ALERT = 0
+PRIORITY_NOTIFY = 1
+PRIORITY_STATUS = 2
+
+DEFAULT_MAX_PENDING = 16
+DEFAULT_ANIMATION_INTERVAL = 5.0  # min seconds between repeats of the same animation
+
+
+class DisplayWorker(threading.Thread):
+    """Prioritized, coalescing command queue in front of the SenseHat LED matrix
+
+    Commands with the same key replace each other while pending, so only the
+    latest comfort-status colour is ever drawn. Repeats of the same animation
+    within `animation_interval` are dropped, and the current status colour is
+    restored after each animation.
+    """
+
+    def __init__(self, sense, max_pending=DEFAULT_MAX_PENDING,
+                 animation_interval=DEFAULT_ANIMATION_INTERVAL, metrics=None):
+        super().__init__(name="pczs-display", daemon=True)
+        self.sense = sense
+        self.metrics = metrics
+        self.max_pending = max_pending
+        self.animation_interval = animation_interval
+        self.dropped = 0
+        self._pending = {}  # key -> (priority, seq, func, args)
+        self._last_run = {}  # animation key -> monotonic time
+        self._status = None
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+
+    # Non-blocking API
+
+    def status(self, colour):
+        """Fill the matrix with a comfort-status colour (None turns it off)"""
+        self._submit("status", PRIORITY_STATUS, self._draw_status, (colour,))
+
+    def flash(self, letter, colour, duration=0.5):
+        """Briefly show a single letter; the same letter in another colour is a different flash"""
+        self._submit(f"flash:{letter}:{colour}", PRIORITY_NOTIFY, self._flash, (letter, colour, duration), animation=True)
+
+    def message(self, text, colour, scroll_speed=0.05, alert=False):
+        """Scroll a text message across the matrix"""
+        priority = PRIORITY_ALERT if alert else PRIORITY_NOTIFY
+        self._submit(f"message:{text}", priority, self._message, (text, colour, scroll_speed), animation=True)
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    def stop(self, timeout=2.0):
+        with self._cond:
+            self._stopped = True
+            self._pending.clear()
+            self._cond.notify()
+        if self.is_alive():
+            self.join(timeout)
+
+    def _submit(self, key, priority, func, args, animation=False):
+        with self._cond:
+            if animation:
+                last = self._last_run.get(key)
+                if key in self._pending or (last is not None and time.monotonic() - last < self.animation_interval):
+                    self.dropped += 1
+                    return
+            elif key in self._pending:
+                self.dropped += 1  # superseded by this newer command
+            if key not in self._pending and len(self._pending) >= self.max_pending:
+                # Make room by dropping the least important, oldest command
+                victim = max(self._pending, key=lambda k: (self._pending[k][0], -self._pending[k][1]))
+                if self._pending[victim][0] < priority:
+                    self.dropped += 1
+                    return
+                del self._pending[victim]
+                self.dropped += 1
+            self._seq += 1
+            self._pending[key] = (priority, self._seq, func, args)
+            self._cond.notify()
+
+    # Worker thread
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                key = min(self._pending, key=lambda k: self._pending[k][:2])
+                _, _, func, args = self._pending.pop(key)
+                if key != "status":
+                    self._last_run[key] = time.monotonic()
+            started = time.perf_counter()
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"Display error: {e}")
+            if self.metrics is not None:
+                # Time spent driving the LEDs, i.e. what callers used to block on
+                self.metrics.histogram("pczs_display_seconds", "SenseHat display command time",
+                                       command=key.split(":")[0]).observe(time.perf_counter() - started)
+
+    def _draw_status(self, colour):
+        self._status = colour
+        if colour is None:
+            self.sense.clear()
+        else:
+            self.sense.clear(colour)
+
+    def _restore_status(self):
+        if self._status is None:
+            self.sense.clear()
+        else:
+            self.sense.clear(self._status)
+
+    def _flash(self, letter, colour, duration):
+        self.sense.show_letter(letter, colour)
+        time.sleep(duration)
+        self._restore_status()
+
+    def _message(self, text, colour, scroll_speed):
+        self.sense.show_message(text, text_colour=colour, scroll_speed=scroll_speed)
+        self._restore_status()
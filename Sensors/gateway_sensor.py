@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Gateway Mode
+Runs several workspaces' sensors from one Raspberry Pi over a single MQTT
+connection. Each workspace has its own IoT thing, shadow and state object;
+shadow messages are routed to the right workspace by thing name.
+"""
+import json
+import datetime
+import uuid
+import threading
+import traceback
+import RPi.GPIO as GPIO
+try:
+    import board
+    import adafruit_dht
+    DHT_AVAILABLE = True
+except ImportError:
+    print("Warning: adafruit_dht module not available, DHT22 workspaces will not publish telemetry")
+    DHT_AVAILABLE = False
+from awscrt import io, mqtt
+from awsiot import mqtt_connection_builder
+from bootstrap import connect_in_background
+from telemetry_queue import TelemetryQueue, QueueDrainer
+from telemetry_batch import TelemetryBatcher
+from shadow_reporter import ShadowReporter
+from occupancy import OccupancyMonitor
+from sensor_drivers import SensorScheduler, DHT22Driver, PIRDriver, MockDriver
+from dht_sampler import DHT22Sampler
+
+# Configuration
+GATEWAY_ID = "gateway_1"
+ENDPOINT = "a2ao1owrs8g0lu-ats.iot.us-east-2.amazonaws.com"
+CLIENT_ID = f"pczs-{GATEWAY_ID}-{uuid.uuid4().hex[:8]}"
+CERT_PATH = "/home/smartsys/pczs/cert/"
+CERT_FILE = CERT_PATH + "certificate.pem.crt"
+KEY_FILE = CERT_PATH + "private.pem.key"
+ROOT_CA = CERT_PATH + "AmazonRootCA1.pem"
+QUEUE_PATH = f"/home/smartsys/pczs/queue/telemetry-{GATEWAY_ID}.db"
+QUEUE_MAX_BYTES = 200 * 1024 * 1024  # disk budget for unsent telemetry (all workspaces)
+QUEUE_DRAIN_RATE = 50  # messages per second when catching up after an outage
+TELEMETRY_BATCH_SIZE = 1  # samples per telemetry message; >1 enables batch mode
+TELEMETRY_BATCH_SECONDS = 300  # flush a partial batch after this long
+SHADOW_DEADBANDS = {"temperature": 0.2, "humidity": 1.0}  # min change worth reporting
+SHADOW_HEARTBEAT = 900  # seconds between full shadow reports
+SAMPLE_INTERVAL = 10  # seconds between telemetry samples
+OCCUPANCY_TIMEOUT = 300  # seconds
+PIR_BOUNCE_MS = 200  # debounce window for PIR edges
+
+# Shadow topics for all things handled by this gateway; "+" is the thing name
+SHADOW_DELTA_FILTER = "$aws/things/+/shadow/update/delta"
+SHADOW_ACCEPTED_FILTER = "$aws/things/+/shadow/update/accepted"
+
+# Workspaces hosted by this gateway. The certificate's IoT policy must allow
+# this client to update every listed thing's shadow.
+WORKSPACES = [
+    {"workspace_id": "workspace_1", "thing_name": "PCZS-workspace_1", "pir_pin": 17, "dht_pin": "D4"},
+    {"workspace_id": "workspace_2", "thing_name": "PCZS-workspace_2", "pir_pin": 27},
+    {"workspace_id": "workspace_3", "thing_name": "PCZS-workspace_3", "pir_pin": 5},
+]
+
+DEFAULT_COMFORT_SETTINGS = {
+    "preferred_temp": 23.0,
+    "preferred_humidity": 50.0,
+    "temp_threshold": 1.0,
+    "humidity_threshold": 10.0,
+}
+MOCK_ENVIRONMENT = {"temperature": 23.5, "humidity": 45.0}
+
+
+class Workspace:
+    """Everything one workspace pipeline needs, instead of module globals"""
+
+    def __init__(self, workspace_id, thing_name, pir_pin=None, dht_pin=None):
+        self.workspace_id = workspace_id
+        self.thing_name = thing_name
+        self.telemetry_topic = f"pczs/{workspace_id}/telemetry"
+        self.telemetry_batch_topic = f"pczs/{workspace_id}/telemetry/batch"
+        self.shadow_update_topic = f"$aws/things/{thing_name}/shadow/update"
+        self.comfort_settings = dict(DEFAULT_COMFORT_SETTINGS)
+        self.fan_state = False
+        self.last_temperature = None
+        self.shadow_reporter = ShadowReporter(SHADOW_DEADBANDS, SHADOW_HEARTBEAT)
+        self.batcher = TelemetryBatcher(TELEMETRY_BATCH_SIZE, TELEMETRY_BATCH_SECONDS)
+        self.lock = threading.Lock()
+
+        self.sensors = SensorScheduler(("temperature", "humidity", "occupied"))
+        self.dht_sampler = None
+        if dht_pin is not None and DHT_AVAILABLE:
+            try:
+                dht_sensor = adafruit_dht.DHT22(getattr(board, dht_pin))
+                self.dht_sampler = DHT22Sampler(dht_sensor)
+                self.sensors.register(DHT22Driver(self.dht_sampler), priority=0)
+            except Exception as e:
+                print(f"[{workspace_id}] Could not initialize DHT22 on {dht_pin}: {e}")
+        elif dht_pin is None:
+            # Only workspaces without a temperature sensor get fixed values; a failed
+            # DHT22 must not be papered over with data that drives the fan
+            self.sensors.register(MockDriver(MOCK_ENVIRONMENT), priority=1)
+
+        self.occupancy_monitor = None
+        if pir_pin is not None:
+            GPIO.setup(pir_pin, GPIO.IN)
+            self.occupancy_monitor = OccupancyMonitor(GPIO, pir_pin, OCCUPANCY_TIMEOUT,
+                                                      on_change=self.on_occupancy_change,
+                                                      bouncetime=PIR_BOUNCE_MS)
+            self.sensors.register(PIRDriver(self.occupancy_monitor))
+
+    def start(self):
+        if self.occupancy_monitor is not None:
+            self.occupancy_monitor.start()
+        if self.dht_sampler is not None:
+            self.dht_sampler.start()
+        self.sensors.refresh()
+        if self.dht_sampler is not None:
+            self.sensors.start()
+
+    def stop(self):
+        if self.occupancy_monitor is not None:
+            self.occupancy_monitor.stop()
+        self.sensors.stop()
+
+    def on_occupancy_change(self, occupied):
+        # Runs on the PIR interrupt/timer thread; wake the main loop to publish now
+        sample_now.set()
+
+    def control_fan(self, temp, occupied):
+        pref_temp = self.comfort_settings["preferred_temp"]
+        temp_threshold = self.comfort_settings["temp_threshold"]
+        fan_on = occupied and temp > (pref_temp + temp_threshold)
+        if fan_on != self.fan_state:
+            print(f"[{self.workspace_id}] Fan control: Turning fan {'ON' if fan_on else 'OFF'}")
+            self.fan_state = fan_on
+        return self.fan_state
+
+    def read_sensors(self):
+        """Telemetry and shadow payloads, or None while there is no fresh temperature/humidity reading"""
+        with self.lock:
+            readings = self.sensors.snapshot()
+            temperature = readings["temperature"]
+            humidity = readings["humidity"]
+            _, age, source = self.sensors.latest("temperature")
+            if temperature is None or humidity is None or (source == DHT22Driver.name and age > DHT22Driver.max_age):
+                return None
+            is_occupied = bool(readings["occupied"])
+            self.last_temperature = temperature
+            fan_on = self.control_fan(temperature, is_occupied)
+        timestamp = datetime.datetime.now().isoformat()
+
+        payload = {
+            "workspace_id": self.workspace_id,
+            "timestamp": timestamp,
+            "temperature": temperature,
+            "humidity": humidity,
+            "occupied": is_occupied,
+            "fan_state": fan_on
+        }
+
+        shadow_payload = {
+            "state": {
+                "reported": {
+                    "temperature": temperature,
+                    "humidity": humidity,
+                    "occupied": is_occupied,
+                    "fan_state": fan_on
+                }
+            }
+        }
+
+        return payload, shadow_payload
+
+    def apply_delta(self, delta):
+        """Apply desired comfort settings and return the new reported settings"""
+        with self.lock:
+            self.comfort_settings.update({k: delta[k] for k in self.comfort_settings if k in delta})
+            if self.last_temperature is not None:
+                occupied = self.occupancy_monitor is not None and self.occupancy_monitor.occupied
+                self.control_fan(self.last_temperature, occupied)
+            print(f"[{self.workspace_id}] Updated comfort settings: {self.comfort_settings}")
+            return dict(self.comfort_settings)
+
+
+# State
+sample_now = threading.Event()
+workspaces = {}  # thing name -> Workspace
+
+
+def thing_from_topic(topic):
+    # $aws/things/<thing>/shadow/update/...
+    parts = topic.split("/")
+    return parts[2] if len(parts) > 2 else None
+
+# Callback when connection is accidentally lost.
+def on_connection_interrupted(connection, error, **kwargs):
+    print(f"Connection interrupted: {error}")
+    queue_drainer.connection_down()
+
+# Callback when an interrupted connection is re-established.
+def on_connection_resumed(connection, return_code, session_present, **kwargs):
+    print(f"Connection resumed: {return_code}, session_present: {session_present}")
+    queue_drainer.connection_up(resumed=True)
+    for workspace in workspaces.values():
+        workspace.shadow_reporter.reset()
+
+def publish_queued(topic, payload):
+    """Publish a message taken from the telemetry queue and return its PUBACK future"""
+    future, _ = mqtt_connection.publish(
+        topic=topic,
+        payload=payload,
+        qos=mqtt.QoS.AT_LEAST_ONCE
+    )
+    return future
+
+def enqueue_telemetry(workspace, telemetry):
+    if TELEMETRY_BATCH_SIZE <= 1:
+        telemetry_queue.put(workspace.telemetry_topic, json.dumps(telemetry))
+        return
+    batch = workspace.batcher.add(telemetry)
+    if batch is not None:
+        telemetry_queue.put(workspace.telemetry_batch_topic, json.dumps(batch))
+
+def on_connected(connection):
+    """First CONNACK: start draining, subscribe, and report every workspace's settings"""
+    print("Connected to AWS IoT!")
+    queue_drainer.connection_up()
+
+    # Wildcard subscriptions; messages are routed to workspaces by thing name
+    print(f"Subscribing to {SHADOW_DELTA_FILTER} and {SHADOW_ACCEPTED_FILTER}...")
+    delta_subscribe_future, _ = mqtt_connection.subscribe(
+        topic=SHADOW_DELTA_FILTER,
+        qos=mqtt.QoS.AT_LEAST_ONCE,
+        callback=on_shadow_delta
+    )
+    accepted_subscribe_future, _ = mqtt_connection.subscribe(
+        topic=SHADOW_ACCEPTED_FILTER,
+        qos=mqtt.QoS.AT_LEAST_ONCE,
+        callback=on_shadow_accepted
+    )
+    delta_subscribe_future.result()
+    accepted_subscribe_future.result()
+
+    # Report initial comfort settings for every workspace
+    for workspace in workspaces.values():
+        mqtt_connection.publish(
+            topic=workspace.shadow_update_topic,
+            payload=json.dumps({"state": {"reported": workspace.comfort_settings}}),
+            qos=mqtt.QoS.AT_LEAST_ONCE
+        )
+
+# Callback for shadow deltas of any thing handled by this gateway
+def on_shadow_delta(topic, payload, dup, qos, retain, **kwargs):
+    workspace = workspaces.get(thing_from_topic(topic))
+    if workspace is None:
+        return
+    try:
+        delta = json.loads(payload.decode('utf-8')).get("state", {})
+        settings = workspace.apply_delta(delta)
+        mqtt_connection.publish(
+            topic=workspace.shadow_update_topic,
+            payload=json.dumps({"state": {"reported": settings}}),
+            qos=mqtt.QoS.AT_LEAST_ONCE
+        )
+    except Exception as e:
+        print(f"[{workspace.workspace_id}] Error handling delta: {e}")
+        traceback.print_exc()
+
+# Callback for accepted shadow updates of any thing handled by this gateway
+def on_shadow_accepted(topic, payload, dup, qos, retain, **kwargs):
+    workspace = workspaces.get(thing_from_topic(topic))
+    if workspace is not None:
+        workspace.shadow_reporter.on_accepted(payload)
+
+def main():
+    global mqtt_connection, telemetry_queue, queue_drainer
+
+    GPIO.setmode(GPIO.BCM)
+    for config in WORKSPACES:
+        workspace = Workspace(**config)
+        workspaces[workspace.thing_name] = workspace
+        workspace.start()
+    print(f"Gateway hosting {len(workspaces)} workspaces: {[w.workspace_id for w in workspaces.values()]}")
+
+    # One store-and-forward queue for every workspace's telemetry
+    telemetry_queue = TelemetryQueue(QUEUE_PATH, max_bytes=QUEUE_MAX_BYTES)
+    queue_drainer = QueueDrainer(telemetry_queue, publish_queued, rate=QUEUE_DRAIN_RATE)
+
+    try:
+        # Spin up resources
+        event_loop_group = io.EventLoopGroup(1)
+        host_resolver = io.DefaultHostResolver(event_loop_group)
+        client_bootstrap = io.ClientBootstrap(event_loop_group, host_resolver)
+
+        # A single MQTT connection is shared by all workspaces
+        mqtt_connection = mqtt_connection_builder.mtls_from_path(
+            endpoint=ENDPOINT,
+            cert_filepath=CERT_FILE,
+            pri_key_filepath=KEY_FILE,
+            ca_filepath=ROOT_CA,
+            client_bootstrap=client_bootstrap,
+            client_id=CLIENT_ID,
+            clean_session=True,
+            keep_alive_secs=30,
+            on_connection_interrupted=on_connection_interrupted,
+            on_connection_resumed=on_connection_resumed
+        )
+
+        # Drain as soon as we are connected; until then samples just wait on disk
+        queue_drainer.start()
+        print(f"Connecting to {ENDPOINT} with client ID '{CLIENT_ID}'...")
+        connect_in_background(mqtt_connection, on_connected)
+
+        # Main loop
+        print("Gateway Mode Running. Press Ctrl+C to exit.")
+        while True:
+            for workspace in workspaces.values():
+                sample = workspace.read_sensors()
+                if sample is None:
+                    print(f"[{workspace.workspace_id}] No fresh temperature reading, skipping this sample")
+                    continue
+                telemetry, shadow = sample
+                enqueue_telemetry(workspace, telemetry)
+
+                shadow_update = workspace.shadow_reporter.build_update(shadow["state"]["reported"])
+                if shadow_update is not None:
+                    mqtt_connection.publish(
+                        topic=workspace.shadow_update_topic,
+                        payload=json.dumps(shadow_update),
+                        qos=mqtt.QoS.AT_LEAST_ONCE
+                    )
+            print(f"Queued telemetry for {len(workspaces)} workspaces ({len(telemetry_queue)} pending)")
+
+            # Sleep until the next sample, or wake immediately on an occupancy change
+            sample_now.wait(SAMPLE_INTERVAL)
+            sample_now.clear()
+    except KeyboardInterrupt:
+        print("Exiting...")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        traceback.print_exc()
+    finally:
+        print("Disconnecting...")
+        for workspace in workspaces.values():
+            # Keep any partially filled batch on disk for the next run
+            batch = workspace.batcher.flush()
+            if batch is not None:
+                telemetry_queue.put(workspace.telemetry_batch_topic, json.dumps(batch))
+            workspace.stop()
+        queue_drainer.stop()
+        telemetry_queue.close()
+        try:
+            disconnect_future = mqtt_connection.disconnect()
+            disconnect_future.result()
+        except:
+            pass
+        GPIO.cleanup()
+        print("Cleanup complete")
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,16 @@
 PCZS: Personalized Comfort Zones System - Integrated Sensor Script
 Handles SenseHat, PIR, and DHT22 sensors and publishes to AWS IoT
 """
+from bootstrap import BootTimer, connect_in_background, preload, stable_client_id, subscribe_all
+# Load the AWS IoT SDK in the background while the sensor libraries import
+preload("awscrt.io", "awscrt.mqtt", "awsiot.mqtt_connection_builder")
 import time
+import asyncio
 import json
 import datetime
-import uuid
 import RPi.GPIO as GPIO
 import traceback
+import threading
 try:
     import board
     import adafruit_dht
@@ -17,32 +21,68 @@ except ImportError:
     print("Warning: adafruit_dht module not available, will use SenseHat only")
     DHT_AVAILABLE = False
 from sense_hat import SenseHat
-from awscrt import io, mqtt
-from awsiot import mqtt_connection_builder
-import boto3
-from botocore.exceptions import ClientError
+from telemetry_queue import TelemetryQueue, QueueDrainer
+from telemetry_batch import TelemetryBatcher
+from aggregation import WindowAggregator
+from wire_format import encode_telemetry
+from shadow_reporter import ShadowReporter
+from occupancy import OccupancyMonitor
+from async_runtime import DeviceRuntime, LoopStats, wait_crt_ack
+from metrics import MetricsRegistry, MetricsServer
+from publisher import InFlightPublisher, PublishDropped, POLICY_DROP_OLDEST
+from display_worker import DisplayWorker
+from sensor_drivers import SensorScheduler, DHT22Driver, SenseHatDriver
+from dht_sampler import DHT22Sampler
+from preference_cache import PreferenceCache, settings_version, comfort_values
 
 # Configuration
 THING_NAME = "PCZS"
 WORKSPACE_ID = "workspace_1"
 ENDPOINT = "a2ao1owrs8g0lu-ats.iot.us-east-2.amazonaws.com"
-CLIENT_ID = f"pczs-integrated-{uuid.uuid4().hex[:8]}"
+CLIENT_ID = stable_client_id("pczs-integrated")  # stable so the broker keeps our session
 CERT_PATH = "/home/smartsys/pczs/cert/"
 CERT_FILE = CERT_PATH + "certificate.pem.crt"
 KEY_FILE = CERT_PATH + "private.pem.key"
 ROOT_CA = CERT_PATH + "AmazonRootCA1.pem"
+QUEUE_PATH = "/home/smartsys/pczs/queue/telemetry-integrated.db"
+QUEUE_MAX_BYTES = 50 * 1024 * 1024  # disk budget for unsent telemetry
+QUEUE_DRAIN_RATE = 20  # messages per second when catching up after an outage
+PREFERENCE_CACHE_PATH = "/home/smartsys/pczs/preferences-integrated.json"
+TELEMETRY_BATCH_SIZE = 1  # samples per telemetry message; >1 enables batch mode
+TELEMETRY_BATCH_SECONDS = 300  # flush a partial batch after this long
+TELEMETRY_AGGREGATE_WINDOW = 0  # 60 or 300 publishes window aggregates instead of raw samples
+TELEMETRY_ENCODING = "json"  # "binary" sends raw samples as 14-byte packed messages
+SAMPLE_INTERVAL = 10  # seconds between telemetry samples
+USE_ASYNC_RUNTIME = True  # run sampling/publishing/shadow handling as asyncio tasks
+SHADOW_DEADBANDS = {"temperature": 0.2, "humidity": 1.0}  # min change worth reporting
+SHADOW_HEARTBEAT = 900  # seconds between full shadow reports
+PUBLISH_MAX_IN_FLIGHT = 32  # unacknowledged QoS1 publishes allowed at once
+PUBLISH_MAX_BYTES = 256 * 1024  # ...and their total payload size
+PUBLISH_WINDOW_POLICY = POLICY_DROP_OLDEST  # block or drop_oldest when the window is full
+METRICS_PORT = 9108  # local Prometheus endpoint (http://localhost:9108/metrics); 0 disables
+CLEAN_SESSION = False  # persistent session: subscriptions and QoS1 deltas survive restarts
 TELEMETRY_TOPIC = f"pczs/{WORKSPACE_ID}/telemetry"
+TELEMETRY_BATCH_TOPIC = f"pczs/{WORKSPACE_ID}/telemetry/batch"
+TELEMETRY_BINARY_TOPIC = f"pczs/{WORKSPACE_ID}/telemetry/bin"
 SHADOW_UPDATE_TOPIC = f"$aws/things/{THING_NAME}/shadow/update"
 SHADOW_UPDATE_ACCEPTED_TOPIC = f"$aws/things/{THING_NAME}/shadow/update/accepted"
 SHADOW_UPDATE_DELTA_TOPIC = f"$aws/things/{THING_NAME}/shadow/update/delta"
+SHADOW_GET_TOPIC = f"$aws/things/{THING_NAME}/shadow/get"
+SHADOW_GET_ACCEPTED_TOPIC = f"$aws/things/{THING_NAME}/shadow/get/accepted"
 
 # GPIO Pins
 PIR_PIN = 17
+PIR_BOUNCE_MS = 200  # debounce window for PIR edges
 DHT_PIN = 4  # GPIO4 for DHT22
+DHT_SAMPLE_INTERVAL = 5  # seconds between DHT22 reads (minimum 2)
+
+metrics = MetricsRegistry()
+json_encode_seconds = metrics.histogram("pczs_json_encode_seconds", "Telemetry JSON encode time")
 
 # Initialize SenseHat
 sense = SenseHat()
 sense.clear()
+display = DisplayWorker(sense, metrics=metrics)  # all LED updates after startup go through this thread
 
 # Initialize GPIO
 GPIO.setmode(GPIO.BCM)
@@ -59,6 +99,15 @@ if DHT_AVAILABLE:
 else:
     dht_sensor = None
 
+# Sensor drivers: DHT22 is preferred, the SenseHat is only read while it has no fresh value
+sensor_scheduler = SensorScheduler(("temperature", "humidity"), metrics=metrics)
+dht_sampler = None
+if dht_sensor is not None:
+    # The DHT22 is read on its own thread so the bit-banged protocol never blocks the loop
+    dht_sampler = DHT22Sampler(dht_sensor, interval=DHT_SAMPLE_INTERVAL)
+    sensor_scheduler.register(DHT22Driver(dht_sampler), priority=0)
+sensor_scheduler.register(SenseHatDriver(sense, temp_offset=8.0), priority=1)
+
 # Colors
 RED = (255, 0, 0)
 GREEN = (0, 255, 0)
@@ -67,10 +116,17 @@ YELLOW = (255, 255, 0)
 ORANGE = (255, 165, 0)
 
 # State
+shadow_reporter = ShadowReporter(SHADOW_DEADBANDS, SHADOW_HEARTBEAT)
 fan_state = False
 occupancy = False
 last_motion_time = 0
 OCCUPANCY_TIMEOUT = 300  # seconds
+occupancy_changed = threading.Event()
+last_temperature = None
+runtime = None  # DeviceRuntime when USE_ASYNC_RUNTIME is on
+loop_stats = LoopStats("integrated", metrics=metrics)
+boot_timer = BootTimer()
+mqtt = None  # awscrt.mqtt, imported by start_connection()
 
 comfort_settings = {
     "preferred_temp": 23.0,
@@ -78,9 +134,14 @@ comfort_settings = {
     "temp_threshold": 1.0,
     "humidity_threshold": 10.0,
 }
+preference_cache = PreferenceCache(PREFERENCE_CACHE_PATH, comfort_settings)
+USER_ID = "user_1"  # This would come from user authentication in a real app
 
 def get_user_preferences(user_id, workspace_id):
     """Retrieves user preferences from DynamoDB"""
+    # boto3 is only needed when the cached preferences are out of date
+    import boto3
+    from botocore.exceptions import ClientError
     try:
         dynamodb = boto3.resource('dynamodb', region_name='us-east-2')
         table = dynamodb.Table('PCZS_UserPreferences')
@@ -93,7 +154,7 @@ def get_user_preferences(user_id, workspace_id):
         if 'Item' in response:
             prefs = response['Item']
             print(f"Retrieved preferences: {prefs}")
-            return prefs
+            return comfort_values(prefs)
         else:
             print("No preferences found, using defaults")
             return comfort_settings  # Use existing defaults
@@ -105,45 +166,23 @@ def get_user_preferences(user_id, workspace_id):
         traceback.print_exc()
         return comfort_settings  # Use existing defaults
 
+def on_occupancy_change(occupied):
+    """Called from the PIR interrupt/timer thread; wake the main loop to publish now"""
+    if runtime is not None:
+        runtime.trigger_sample()
+    occupancy_changed.set()
+
 def detect_occupancy():
-    """Detect motion using PIR sensor and update occupancy state"""
+    """Return the occupancy state maintained by the PIR edge callbacks"""
     global occupancy, last_motion_time
-    motion = GPIO.input(PIR_PIN)
-    if motion:
-        print("Motion detected!")
-        occupancy = True
-        last_motion_time = time.time()
+    was_occupied = occupancy
+    occupancy = occupancy_monitor.occupied
+    last_motion_time = occupancy_monitor.last_motion_time
+    if occupancy and not was_occupied:
         # Visual indicator for occupancy
-        sense.show_letter("O", GREEN)
-        time.sleep(0.5)
-        sense.clear()
-    elif time.time() - last_motion_time > OCCUPANCY_TIMEOUT:
-        print("No motion detected — workspace unoccupied")
-        occupancy = False
+        display.flash("O", GREEN)
     return occupancy
 
-def read_dht22():
-    """Read temperature and humidity from DHT22 sensor"""
-    if not DHT_AVAILABLE or dht_sensor is None:
-        # Fallback to SenseHat values if DHT22 is not available
-        return None, None
-    
-    try:
-        temperature = dht_sensor.temperature
-        humidity = dht_sensor.humidity
-        if humidity is not None and temperature is not None:
-            humidity = round(humidity, 1)
-            temperature = round(temperature, 1)
-            print(f"DHT22: Temp={temperature}°C, Humidity={humidity}%")
-            return temperature, humidity
-    except RuntimeError as e:
-        # DHT22 sensors can occasionally fail to read
-        print(f"DHT22 reading error: {e}")
-    except Exception as e:
-        print(f"Unexpected DHT22 error: {e}")
-    
-    return None, None
-
 def indicate_comfort_status(temp, humidity):
     """Display comfort status on SenseHat LED matrix"""
     pref_temp = comfort_settings["preferred_temp"]
@@ -151,15 +190,15 @@ def indicate_comfort_status(temp, humidity):
     
     # Only show comfort status when workspace is occupied
     if not occupancy:
-        sense.clear()  # Turn off display when unoccupied
+        display.status(None)  # Turn off display when unoccupied
         return
         
     if abs(temp - pref_temp) <= temp_threshold:
-        sense.clear(GREEN)  # Comfortable
+        display.status(GREEN)  # Comfortable
     elif temp > pref_temp:
-        sense.clear(RED)    # Too hot
+        display.status(RED)    # Too hot
     else:
-        sense.clear(BLUE)   # Too cold
+        display.status(BLUE)   # Too cold
 
 def control_fan(temp):
     """Control fan based on temperature and occupancy"""
@@ -178,38 +217,27 @@ def control_fan(temp):
         if not fan_state:
             print("Fan control: Turning fan ON")
             # Visual indicator for fan state
-            sense.show_letter("F", GREEN)
-            time.sleep(0.5)
-            sense.clear()
+            display.flash("F", GREEN)
             fan_state = True
     else:
         if fan_state:
             print("Fan control: Turning fan OFF")
-            sense.show_letter("O", BLUE)
-            time.sleep(0.5)
-            sense.clear()
+            display.flash("O", BLUE)
             fan_state = False
     return fan_state
 
 def read_sensors():
     """Read all sensors and prepare payload for MQTT publishing"""
+    global last_temperature
     # Check occupancy first
     is_occupied = detect_occupancy()
     
-    # Read DHT22 sensor (more accurate than SenseHat for temperature/humidity)
-    dht_temp, dht_humidity = read_dht22()
-    
-    # Read SenseHat sensors as backup
-    sh_temp = sense.get_temperature()
-    sh_humidity = sense.get_humidity()
-    
-    # Use DHT22 readings if available, otherwise fall back to SenseHat
-    temperature = dht_temp if dht_temp is not None else sh_temp - 8  # Adjust SenseHat temp
-    humidity = dht_humidity if dht_humidity is not None else sh_humidity
-    
-    # Round values
-    temperature = round(temperature, 1)
-    humidity = round(humidity, 1)
+    # Latest cached readings from the best available driver (DHT22, else SenseHat)
+    temperature, _, _ = sensor_scheduler.latest("temperature")
+    humidity, _, _ = sensor_scheduler.latest("humidity")
+    if temperature is None or humidity is None:
+        raise RuntimeError("No temperature/humidity reading available yet")
+    last_temperature = temperature
     
     # Use LED to indicate comfort status
     indicate_comfort_status(temperature, humidity)
@@ -247,13 +275,119 @@ def read_sensors():
 # Callback when connection is accidentally lost.
 def on_connection_interrupted(connection, error, **kwargs):
     print(f"Connection interrupted: {error}")
+    queue_drainer.connection_down()
 
 # Callback when an interrupted connection is re-established.
 def on_connection_resumed(connection, return_code, session_present, **kwargs):
     print(f"Connection resumed: {return_code}, session_present: {session_present}")
+    queue_drainer.connection_up(resumed=True)
+    shadow_reporter.reset()
+
+def enqueue_telemetry(telemetry):
+    """Queue a telemetry sample, as-is, packed into a batch, or folded into a window aggregate"""
+    if TELEMETRY_AGGREGATE_WINDOW:
+        topic, message = TELEMETRY_TOPIC, telemetry_aggregator.add(telemetry)
+    elif TELEMETRY_BATCH_SIZE <= 1 and TELEMETRY_ENCODING == "binary":
+        telemetry_queue.put(TELEMETRY_BINARY_TOPIC, encode_telemetry(telemetry))
+        return
+    elif TELEMETRY_BATCH_SIZE <= 1:
+        topic, message = TELEMETRY_TOPIC, telemetry
+    else:
+        topic, message = TELEMETRY_BATCH_TOPIC, telemetry_batcher.add(telemetry)
+    if message is None:
+        return
+    with json_encode_seconds.time():
+        payload = json.dumps(message)
+    telemetry_queue.put(topic, payload)
+
+def mqtt_publish(topic, payload):
+    """Send one QoS1 message and return its PUBACK future (only InFlightPublisher calls this)"""
+    future, _ = mqtt_connection.publish(
+        topic=topic,
+        payload=payload,
+        qos=mqtt.QoS.AT_LEAST_ONCE
+    )
+    return future
+
+def publish_queued(topic, payload):
+    """Publish a message taken from the telemetry queue and return its PUBACK future"""
+    # Already on disk: if the window drops it, it stays queued and the drainer retries it
+    future = publisher.publish(topic, payload)
+    return boot_timer.watch_first_publish(future)
+
+def start_connection():
+    """Build the MQTT connection and keep trying to connect in the background"""
+    global mqtt, mqtt_connection
+    from awscrt import io, mqtt
+    from awsiot import mqtt_connection_builder
+
+    # Spin up resources
+    event_loop_group = io.EventLoopGroup(1)
+    host_resolver = io.DefaultHostResolver(event_loop_group)
+    client_bootstrap = io.ClientBootstrap(event_loop_group, host_resolver)
+
+    # Initialize MQTT connection
+    mqtt_connection = mqtt_connection_builder.mtls_from_path(
+        endpoint=ENDPOINT,
+        cert_filepath=CERT_FILE,
+        pri_key_filepath=KEY_FILE,
+        ca_filepath=ROOT_CA,
+        client_bootstrap=client_bootstrap,
+        client_id=CLIENT_ID,
+        clean_session=CLEAN_SESSION,
+        keep_alive_secs=30,
+        on_connection_interrupted=on_connection_interrupted,
+        on_connection_resumed=on_connection_resumed
+    )
+    # Route by topic from the start: with a persistent session the broker redelivers queued
+    # deltas right after CONNACK, before subscribe_all() could register per-topic callbacks
+    mqtt_connection.on_message(on_message)
+
+    # Connect to AWS IoT Core
+    print(f"Connecting to {ENDPOINT} with client ID '{CLIENT_ID}'...")
+    return connect_in_background(mqtt_connection, on_connected)
+
+def on_connected(connection):
+    """First CONNACK: start draining, subscribe, and sync the shadow"""
+    boot_timer.mark("connected")
+    print(f"Connected to AWS IoT! (session_present: {connection['session_present']})")
+    queue_drainer.connection_up()
+
+    # Subscribe to the shadow topics in one round trip instead of one after another;
+    # messages reach their handlers through on_message()
+    subscribe_all(mqtt_connection, mqtt.QoS.AT_LEAST_ONCE, [
+        (SHADOW_UPDATE_DELTA_TOPIC, None),
+        (SHADOW_UPDATE_ACCEPTED_TOPIC, None),
+        (SHADOW_GET_ACCEPTED_TOPIC, None),
+    ])
+    boot_timer.mark("subscribed")
+
+    # Ask for the shadow document; DynamoDB is only read if it has newer preferences
+    publisher.publish(SHADOW_GET_TOPIC, "", routine=False)
+
+    # Report initial comfort settings to shadow
+    print("Publishing initial comfort settings...")
+    publisher.publish(SHADOW_UPDATE_TOPIC, json.dumps({"state": {"reported": comfort_settings}}), routine=False)
+
+# Callback for every message the connection receives, registered before connecting
+def on_message(topic, payload, dup, qos, retain, **kwargs):
+    handler = {
+        SHADOW_UPDATE_DELTA_TOPIC: on_shadow_delta,
+        SHADOW_UPDATE_ACCEPTED_TOPIC: on_shadow_accepted,
+        SHADOW_GET_ACCEPTED_TOPIC: on_shadow_get_accepted,
+    }.get(topic)
+    if handler is not None:
+        handler(topic, payload, dup, qos, retain, **kwargs)
 
 # Callback when a message is received on shadow delta topic
 def on_shadow_delta(topic, payload, dup, qos, retain, **kwargs):
+    if runtime is not None:
+        runtime.submit_shadow_delta(payload)
+    else:
+        apply_shadow_delta(payload, time.monotonic())
+
+def apply_shadow_delta(payload, received):
+    """Apply new comfort settings from a shadow delta and re-evaluate the fan right away"""
     global comfort_settings
     payload_str = payload.decode('utf-8')
     print(f"Received delta message: {payload_str}")
@@ -262,118 +396,188 @@ def on_shadow_delta(topic, payload, dup, qos, retain, **kwargs):
         # Update only the keys that exist in comfort_settings
         comfort_settings.update({k: delta[k] for k in comfort_settings.keys() if k in delta})
         print(f"Updated comfort settings: {comfort_settings}")
+        preference_cache.save(comfort_settings, settings_version(json.loads(payload_str)))
+
+        # Fan decision with the new settings, without waiting for the next sample
+        if last_temperature is not None:
+            control_fan(last_temperature)
+        loop_stats.record("control_latency", time.monotonic() - received)
         
         # Display confirmation on SenseHat
-        sense.show_message("Updated", text_colour=GREEN, scroll_speed=0.05)
+        display.message("Updated", GREEN)
         
         # Update the reported state to match the desired state
         update = {"state": {"reported": comfort_settings}}
-        mqtt_connection.publish(
-            topic=SHADOW_UPDATE_TOPIC,
-            payload=json.dumps(update),
-            qos=mqtt.QoS.AT_LEAST_ONCE
-        )
+        publisher.publish(SHADOW_UPDATE_TOPIC, json.dumps(update), routine=False)
     except Exception as e:
         print(f"Error handling delta: {e}")
-        sense.show_message("Error", text_colour=RED, scroll_speed=0.05)
+        display.message("Error", RED, alert=True)
+
+# Callback with the full shadow document, requested once at startup
+def on_shadow_get_accepted(topic, payload, dup, qos, retain, **kwargs):
+    try:
+        document = json.loads(payload.decode('utf-8'))
+    except ValueError as e:
+        print(f"Ignoring malformed shadow document: {e}")
+        return
+    version = settings_version(document)
+    if not preference_cache.is_stale(version):
+        print(f"Cached preferences are current (version {preference_cache.version})")
+        return
+    # Preferences changed while we were offline; fetch them off the MQTT callback thread
+    desired = document.get("state", {}).get("desired", {})
+    threading.Thread(target=refresh_preferences, args=(version, desired),
+                     name="pczs-preferences", daemon=True).start()
+
+def refresh_preferences(version, desired):
+    """Refresh comfort settings from DynamoDB, falling back to the shadow's desired state"""
+    settings = get_user_preferences(USER_ID, WORKSPACE_ID)
+    if settings is comfort_settings:
+        settings = comfort_values(desired)
+    comfort_settings.update(settings)
+    print(f"Applied user preferences: {comfort_settings}")
+    preference_cache.save(comfort_settings, version)
+    if last_temperature is not None:
+        control_fan(last_temperature)
+    publisher.publish(SHADOW_UPDATE_TOPIC, json.dumps({"state": {"reported": comfort_settings}}), routine=False)
 
 # Callback when a message is received on shadow accepted topic
 def on_shadow_accepted(topic, payload, dup, qos, retain, **kwargs):
     payload_str = payload.decode('utf-8')
     print(f"Shadow update accepted: {payload_str}")
+    shadow_reporter.on_accepted(payload)
+
+def record_telemetry(telemetry):
+    """Put a sample on the disk queue as soon as it is taken, whatever the network is doing"""
+    enqueue_telemetry(telemetry)
+    print(f"Queued telemetry: {telemetry} ({len(telemetry_queue)} pending)")
+
+async def publish_sample(telemetry, shadow):
+    """Update the device shadow, waiting at most the reporter's ack timeout for its PUBACK"""
+    shadow_update = shadow_reporter.build_update(shadow["state"]["reported"])
+    if shadow_update is None:
+        return
+    # publish() may block under the "block" policy, so keep it off the event loop
+    shadow_future = await asyncio.to_thread(publisher.publish, SHADOW_UPDATE_TOPIC, json.dumps(shadow_update))
+    try:
+        await wait_crt_ack(shadow_future, shadow_reporter.ack_timeout)
+    except PublishDropped as e:
+        # The reporter re-sends unacknowledged fields after its ack timeout
+        print(f"Shadow update not sent: {e}")
+    except asyncio.TimeoutError:
+        print("Shadow update not acknowledged yet; moving on")
+
+async def run_async():
+    """Run the device as independent asyncio tasks (sampling, publishing, shadow handling)"""
+    global runtime
+    runtime = DeviceRuntime(
+        sample=read_sensors,
+        record=record_telemetry,
+        publish=publish_sample,
+        handle_shadow=apply_shadow_delta,
+        sample_interval=SAMPLE_INTERVAL,
+        stats=loop_stats
+    )
+    await runtime.run()
+
+def run_sync():
+    """Original blocking loop, kept for comparison with the async runtime"""
+    next_sample = time.monotonic()
+    while True:
+        started = time.monotonic()
+        loop_stats.record("sample_jitter", abs(started - next_sample))
+        telemetry, shadow = read_sensors()
+        loop_stats.record("sample_duration", time.monotonic() - started)
+
+        # Queue telemetry; the drainer publishes it as soon as we are connected
+        enqueue_telemetry(telemetry)
+
+        # Update device shadow, but only with fields that changed
+        shadow_update = shadow_reporter.build_update(shadow["state"]["reported"])
+        if shadow_update is not None:
+            publisher.publish(SHADOW_UPDATE_TOPIC, json.dumps(shadow_update))
+
+        print(f"Queued telemetry: {telemetry} ({len(telemetry_queue)} pending)")
+        loop_stats.maybe_report()
+
+        # Sleep until the next sample, or wake immediately on an occupancy change
+        next_sample = started + SAMPLE_INTERVAL
+        if occupancy_changed.wait(SAMPLE_INTERVAL):
+            next_sample = time.monotonic()
+        occupancy_changed.clear()
+
+def register_gauges():
+    """Queue depths and drop counters that live on other objects, read at scrape time"""
+    metrics.gauge("pczs_telemetry_queue_depth", "Telemetry messages waiting to be published",
+                  fn=lambda: len(telemetry_queue))
+    metrics.gauge("pczs_telemetry_queue_bytes", "Bytes of telemetry waiting to be published",
+                  fn=lambda: telemetry_queue.size_bytes)
+    metrics.counter("pczs_telemetry_evicted_total", "Telemetry dropped because the queue was full",
+                    fn=lambda: telemetry_queue.evicted)
+    metrics.gauge("pczs_publish_backlog", "Samples waiting for the publisher task",
+                  fn=lambda: runtime.publish_backlog() if runtime is not None else 0)
+    metrics.gauge("pczs_publish_in_flight", "Unacknowledged QoS1 publishes", fn=publisher.in_flight)
+    metrics.gauge("pczs_publish_in_flight_bytes", "Payload bytes of unacknowledged publishes",
+                  fn=publisher.in_flight_bytes)
+    metrics.gauge("pczs_publish_window_backlog", "Messages waiting for room in the publish window",
+                  fn=publisher.backlog)
+    metrics.gauge("pczs_display_pending", "Display commands waiting to run", fn=display.pending)
+    metrics.counter("pczs_display_dropped_total", "Display commands coalesced or dropped",
+                    fn=lambda: display.dropped)
 
 def main():
-    global mqtt_connection, comfort_settings
+    global mqtt_connection, comfort_settings, telemetry_queue, publisher, queue_drainer, telemetry_batcher, telemetry_aggregator, occupancy_monitor
 
-    # Display startup message
-    sense.show_message("PCZS", text_colour=ORANGE, scroll_speed=0.05)
+    # Apply the last known preferences before anything touches the network
+    comfort_settings.update(preference_cache.load())
+    boot_timer.mark("preferences")
+
+    # Open the store-and-forward queue before connecting so nothing is lost
+    telemetry_queue = TelemetryQueue(QUEUE_PATH, max_bytes=QUEUE_MAX_BYTES)
+    publisher = InFlightPublisher(mqtt_publish, max_in_flight=PUBLISH_MAX_IN_FLIGHT, max_bytes=PUBLISH_MAX_BYTES,
+                                  policy=PUBLISH_WINDOW_POLICY, stats=loop_stats)
+    queue_drainer = QueueDrainer(telemetry_queue, publish_queued, rate=QUEUE_DRAIN_RATE)
+    telemetry_batcher = TelemetryBatcher(TELEMETRY_BATCH_SIZE, TELEMETRY_BATCH_SECONDS)
+    telemetry_aggregator = WindowAggregator(TELEMETRY_AGGREGATE_WINDOW or 60, SAMPLE_INTERVAL)
+    occupancy_monitor = None
+    register_gauges()
+    if METRICS_PORT:
+        try:
+            MetricsServer(metrics, port=METRICS_PORT).start()
+        except OSError as e:
+            # e.g. the port is taken by a previous instance; run without the endpoint
+            print(f"Metrics endpoint disabled, could not bind port {METRICS_PORT}: {e}")
 
     try:
-        # Spin up resources
-        event_loop_group = io.EventLoopGroup(1)
-        host_resolver = io.DefaultHostResolver(event_loop_group)
-        client_bootstrap = io.ClientBootstrap(event_loop_group, host_resolver)
-
-        # Initialize MQTT connection
-        mqtt_connection = mqtt_connection_builder.mtls_from_path(
-            endpoint=ENDPOINT,
-            cert_filepath=CERT_FILE,
-            pri_key_filepath=KEY_FILE,
-            ca_filepath=ROOT_CA,
-            client_bootstrap=client_bootstrap,
-            client_id=CLIENT_ID,
-            clean_session=True,
-            keep_alive_secs=30
-        )
+        # Drain as soon as we are connected; until then samples just wait on disk
+        queue_drainer.start()
 
-        # Connect to AWS IoT Core
-        print(f"Connecting to {ENDPOINT} with client ID '{CLIENT_ID}'...")
-        connect_future = mqtt_connection.connect()
-        connect_future.result()
-        print("Connected to AWS IoT!")
+        # Start connecting first; the TLS handshake runs while the sensors start up
+        start_connection()
 
-        # Retrieve user preferences from DynamoDB
-        user_id = "user_1"  # This would come from user authentication in a real app
-        try:
-            retrieved_settings = get_user_preferences(user_id, WORKSPACE_ID)
-            if retrieved_settings != comfort_settings:
-                comfort_settings.update(retrieved_settings)
-                print(f"Applied user preferences: {comfort_settings}")
-        except Exception as e:
-            print(f"Error retrieving preferences, using defaults: {e}")
-            traceback.print_exc()
-
-        # Subscribe to shadow delta and accepted topics
-        print(f"Subscribing to {SHADOW_UPDATE_DELTA_TOPIC}...")
-        delta_subscribe_future, _ = mqtt_connection.subscribe(
-            topic=SHADOW_UPDATE_DELTA_TOPIC,
-            qos=mqtt.QoS.AT_LEAST_ONCE,
-            callback=on_shadow_delta
-        )
-        delta_subscribe_future.result()
-        
-        print(f"Subscribing to {SHADOW_UPDATE_ACCEPTED_TOPIC}...")
-        accepted_subscribe_future, _ = mqtt_connection.subscribe(
-            topic=SHADOW_UPDATE_ACCEPTED_TOPIC,
-            qos=mqtt.QoS.AT_LEAST_ONCE,
-            callback=on_shadow_accepted
-        )
-        accepted_subscribe_future.result()
-        
-        # Report initial comfort settings to shadow
-        print("Publishing initial comfort settings...")
-        mqtt_connection.publish(
-            topic=SHADOW_UPDATE_TOPIC,
-            payload=json.dumps({"state": {"reported": comfort_settings}}),
-            qos=mqtt.QoS.AT_LEAST_ONCE
-        )
+        # Display startup message without blocking the boot
+        display.start()
+        display.message("PCZS", ORANGE)
+
+        # Take the first readings now, then let the scheduler sample each driver at its own rate
+        if dht_sampler is not None:
+            dht_sampler.start()
+        sensor_scheduler.refresh()
+        sensor_scheduler.start()
+
+        # Watch the PIR with edge interrupts instead of polling it
+        occupancy_monitor = OccupancyMonitor(GPIO, PIR_PIN, OCCUPANCY_TIMEOUT,
+                                             on_change=on_occupancy_change, bouncetime=PIR_BOUNCE_MS)
+        occupancy_monitor.start()
+        boot_timer.mark("sensors")
 
         # Main loop
-        print("Integrated Sensors Mode Running. Press Ctrl+C to exit.")
-        while True:
-            telemetry, shadow = read_sensors()
-            
-            # Publish telemetry data
-            mqtt_connection.publish(
-                topic=TELEMETRY_TOPIC,
-                payload=json.dumps(telemetry),
-                qos=mqtt.QoS.AT_LEAST_ONCE
-            )
-            
-            # Update device shadow
-            mqtt_connection.publish(
-                topic=SHADOW_UPDATE_TOPIC,
-                payload=json.dumps(shadow),
-                qos=mqtt.QoS.AT_LEAST_ONCE
-            )
-            
-            print(f"Published telemetry: {telemetry}")
-            
-            # Check for motion more frequently, but don't flood AWS with messages
-            for i in range(5):  # Check every 2 seconds for motion, but publish only every 10 seconds
-                if i > 0:  # Skip the first iteration since we just checked
-                    detect_occupancy()  # Just check occupancy without publishing
-                time.sleep(2)
+        if USE_ASYNC_RUNTIME:
+            print("Integrated Sensors Mode Running (asyncio). Press Ctrl+C to exit.")
+            asyncio.run(run_async())
+        else:
+            print("Integrated Sensors Mode Running. Press Ctrl+C to exit.")
+            run_sync()
                 
     except KeyboardInterrupt:
         print("Exiting...")
@@ -382,11 +586,19 @@ def main():
         traceback.print_exc()
     finally:
         print("Disconnecting...")
-        if DHT_AVAILABLE and dht_sensor is not None:
-            try:
-                dht_sensor.exit()
-            except:
-                pass
+        # Keep any partially filled batch on disk for the next run
+        batch = telemetry_batcher.flush()
+        if batch is not None:
+            telemetry_queue.put(TELEMETRY_BATCH_TOPIC, json.dumps(batch))
+        aggregate = telemetry_aggregator.flush()
+        if aggregate is not None:
+            telemetry_queue.put(TELEMETRY_TOPIC, json.dumps(aggregate))
+        queue_drainer.stop()
+        telemetry_queue.close()
+        if occupancy_monitor is not None:
+            occupancy_monitor.stop()
+        sensor_scheduler.stop()
+        display.stop()
         sense.clear()
         try:
             disconnect_future = mqtt_connection.disconnect()
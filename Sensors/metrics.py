@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Device Metrics
+Latency histograms, counters and gauges for the sensor loops, served in
+Prometheus text format from a small local HTTP endpoint.
+
+    metrics = MetricsRegistry()
+    read_seconds = metrics.histogram("pczs_sensor_read_seconds", "Sensor read time", driver="dht22")
+    with read_seconds.time():
+        ...
+    MetricsServer(metrics, port=9108).start()   # curl localhost:9108/metrics
+"""
+import bisect
+import http.server
+import threading
+import time
+
+# Seconds; covers sub-millisecond encodes up to multi-second display scrolls
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self):
+        """Context manager that observes the elapsed time of its block"""
+        return _Timer(self)
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            yield f"{name}_bucket{_format_labels(labels, ('le', _format_value(bound)))} {cumulative}"
+        yield f"{name}_sum{_format_labels(labels)} {total!r}"
+        yield f"{name}_count{_format_labels(labels)} {cumulative}"
+
+
+class Counter:
+    """Monotonic count; `fn` reads the value from an existing counter attribute instead"""
+
+    def __init__(self, fn=None):
+        self.fn = fn
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self.fn() if self.fn is not None else self._value
+
+    def samples(self, name, labels):
+        yield f"{name}{_format_labels(labels)} {_format_value(self.value)}"
+
+
+class Gauge(Counter):
+    """Point-in-time value, usually read through `fn` (queue depths etc.)"""
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+
+class MetricsRegistry:
+    """Named metric families; each distinct label set gets its own child metric"""
+
+    def __init__(self):
+        self._families = {}  # name -> (type, help, {labels: metric})
+        self._lock = threading.Lock()
+
+    def _get(self, kind, factory, name, help, labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = (kind, help, {})
+            elif family[0] != kind:
+                raise ValueError(f"Metric {name} is already registered as a {family[0]}")
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = factory()
+            return metric
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS, **labels):
+        return self._get("histogram", lambda: Histogram(buckets), name, help, labels)
+
+    def counter(self, name, help, fn=None, **labels):
+        return self._get("counter", lambda: Counter(fn), name, help, labels)
+
+    def gauge(self, name, help, fn=None, **labels):
+        return self._get("gauge", lambda: Gauge(fn), name, help, labels)
+
+    def render(self):
+        """All metrics in Prometheus text exposition format"""
+        with self._lock:
+            families = [(name, kind, help, list(children.items()))
+                        for name, (kind, help, children) in sorted(self._families.items())]
+        lines = []
+        for name, kind, help, children in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in children:
+                try:
+                    lines.extend(metric.samples(name, labels))
+                except Exception as e:
+                    # A gauge callback failing (e.g. closed queue) shouldn't break the scrape
+                    print(f"Metric {name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer(threading.Thread):
+    """Serves GET /metrics on a daemon thread; binds to localhost by default"""
+
+    def __init__(self, registry, port=9108, host="127.0.0.1"):
+        super().__init__(name="pczs-metrics", daemon=True)
+        registry_ref = registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry_ref.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # scrapes every few seconds would flood the console
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Interrupt-Driven Occupancy Detection
+Tracks PIR motion with GPIO edge callbacks instead of polling the pin
+"""
+import collections
+import threading
+import time
+
+DEFAULT_BOUNCE_MS = 200
+DEFAULT_LOG_SIZE = 500
+
+
+class OccupancyMonitor:
+    """Occupancy state machine fed by PIR edge interrupts
+
+    UNOCCUPIED -> OCCUPIED on a rising edge. When the PIR output falls, a timer
+    of `timeout` seconds starts; a new rising edge cancels it, otherwise the
+    workspace becomes UNOCCUPIED when it fires. `on_change(occupied)` is called
+    on every transition, from the GPIO or timer thread, so keep it short.
+    """
+
+    def __init__(self, gpio, pin, timeout, on_change=None,
+                 bouncetime=DEFAULT_BOUNCE_MS, log_size=DEFAULT_LOG_SIZE):
+        self.gpio = gpio
+        self.pin = pin
+        self.timeout = timeout
+        self.on_change = on_change
+        self.bouncetime = bouncetime
+        self.motion_log = collections.deque(maxlen=log_size)  # (timestamp, level)
+        self.occupied = False
+        self.motion = False
+        self.last_motion_time = 0
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def start(self):
+        self.gpio.add_event_detect(self.pin, self.gpio.BOTH, callback=self._on_edge,
+                                   bouncetime=self.bouncetime)
+        # Pick up a PIR that is already high when we start
+        self._handle_level(self.gpio.input(self.pin), time.time())
+
+    def stop(self):
+        self.gpio.remove_event_detect(self.pin)
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _on_edge(self, channel):
+        # Read the settled level rather than trusting the edge direction
+        self._handle_level(self.gpio.input(channel), time.time())
+
+    def _handle_level(self, level, now):
+        level = bool(level)
+        changed = False
+        with self._lock:
+            if level == self.motion:
+                return  # bounce or duplicate edge
+            self.motion = level
+            self.motion_log.append((now, level))
+            if level:
+                self.last_motion_time = now
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self.occupied:
+                    self.occupied = changed = True
+            else:
+                self.last_motion_time = now
+                self._timer = threading.Timer(self.timeout, self._on_timeout)
+                self._timer.daemon = True
+                self._timer.start()
+        if changed:
+            print("Motion detected — workspace occupied")
+            self._notify(True)
+
+    def _on_timeout(self):
+        with self._lock:
+            self._timer = None
+            if self.motion or not self.occupied:
+                return
+            self.occupied = False
+        print("No motion detected — workspace unoccupied")
+        self._notify(False)
+
+    def _notify(self, occupied):
+        if self.on_change is None:
+            return
+        try:
+            self.on_change(occupied)
+        except Exception as e:
+            print(f"Error in occupancy callback: {e}")
+
+    def events_since(self, since):
+        """Return logged (timestamp, level) motion edges newer than `since`"""
+        with self._lock:
+            return [event for event in self.motion_log if event[0] > since]
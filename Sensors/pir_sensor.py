@@ -3,13 +3,18 @@
 PCZS: Personalized Comfort Zones System - PIR Sensor Mode
 This module handles occupancy detection and publishes to AWS IoT
 """
-import time
 import json
 import datetime
 import uuid
+import threading
 import RPi.GPIO as GPIO
 from awscrt import io, mqtt
 from awsiot import mqtt_connection_builder
+from telemetry_queue import TelemetryQueue, QueueDrainer
+from telemetry_batch import TelemetryBatcher
+from shadow_reporter import ShadowReporter
+from occupancy import OccupancyMonitor
+from sensor_drivers import SensorScheduler, MockDriver, PIRDriver
 
 # Configuration
 THING_NAME = "PCZS"
@@ -20,38 +25,44 @@ CERT_PATH = "/home/smartsys/pczs/cert/"
 CERT_FILE = CERT_PATH + "certificate.pem.crt"
 KEY_FILE = CERT_PATH + "private.pem.key"
 ROOT_CA = CERT_PATH + "AmazonRootCA1.pem"
+QUEUE_PATH = "/home/smartsys/pczs/queue/telemetry-pir.db"
+QUEUE_MAX_BYTES = 50 * 1024 * 1024  # disk budget for unsent telemetry
+QUEUE_DRAIN_RATE = 20  # messages per second when catching up after an outage
+TELEMETRY_BATCH_SIZE = 1  # samples per telemetry message; >1 enables batch mode
+TELEMETRY_BATCH_SECONDS = 300  # flush a partial batch after this long
+SHADOW_DEADBANDS = {"temperature": 0.2, "humidity": 1.0}  # min change worth reporting
+SHADOW_HEARTBEAT = 900  # seconds between full shadow reports
 TELEMETRY_TOPIC = f"pczs/{WORKSPACE_ID}/telemetry"
+TELEMETRY_BATCH_TOPIC = f"pczs/{WORKSPACE_ID}/telemetry/batch"
 SHADOW_UPDATE_TOPIC = f"$aws/things/{THING_NAME}/shadow/update"
+SHADOW_UPDATE_ACCEPTED_TOPIC = f"$aws/things/{THING_NAME}/shadow/update/accepted"
 
 # GPIO Pins
 PIR_PIN = 17
+PIR_BOUNCE_MS = 200  # debounce window for PIR edges
 
 # Initialize GPIO
 GPIO.setmode(GPIO.BCM)
 GPIO.setup(PIR_PIN, GPIO.IN)
 
+# Sensor drivers: mock data for environmental sensors, PIR for occupancy
+sensor_scheduler = SensorScheduler(("temperature", "humidity", "occupied"))
+sensor_scheduler.register(MockDriver({"temperature": 23.5, "humidity": 45.0}))
+
 # State
-occupancy = False
-last_motion_time = 0
+shadow_reporter = ShadowReporter(SHADOW_DEADBANDS, SHADOW_HEARTBEAT)
 OCCUPANCY_TIMEOUT = 300  # seconds
+occupancy_changed = threading.Event()
 
-def detect_occupancy():
-    global occupancy, last_motion_time
-    motion = GPIO.input(PIR_PIN)
-    if motion:
-        print("Motion detected!")
-        occupancy = True
-        last_motion_time = time.time()
-    elif time.time() - last_motion_time > OCCUPANCY_TIMEOUT:
-        print("No motion detected — workspace unoccupied")
-        occupancy = False
-    return occupancy
+def on_occupancy_change(occupied):
+    # Runs on the PIR interrupt/timer thread; wake the main loop to publish now
+    occupancy_changed.set()
 
 def read_sensors():
-    # Using mock data for environmental sensors
-    temperature = 23.5
-    humidity = 45.0
-    is_occupied = detect_occupancy()
+    readings = sensor_scheduler.snapshot()
+    temperature = readings["temperature"]
+    humidity = readings["humidity"]
+    is_occupied = readings["occupied"]
     timestamp = datetime.datetime.now().isoformat()
 
     payload = {
@@ -76,12 +87,51 @@ def read_sensors():
 # Callback when connection is accidentally lost.
 def on_connection_interrupted(connection, error, **kwargs):
     print(f"Connection interrupted: {error}")
+    queue_drainer.connection_down()
 
 # Callback when an interrupted connection is re-established.
 def on_connection_resumed(connection, return_code, session_present, **kwargs):
     print(f"Connection resumed: {return_code}, session_present: {session_present}")
+    queue_drainer.connection_up(resumed=True)
+    shadow_reporter.reset()
+
+def enqueue_telemetry(telemetry):
+    """Queue a telemetry sample, packing it into a batch message when batch mode is on"""
+    if TELEMETRY_BATCH_SIZE <= 1:
+        telemetry_queue.put(TELEMETRY_TOPIC, json.dumps(telemetry))
+        return
+    batch = telemetry_batcher.add(telemetry)
+    if batch is not None:
+        telemetry_queue.put(TELEMETRY_BATCH_TOPIC, json.dumps(batch))
+
+def publish_queued(topic, payload):
+    """Publish a message taken from the telemetry queue and return its PUBACK future"""
+    future, _ = mqtt_connection.publish(
+        topic=topic,
+        payload=payload,
+        qos=mqtt.QoS.AT_LEAST_ONCE
+    )
+    return future
+
+# Callback when a message is received on shadow accepted topic
+def on_shadow_accepted(topic, payload, dup, qos, retain, **kwargs):
+    shadow_reporter.on_accepted(payload)
 
 def main():
+    global mqtt_connection, telemetry_queue, queue_drainer, telemetry_batcher, occupancy_monitor
+
+    # Watch the PIR with edge interrupts instead of polling it
+    occupancy_monitor = OccupancyMonitor(GPIO, PIR_PIN, OCCUPANCY_TIMEOUT,
+                                         on_change=on_occupancy_change, bouncetime=PIR_BOUNCE_MS)
+    occupancy_monitor.start()
+    sensor_scheduler.register(PIRDriver(occupancy_monitor))
+    sensor_scheduler.refresh()  # mock values never go stale, no sampling thread needed
+
+    # Open the store-and-forward queue before connecting so nothing is lost
+    telemetry_queue = TelemetryQueue(QUEUE_PATH, max_bytes=QUEUE_MAX_BYTES)
+    queue_drainer = QueueDrainer(telemetry_queue, publish_queued, rate=QUEUE_DRAIN_RATE)
+    telemetry_batcher = TelemetryBatcher(TELEMETRY_BATCH_SIZE, TELEMETRY_BATCH_SECONDS)
+
     # Spin up resources
     event_loop_group = io.EventLoopGroup(1)
     host_resolver = io.DefaultHostResolver(event_loop_group)
@@ -96,7 +146,9 @@ def main():
         client_bootstrap=client_bootstrap,
         client_id=CLIENT_ID,
         clean_session=True,
-        keep_alive_secs=30
+        keep_alive_secs=30,
+        on_connection_interrupted=on_connection_interrupted,
+        on_connection_resumed=on_connection_resumed
     )
 
     # Connect to AWS IoT Core
@@ -104,6 +156,17 @@ def main():
     connect_future = mqtt_connection.connect()
     connect_future.result()
     print("Connected to AWS IoT!")
+    queue_drainer.connection_up()
+    queue_drainer.start()
+
+    # Track acknowledged shadow state so only changes are reported
+    print(f"Subscribing to {SHADOW_UPDATE_ACCEPTED_TOPIC}...")
+    accepted_subscribe_future, _ = mqtt_connection.subscribe(
+        topic=SHADOW_UPDATE_ACCEPTED_TOPIC,
+        qos=mqtt.QoS.AT_LEAST_ONCE,
+        callback=on_shadow_accepted
+    )
+    accepted_subscribe_future.result()
 
     # Main loop
     try:
@@ -111,28 +174,36 @@ def main():
         while True:
             telemetry, shadow = read_sensors()
             
-            # Publish telemetry data
-            mqtt_connection.publish(
-                topic=TELEMETRY_TOPIC,
-                payload=json.dumps(telemetry),
-                qos=mqtt.QoS.AT_LEAST_ONCE
-            )
+            # Queue telemetry; the drainer publishes it as soon as we are connected
+            enqueue_telemetry(telemetry)
             
-            # Update device shadow with occupancy
-            mqtt_connection.publish(
-                topic=SHADOW_UPDATE_TOPIC,
-                payload=json.dumps(shadow),
-                qos=mqtt.QoS.AT_LEAST_ONCE
-            )
+            # Update device shadow, but only with fields that changed
+            shadow_update = shadow_reporter.build_update(shadow["state"]["reported"])
+            if shadow_update is not None:
+                mqtt_connection.publish(
+                    topic=SHADOW_UPDATE_TOPIC,
+                    payload=json.dumps(shadow_update),
+                    qos=mqtt.QoS.AT_LEAST_ONCE
+                )
             
-            print(f"Published telemetry: {telemetry}")
-            time.sleep(5)  # Check more frequently for motion
+            print(f"Queued telemetry: {telemetry} ({len(telemetry_queue)} pending)")
+
+            # Sleep until the next sample, or wake immediately on an occupancy change
+            occupancy_changed.wait(5)
+            occupancy_changed.clear()
     except KeyboardInterrupt:
         print("Exiting...")
     except Exception as e:
         print(f"Unexpected error: {e}")
     finally:
         print("Disconnecting...")
+        # Keep any partially filled batch on disk for the next run
+        batch = telemetry_batcher.flush()
+        if batch is not None:
+            telemetry_queue.put(TELEMETRY_BATCH_TOPIC, json.dumps(batch))
+        queue_drainer.stop()
+        telemetry_queue.close()
+        occupancy_monitor.stop()
         disconnect_future = mqtt_connection.disconnect()
         disconnect_future.result()
         GPIO.cleanup()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - On-Device Preference Cache
+Keeps the last known comfort settings in a small versioned JSON file so a
+device can apply them at boot without waiting for the network.
+
+The cache version is the newest `metadata.desired` timestamp of the comfort
+keys in the device shadow. Unlike the shadow document `version`, which moves
+every time the device reports a reading, it only changes when someone saves
+new preferences.
+"""
+import json
+import os
+import threading
+import time
+
+COMFORT_KEYS = ("preferred_temp", "preferred_humidity", "temp_threshold", "humidity_threshold")
+
+
+def settings_version(message):
+    """Newest desired-state timestamp of the comfort keys in a shadow message
+
+    Works for delta messages (`metadata.<key>`) and get/accepted documents
+    (`metadata.desired.<key>`). Returns None if no comfort key is present.
+    """
+    metadata = message.get("metadata", {})
+    metadata = metadata.get("desired", metadata)
+    stamps = [metadata[k].get("timestamp") for k in COMFORT_KEYS if isinstance(metadata.get(k), dict)]
+    stamps = [s for s in stamps if s is not None]
+    return max(stamps) if stamps else None
+
+
+def comfort_values(source):
+    """Pick the comfort keys out of a dict (shadow state, DynamoDB item) as floats"""
+    return {k: float(source[k]) for k in COMFORT_KEYS if k in source}
+
+
+class PreferenceCache:
+    """Versioned comfort settings persisted to `path`
+
+    load() never raises: a missing or corrupt file just means the defaults.
+    save() writes atomically so a power cut can't leave a half-written file.
+    """
+
+    def __init__(self, path, defaults):
+        self.path = path
+        self.defaults = dict(defaults)
+        self.version = None  # None until settings have been synced at least once
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Return the cached settings merged over the defaults"""
+        settings = dict(self.defaults)
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+            settings.update(comfort_values(cached.get("settings", {})))
+            self.version = cached.get("version")
+            print(f"Loaded cached preferences (version {self.version}): {settings}")
+        except FileNotFoundError:
+            print("No cached preferences, using defaults")
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"Ignoring corrupt preference cache {self.path}: {e}")
+        return settings
+
+    def is_stale(self, version):
+        """True if the shadow holds settings newer than the cached ones"""
+        if self.version is None:
+            return True
+        return version is not None and version > self.version
+
+    def save(self, settings, version=None):
+        """Persist settings; a `version` older than the cached one is ignored"""
+        with self._lock:
+            if version is not None and self.version is not None and version < self.version:
+                return False
+            if version is not None or self.version is None:
+                self.version = version if version is not None else 0
+            record = {
+                "version": self.version,
+                "saved": time.time(),
+                "settings": comfort_values(settings),
+            }
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(record, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Could not write preference cache: {e}")
+                return False
+        return True
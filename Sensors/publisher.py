@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Bounded QoS1 Publisher
+Caps the number and size of unacknowledged QoS1 publishes so a slow or
+throttling broker can't pile up messages in awscrt without limit, and pushes
+back on whoever is producing them.
+"""
+import collections
+import concurrent.futures
+import threading
+import time
+
+POLICY_BLOCK = "block"              # wait for the window to drain
+POLICY_DROP_OLDEST = "drop_oldest"  # drop the oldest waiting routine message
+
+DEFAULT_MAX_IN_FLIGHT = 32
+DEFAULT_MAX_BYTES = 256 * 1024
+DEFAULT_MAX_BACKLOG = 32
+DEFAULT_BLOCK_TIMEOUT = 30.0
+
+
+class PublishDropped(Exception):
+    """The message was not sent because the publish window was full"""
+
+
+class InFlightPublisher:
+    """QoS1 publish window with a short backlog and an overflow policy
+
+    `publish_fn(topic, payload)` sends one message and returns its PUBACK
+    future (awscrt's publish future). At most `max_in_flight` messages and
+    `max_bytes` of payload are unacknowledged at once; further messages wait
+    in a backlog of `max_backlog`. When that is full too, routine messages
+    are handled by `policy`:
+
+        block        the caller waits up to `block_timeout` for room
+        drop_oldest  the oldest waiting routine message is dropped
+
+    Routine messages are queued telemetry, which stays on disk until it is
+    acknowledged (QueueDrainer retries it), and shadow updates, which the
+    ShadowReporter re-sends itself. Non-routine messages (settings echoes,
+    shadow gets) always queue.
+
+    publish() returns a future that resolves on PUBACK, or fails with
+    PublishDropped. Ack latencies go to `stats` as `ack_latency`.
+    """
+
+    def __init__(self, publish_fn, max_in_flight=DEFAULT_MAX_IN_FLIGHT, max_bytes=DEFAULT_MAX_BYTES,
+                 policy=POLICY_BLOCK, max_backlog=DEFAULT_MAX_BACKLOG,
+                 block_timeout=DEFAULT_BLOCK_TIMEOUT, stats=None):
+        if policy not in (POLICY_BLOCK, POLICY_DROP_OLDEST):
+            raise ValueError(f"Unknown publish window policy: {policy}")
+        self.publish_fn = publish_fn
+        self.max_in_flight = max_in_flight
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.max_backlog = max_backlog
+        self.block_timeout = block_timeout
+        self.stats = stats
+        self.sent = 0
+        self.acked = 0
+        self.failed = 0
+        self.dropped = 0
+        self._in_flight = 0
+        self._in_flight_bytes = 0
+        self._backlog = collections.deque()  # (topic, payload, routine, future)
+        self._cond = threading.Condition()
+
+    def in_flight(self):
+        with self._cond:
+            return self._in_flight
+
+    def in_flight_bytes(self):
+        with self._cond:
+            return self._in_flight_bytes
+
+    def backlog(self):
+        with self._cond:
+            return len(self._backlog)
+
+    def publish(self, topic, payload, routine=True):
+        future = concurrent.futures.Future()
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')  # the window is measured in bytes
+        with self._cond:
+            if routine and len(self._backlog) >= self.max_backlog:
+                if self.policy == POLICY_BLOCK:
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._backlog) >= self.max_backlog:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._drop(future, "timed out waiting for the publish window")
+                            return future
+                        self._cond.wait(remaining)
+                else:
+                    victim = next((entry for entry in self._backlog if entry[2]), None)
+                    if victim is None:
+                        self._drop(future, "publish window full")
+                        return future
+                    self._backlog.remove(victim)
+                    self._drop(victim[3], "dropped for a newer message")
+            self._backlog.append((topic, payload, routine, future))
+            ready = self._take_ready()
+        for entry in ready:
+            self._send(entry)
+        return future
+
+    # Window bookkeeping (callers hold self._cond)
+
+    def _has_room(self, size):
+        if self._in_flight == 0:
+            return True  # always let one message through, however large
+        return self._in_flight < self.max_in_flight and self._in_flight_bytes + size <= self.max_bytes
+
+    def _take_ready(self):
+        """Move backlog entries into the window while there is room"""
+        ready = []
+        while self._backlog and self._has_room(len(self._backlog[0][1])):
+            entry = self._backlog.popleft()
+            self._in_flight += 1
+            self._in_flight_bytes += len(entry[1])
+            ready.append(entry)
+        return ready
+
+    def _drop(self, future, reason):
+        self.dropped += 1
+        self._count("publish_dropped")
+        future.set_exception(PublishDropped(reason))
+
+    def _count(self, metric):
+        if self.stats is not None:
+            self.stats.count(metric)
+
+    def _send(self, entry):
+        topic, payload, _, future = entry
+        started = time.monotonic()
+        try:
+            ack = self.publish_fn(topic, payload)
+        except Exception as e:
+            self._release(len(payload))
+            self.failed += 1
+            future.set_exception(e)
+            return
+        self.sent += 1
+        ack.add_done_callback(lambda f: self._on_ack(f, entry, started))
+
+    def _on_ack(self, ack, entry, started):
+        topic, payload, _, future = entry
+        error = ack.exception()
+        if error is None:
+            self.acked += 1
+            if self.stats is not None:
+                self.stats.record("ack_latency", time.monotonic() - started)
+            future.set_result(ack.result())
+        else:
+            self.failed += 1
+            future.set_exception(error)
+        self._release(len(payload))
+
+    def _release(self, size):
+        with self._cond:
+            self._in_flight -= 1
+            self._in_flight_bytes -= size
+            ready = self._take_ready()
+            self._cond.notify_all()
+        for entry in ready:
+            self._send(entry)
@@ -4,12 +4,21 @@ PCZS: Personalized Comfort Zones System - SenseHat Mode
 This module handles sensor data collection and publishes to AWS IoT
 """
 import time
+import asyncio
 import json
 import datetime
 import uuid
 from sense_hat import SenseHat
 from awscrt import io, mqtt
 from awsiot import mqtt_connection_builder
+from telemetry_queue import TelemetryQueue, QueueDrainer
+from telemetry_batch import TelemetryBatcher
+from aggregation import WindowAggregator
+from wire_format import encode_telemetry
+from shadow_reporter import ShadowReporter
+from async_runtime import DeviceRuntime, LoopStats, wait_crt_ack
+from display_worker import DisplayWorker
+from sensor_drivers import SensorScheduler, SenseHatDriver
 
 # Configuration
 THING_NAME = "PCZS"
@@ -20,7 +29,20 @@ CERT_PATH = "/home/smartsys/pczs/cert/"
 CERT_FILE = CERT_PATH + "certificate.pem.crt"
 KEY_FILE = CERT_PATH + "private.pem.key"
 ROOT_CA = CERT_PATH + "AmazonRootCA1.pem"
+QUEUE_PATH = "/home/smartsys/pczs/queue/telemetry-sensehat.db"
+QUEUE_MAX_BYTES = 50 * 1024 * 1024  # disk budget for unsent telemetry
+QUEUE_DRAIN_RATE = 20  # messages per second when catching up after an outage
+TELEMETRY_BATCH_SIZE = 1  # samples per telemetry message; >1 enables batch mode
+TELEMETRY_BATCH_SECONDS = 300  # flush a partial batch after this long
+TELEMETRY_AGGREGATE_WINDOW = 0  # 60 or 300 publishes window aggregates instead of raw samples
+TELEMETRY_ENCODING = "json"  # "binary" sends raw samples as 14-byte packed messages
+SAMPLE_INTERVAL = 10  # seconds between telemetry samples
+USE_ASYNC_RUNTIME = True  # run sampling/publishing/shadow handling as asyncio tasks
+SHADOW_DEADBANDS = {"temperature": 0.2, "humidity": 1.0}  # min change worth reporting
+SHADOW_HEARTBEAT = 900  # seconds between full shadow reports
 TELEMETRY_TOPIC = f"pczs/{WORKSPACE_ID}/telemetry"
+TELEMETRY_BATCH_TOPIC = f"pczs/{WORKSPACE_ID}/telemetry/batch"
+TELEMETRY_BINARY_TOPIC = f"pczs/{WORKSPACE_ID}/telemetry/bin"
 SHADOW_UPDATE_TOPIC = f"$aws/things/{THING_NAME}/shadow/update"
 SHADOW_UPDATE_ACCEPTED_TOPIC = f"$aws/things/{THING_NAME}/shadow/update/accepted"
 SHADOW_UPDATE_DELTA_TOPIC = f"$aws/things/{THING_NAME}/shadow/update/delta"
@@ -28,6 +50,10 @@ SHADOW_UPDATE_DELTA_TOPIC = f"$aws/things/{THING_NAME}/shadow/update/delta"
 # Initialize SenseHat
 sense = SenseHat()
 sense.clear()
+display = DisplayWorker(sense)  # all LED updates after startup go through this thread
+sensor_scheduler = SensorScheduler(("temperature", "humidity"))
+# SenseHat tends to read high due to CPU heat, the driver subtracts an approximate offset
+sensor_scheduler.register(SenseHatDriver(sense, temp_offset=8.0))
 
 # Colors
 RED = (255, 0, 0)
@@ -35,7 +61,11 @@ GREEN = (0, 255, 0)
 BLUE = (0, 0, 255)
 
 # State
+shadow_reporter = ShadowReporter(SHADOW_DEADBANDS, SHADOW_HEARTBEAT)
 fan_state = False
+last_temperature = None
+runtime = None  # DeviceRuntime when USE_ASYNC_RUNTIME is on
+loop_stats = LoopStats("sensehat")
 comfort_settings = {
     "preferred_temp": 23.0,
     "preferred_humidity": 50.0,
@@ -47,11 +77,11 @@ def indicate_comfort_status(temp, humidity):
     pref_temp = comfort_settings["preferred_temp"]
     temp_threshold = comfort_settings["temp_threshold"]
     if abs(temp - pref_temp) <= temp_threshold:
-        sense.clear(GREEN)  # Comfortable
+        display.status(GREEN)  # Comfortable
     elif temp > pref_temp:
-        sense.clear(RED)    # Too hot
+        display.status(RED)    # Too hot
     else:
-        sense.clear(BLUE)   # Too cold
+        display.status(BLUE)   # Too cold
 
 def control_fan(temp):
     global fan_state
@@ -65,26 +95,23 @@ def control_fan(temp):
         if not fan_state:
             print("Fan control: Turning fan ON")
             # Visual indicator for fan state
-            sense.show_letter("F", GREEN)
-            time.sleep(0.5)
-            sense.clear()
+            display.flash("F", GREEN)
             fan_state = True
     else:
         if fan_state:
             print("Fan control: Turning fan OFF")
-            sense.show_letter("O", BLUE)
-            time.sleep(0.5)
-            sense.clear()
+            display.flash("O", BLUE)
             fan_state = False
     return fan_state
 
 def read_sensors():
-    temperature = sense.get_temperature()
-    # Adjust temperature reading as SenseHat tends to read high due to CPU heat
-    temperature = round(temperature - 8, 1)  # Adjust by approximate offset, round to 1 decimal
-    
-    humidity = sense.get_humidity()
-    humidity = round(humidity, 1)
+    global last_temperature
+    # Latest cached reading; the scheduler samples the SenseHat at its own rate
+    temperature, _, _ = sensor_scheduler.latest("temperature")
+    humidity, _, _ = sensor_scheduler.latest("humidity")
+    if temperature is None or humidity is None:
+        raise RuntimeError("No temperature/humidity reading available yet")
+    last_temperature = temperature
     
     # Use LED to indicate comfort status
     indicate_comfort_status(temperature, humidity)
@@ -117,13 +144,48 @@ def read_sensors():
 # Callback when connection is accidentally lost.
 def on_connection_interrupted(connection, error, **kwargs):
     print(f"Connection interrupted: {error}")
+    queue_drainer.connection_down()
 
 # Callback when an interrupted connection is re-established.
 def on_connection_resumed(connection, return_code, session_present, **kwargs):
     print(f"Connection resumed: {return_code}, session_present: {session_present}")
+    queue_drainer.connection_up(resumed=True)
+    shadow_reporter.reset()
+
+def enqueue_telemetry(telemetry):
+    """Queue a telemetry sample, as-is, packed into a batch, or folded into a window aggregate"""
+    if TELEMETRY_AGGREGATE_WINDOW:
+        aggregate = telemetry_aggregator.add(telemetry)
+        if aggregate is not None:
+            telemetry_queue.put(TELEMETRY_TOPIC, json.dumps(aggregate))
+        return
+    if TELEMETRY_BATCH_SIZE <= 1 and TELEMETRY_ENCODING == "binary":
+        telemetry_queue.put(TELEMETRY_BINARY_TOPIC, encode_telemetry(telemetry))
+        return
+    if TELEMETRY_BATCH_SIZE <= 1:
+        telemetry_queue.put(TELEMETRY_TOPIC, json.dumps(telemetry))
+        return
+    batch = telemetry_batcher.add(telemetry)
+    if batch is not None:
+        telemetry_queue.put(TELEMETRY_BATCH_TOPIC, json.dumps(batch))
+
+def publish_queued(topic, payload):
+    """Publish a message taken from the telemetry queue and return its PUBACK future"""
+    future, _ = mqtt_connection.publish(
+        topic=topic,
+        payload=payload,
+        qos=mqtt.QoS.AT_LEAST_ONCE
+    )
+    return future
 
 # Callback when a message is received on shadow delta topic
 def on_shadow_delta(topic, payload, dup, qos, retain, **kwargs):
+    if runtime is not None:
+        runtime.submit_shadow_delta(payload)
+    else:
+        apply_shadow_delta(payload, time.monotonic())
+
+def apply_shadow_delta(payload, received):
     global comfort_settings
     payload_str = payload.decode('utf-8')
     print(f"Received delta message: {payload_str}")
@@ -132,9 +194,14 @@ def on_shadow_delta(topic, payload, dup, qos, retain, **kwargs):
         # Update only the keys that exist in comfort_settings
         comfort_settings.update({k: delta[k] for k in comfort_settings.keys() if k in delta})
         print(f"Updated comfort settings: {comfort_settings}")
+
+        # Fan decision with the new settings, without waiting for the next sample
+        if last_temperature is not None:
+            control_fan(last_temperature)
+        loop_stats.record("control_latency", time.monotonic() - received)
         
         # Display confirmation on SenseHat
-        sense.show_message("Updated", text_colour=GREEN, scroll_speed=0.05)
+        display.message("Updated", GREEN)
         
         # Update the reported state to match the desired state
         update = {"state": {"reported": comfort_settings}}
@@ -145,18 +212,61 @@ def on_shadow_delta(topic, payload, dup, qos, retain, **kwargs):
         )
     except Exception as e:
         print(f"Error handling delta: {e}")
-        sense.show_message("Error", text_colour=RED, scroll_speed=0.05)
+        display.message("Error", RED, alert=True)
 
 # Callback when a message is received on shadow accepted topic
 def on_shadow_accepted(topic, payload, dup, qos, retain, **kwargs):
     payload_str = payload.decode('utf-8')
     print(f"Shadow update accepted: {payload_str}")
+    shadow_reporter.on_accepted(payload)
+
+def record_telemetry(telemetry):
+    """Put a sample on the disk queue as soon as it is taken, whatever the network is doing"""
+    enqueue_telemetry(telemetry)
+    print(f"Queued telemetry: {telemetry} ({len(telemetry_queue)} pending)")
+
+async def publish_sample(telemetry, shadow):
+    """Update the device shadow, waiting at most the reporter's ack timeout for its PUBACK"""
+    shadow_update = shadow_reporter.build_update(shadow["state"]["reported"])
+    if shadow_update is None:
+        return
+    shadow_future, _ = mqtt_connection.publish(
+        topic=SHADOW_UPDATE_TOPIC,
+        payload=json.dumps(shadow_update),
+        qos=mqtt.QoS.AT_LEAST_ONCE
+    )
+    try:
+        await wait_crt_ack(shadow_future, shadow_reporter.ack_timeout)
+    except asyncio.TimeoutError:
+        # awscrt keeps it until it reconnects; the reporter re-sends unacknowledged fields anyway
+        print("Shadow update not acknowledged yet; moving on")
+
+async def run_async():
+    global runtime
+    runtime = DeviceRuntime(
+        sample=read_sensors,
+        record=record_telemetry,
+        publish=publish_sample,
+        handle_shadow=apply_shadow_delta,
+        sample_interval=SAMPLE_INTERVAL,
+        stats=loop_stats
+    )
+    await runtime.run()
 
 def main():
-    global mqtt_connection
+    global mqtt_connection, telemetry_queue, queue_drainer, telemetry_batcher, telemetry_aggregator
 
     # Display startup message
     sense.show_message("PCZS", text_colour=(255, 165, 0), scroll_speed=0.05)
+    display.start()
+    sensor_scheduler.refresh()
+    sensor_scheduler.start()
+
+    # Open the store-and-forward queue before connecting so nothing is lost
+    telemetry_queue = TelemetryQueue(QUEUE_PATH, max_bytes=QUEUE_MAX_BYTES)
+    queue_drainer = QueueDrainer(telemetry_queue, publish_queued, rate=QUEUE_DRAIN_RATE)
+    telemetry_batcher = TelemetryBatcher(TELEMETRY_BATCH_SIZE, TELEMETRY_BATCH_SECONDS)
+    telemetry_aggregator = WindowAggregator(TELEMETRY_AGGREGATE_WINDOW or 60, SAMPLE_INTERVAL)
 
     # Spin up resources
     event_loop_group = io.EventLoopGroup(1)
@@ -172,7 +282,9 @@ def main():
         client_bootstrap=client_bootstrap,
         client_id=CLIENT_ID,
         clean_session=True,
-        keep_alive_secs=30
+        keep_alive_secs=30,
+        on_connection_interrupted=on_connection_interrupted,
+        on_connection_resumed=on_connection_resumed
     )
 
     # Connect to AWS IoT Core
@@ -180,6 +292,8 @@ def main():
     connect_future = mqtt_connection.connect()
     connect_future.result()
     print("Connected to AWS IoT!")
+    queue_drainer.connection_up()
+    queue_drainer.start()
 
     # Subscribe to shadow delta and accepted topics
     print(f"Subscribing to {SHADOW_UPDATE_DELTA_TOPIC}...")
@@ -208,32 +322,51 @@ def main():
 
     # Main loop
     try:
-        print("SenseHat Mode Running. Press Ctrl+C to exit.")
-        while True:
-            telemetry, shadow = read_sensors()
+        if USE_ASYNC_RUNTIME:
+            print("SenseHat Mode Running (asyncio). Press Ctrl+C to exit.")
+            asyncio.run(run_async())
+        else:
+            print("SenseHat Mode Running. Press Ctrl+C to exit.")
+            next_sample = time.monotonic()
+            while True:
+                started = time.monotonic()
+                loop_stats.record("sample_jitter", abs(started - next_sample))
+                telemetry, shadow = read_sensors()
+                loop_stats.record("sample_duration", time.monotonic() - started)
             
-            # Publish telemetry data
-            mqtt_connection.publish(
-                topic=TELEMETRY_TOPIC,
-                payload=json.dumps(telemetry),
-                qos=mqtt.QoS.AT_LEAST_ONCE
-            )
+                # Queue telemetry; the drainer publishes it as soon as we are connected
+                enqueue_telemetry(telemetry)
             
-            # Update device shadow
-            mqtt_connection.publish(
-                topic=SHADOW_UPDATE_TOPIC,
-                payload=json.dumps(shadow),
-                qos=mqtt.QoS.AT_LEAST_ONCE
-            )
+                # Update device shadow, but only with fields that changed
+                shadow_update = shadow_reporter.build_update(shadow["state"]["reported"])
+                if shadow_update is not None:
+                    mqtt_connection.publish(
+                        topic=SHADOW_UPDATE_TOPIC,
+                        payload=json.dumps(shadow_update),
+                        qos=mqtt.QoS.AT_LEAST_ONCE
+                    )
             
-            print(f"Published telemetry: {telemetry}")
-            time.sleep(10)
+                print(f"Queued telemetry: {telemetry} ({len(telemetry_queue)} pending)")
+                loop_stats.maybe_report()
+                next_sample = started + SAMPLE_INTERVAL
+                time.sleep(SAMPLE_INTERVAL)
     except KeyboardInterrupt:
         print("Exiting...")
     except Exception as e:
         print(f"Unexpected error: {e}")
     finally:
         print("Disconnecting...")
+        # Keep any partially filled batch on disk for the next run
+        batch = telemetry_batcher.flush()
+        if batch is not None:
+            telemetry_queue.put(TELEMETRY_BATCH_TOPIC, json.dumps(batch))
+        aggregate = telemetry_aggregator.flush()
+        if aggregate is not None:
+            telemetry_queue.put(TELEMETRY_TOPIC, json.dumps(aggregate))
+        queue_drainer.stop()
+        telemetry_queue.close()
+        sensor_scheduler.stop()
+        display.stop()
         sense.clear()
         disconnect_future = mqtt_connection.disconnect()
         disconnect_future.result()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Sensor Driver Registry
+Each driver declares the fields it provides, how often it may be sampled,
+what a read costs and how long its values stay fresh. SensorScheduler
+samples the drivers that are actually needed at their own rates, and the
+sensor loops read the latest cached values without touching hardware.
+"""
+import threading
+import time
+
+
+class SensorDriver:
+    """Base class for a sensor driver
+
+    name          unique driver name
+    fields        fields returned by read(), e.g. ("temperature", "humidity")
+    min_interval  minimum seconds between reads
+    cost          relative cost of a read (breaks ties between same-priority drivers)
+    max_age       seconds a reading is considered fresh
+    on_demand     read() touches no hardware, so call it at lookup time
+                  instead of scheduling it
+    """
+    name = "driver"
+    fields = ()
+    min_interval = 10.0
+    cost = 1
+    max_age = 30.0
+    on_demand = False
+
+    def read(self):
+        """Return a dict of field -> value, or None if the read failed"""
+        raise NotImplementedError
+
+    def read_with_age(self):
+        """Return (values, age_seconds): read()'s values and how long ago they were measured
+
+        Drivers that hand out values measured earlier (e.g. by a background
+        sampler) override this so the scheduler ages them from measurement time.
+        """
+        return self.read(), 0.0
+
+    def close(self):
+        pass
+
+
+class SenseHatDriver(SensorDriver):
+    """SenseHat temperature/humidity; temperature is offset for CPU heat"""
+    name = "sensehat"
+    fields = ("temperature", "humidity")
+    min_interval = 5.0
+    cost = 2
+    max_age = 30.0
+
+    def __init__(self, sense, temp_offset=8.0):
+        self.sense = sense
+        self.temp_offset = temp_offset
+
+    def read(self):
+        return {
+            "temperature": round(self.sense.get_temperature() - self.temp_offset, 1),
+            "humidity": round(self.sense.get_humidity(), 1),
+        }
+
+
+class DHT22Driver(SensorDriver):
+    """DHT22 values from a background DHT22Sampler (median-filtered, never blocks)"""
+    name = "dht22"
+    fields = ("temperature", "humidity")
+    min_interval = 2.0
+    cost = 1
+    max_age = 30.0
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+
+    def read(self):
+        return self.read_with_age()[0]
+
+    def read_with_age(self):
+        temperature, humidity, age = self.sampler.latest()
+        if temperature is None:
+            return None, None
+        return {"temperature": temperature, "humidity": humidity}, age
+
+    def close(self):
+        self.sampler.stop()
+
+
+class PIRDriver(SensorDriver):
+    """Occupancy from an interrupt-driven OccupancyMonitor (no GPIO access on read)"""
+    name = "pir"
+    fields = ("occupied",)
+    min_interval = 0.0
+    cost = 0
+    max_age = 0.0
+    on_demand = True
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+
+    def read(self):
+        return {"occupied": self.monitor.occupied}
+
+
+class MockDriver(SensorDriver):
+    """Fixed values for hardware that isn't fitted"""
+    name = "mock"
+    min_interval = 60.0
+    cost = 0
+    max_age = float("inf")
+
+    def __init__(self, values):
+        self.values = dict(values)
+        self.fields = tuple(self.values)
+
+    def read(self):
+        return dict(self.values)
+
+
+class SensorScheduler(threading.Thread):
+    """Samples registered drivers at their own cadence and caches the results
+
+    Drivers registered for the same field are tried in (priority, cost) order.
+    A lower-priority driver is only sampled while every driver ahead of it has
+    no fresh value, so a working DHT22 means the SenseHat is never read.
+    """
+
+    def __init__(self, fields, metrics=None):
+        super().__init__(name="pczs-sensor-scheduler", daemon=True)
+        self.fields = tuple(fields)
+        self.metrics = metrics
+        self.errors = {}
+        self._drivers = []  # (priority, cost, driver)
+        self._cache = {}  # driver name -> (values, monotonic time)
+        self._last_attempt = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def register(self, driver, priority=0):
+        self._drivers.append((priority, driver.cost, driver))
+        self._drivers.sort(key=lambda entry: entry[:2])
+        return driver
+
+    def _providers(self, field):
+        return [driver for _, _, driver in self._drivers if field in driver.fields]
+
+    def _fresh(self, driver, now):
+        if driver.on_demand:
+            return True
+        cached = self._cache.get(driver.name)
+        return cached is not None and now - cached[1] <= driver.max_age
+
+    def _needed(self, now):
+        """Drivers that are the best still-usable source for some wanted field"""
+        needed = []
+        for field in self.fields:
+            for driver in self._providers(field):
+                if driver not in needed:
+                    needed.append(driver)
+                if self._fresh(driver, now) or driver.name not in self._last_attempt:
+                    break
+        return needed
+
+    def refresh(self):
+        """Sample every needed driver that is due; returns seconds until the next one is due"""
+        now = time.monotonic()
+        next_due = 1.0
+        sampled = set()
+        while True:
+            # A failed read can make a fallback driver needed within the same pass
+            due_now = []
+            for driver in self._needed(now):
+                if driver.on_demand or driver.name in sampled:
+                    continue
+                due = self._last_attempt.get(driver.name, float("-inf")) + driver.min_interval
+                if due > now:
+                    next_due = min(next_due, due - now)
+                else:
+                    due_now.append(driver)
+            if not due_now:
+                return next_due
+            for driver in due_now:
+                sampled.add(driver.name)
+                self._sample(driver, now)
+                next_due = min(next_due, driver.min_interval)
+
+    def _sample(self, driver, now):
+        self._last_attempt[driver.name] = now
+        started = time.perf_counter()
+        try:
+            values, age = driver.read_with_age()
+        except Exception as e:
+            print(f"Unexpected {driver.name} error: {e}")
+            values = None
+        if self.metrics is not None:
+            self.metrics.histogram("pczs_sensor_read_seconds", "Sensor driver read time",
+                                   driver=driver.name).observe(time.perf_counter() - started)
+        if values is None:
+            self.errors[driver.name] = self.errors.get(driver.name, 0) + 1
+            if self.metrics is not None:
+                self.metrics.counter("pczs_sensor_errors_total", "Failed sensor driver reads",
+                                     driver=driver.name).inc()
+            return
+        with self._lock:
+            # Stamped with when the values were measured, not when they were read
+            self._cache[driver.name] = (values, time.monotonic() - age)
+
+    def latest(self, field):
+        """Return (value, age_seconds, driver_name) for the best cached value of `field`
+
+        Falls back to the newest stale value if nothing is fresh, and to
+        (None, None, None) if the field has never been read.
+        """
+        now = time.monotonic()
+        stale = None
+        with self._lock:
+            for driver in self._providers(field):
+                if driver.on_demand:
+                    return driver.read()[field], 0.0, driver.name
+                cached = self._cache.get(driver.name)
+                if cached is None or field not in cached[0]:
+                    continue
+                age = now - cached[1]
+                if age <= driver.max_age:
+                    return cached[0][field], age, driver.name
+                if stale is None or age < stale[1]:
+                    stale = (cached[0][field], age, driver.name)
+        return stale or (None, None, None)
+
+    def snapshot(self):
+        """Latest value for every wanted field"""
+        return {field: self.latest(field)[0] for field in self.fields}
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._stopped.wait(self.refresh())
+
+    def stop(self):
+        self._stopped.set()
+        if self.is_alive():
+            self.join(timeout=2.0)
+        for _, _, driver in self._drivers:
+            driver.close()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Report-on-Change Shadow Updates
+Only reports shadow fields that changed beyond a deadband since the last
+acknowledged update, plus a periodic full heartbeat
+"""
+import json
+import threading
+import time
+
+DEFAULT_DEADBANDS = {
+    "temperature": 0.2,  # °C
+    "humidity": 1.0,     # % RH
+}
+DEFAULT_HEARTBEAT = 900  # seconds between full reports
+DEFAULT_ACK_TIMEOUT = 30  # seconds before an unacknowledged field is re-sent
+
+
+class ShadowReporter:
+    """Tracks the device's last acknowledged reported state
+
+    Call `build_update(reported)` with the full reported state each cycle; it
+    returns a shadow update payload with only the fields worth sending, or None.
+    Feed `$aws/things/<thing>/shadow/update/accepted` messages to `on_accepted`.
+    """
+
+    def __init__(self, deadbands=None, heartbeat=DEFAULT_HEARTBEAT, ack_timeout=DEFAULT_ACK_TIMEOUT):
+        self.deadbands = dict(DEFAULT_DEADBANDS if deadbands is None else deadbands)
+        self.heartbeat = heartbeat
+        self.ack_timeout = ack_timeout
+        self.acknowledged = {}
+        self.version = None
+        self.sent = 0
+        self.suppressed = 0
+        self._pending = {}  # field -> (value, sent_at)
+        self._last_full = None
+        self._lock = threading.Lock()
+
+    def build_update(self, reported):
+        now = time.monotonic()
+        with self._lock:
+            # Forget sends that were never acknowledged so they go out again
+            self._pending = {k: v for k, v in self._pending.items() if now - v[1] < self.ack_timeout}
+            if self._last_full is None or now - self._last_full >= self.heartbeat:
+                changed = dict(reported)
+                self._last_full = now
+            else:
+                baseline = dict(self.acknowledged)
+                baseline.update({k: v[0] for k, v in self._pending.items()})
+                changed = {k: v for k, v in reported.items() if self._differs(k, baseline.get(k), v)}
+            if not changed:
+                self.suppressed += 1
+                return None
+            for k, v in changed.items():
+                self._pending[k] = (v, now)
+            self.sent += 1
+        return {"state": {"reported": changed}}
+
+    def _differs(self, field, old, new):
+        if old is None or new is None:
+            return old is not new
+        deadband = self.deadbands.get(field)
+        if deadband is not None and isinstance(new, (int, float)) and not isinstance(new, bool):
+            return abs(float(new) - float(old)) >= deadband
+        return old != new
+
+    def on_accepted(self, payload):
+        """Record fields confirmed by an update/accepted message"""
+        try:
+            message = json.loads(payload.decode('utf-8') if isinstance(payload, bytes) else payload)
+        except ValueError as e:
+            print(f"Ignoring malformed shadow accepted message: {e}")
+            return
+        reported = message.get("state", {}).get("reported") or {}
+        with self._lock:
+            self.version = message.get("version", self.version)
+            for k, v in reported.items():
+                self.acknowledged[k] = v
+                if k in self._pending and self._pending[k][0] == v:
+                    del self._pending[k]
+
+    def reset(self):
+        """Send a full report next cycle (e.g. after a reconnect)"""
+        with self._lock:
+            self._pending.clear()
+            self._last_full = None
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Telemetry Batching
+Packs several telemetry samples into one columnar MQTT message
+"""
+import datetime
+import time
+
+# Per-sample fields carried as columns in a batch
+BATCH_COLUMNS = ("temperature", "humidity", "occupied", "fan_state")
+BATCH_VERSION = 1
+
+
+def pack_batch(samples):
+    """Pack a list of telemetry payloads from read_sensors() into one columnar message
+
+    Layout:
+        {"v": 1, "workspace_id": ..., "ts_base": <ISO timestamp of first sample>,
+         "ts_offsets": [ms since ts_base, ...], "temperature": [...], "humidity": [...],
+         "occupied": [...], "fan_state": [...]}
+    Columns a sensor mode doesn't report are left out. The cloud side expands
+    it again in PCZS_TelemetryHandler's expand_telemetry_batch().
+    """
+    base = datetime.datetime.fromisoformat(samples[0]["timestamp"])
+    batch = {
+        "v": BATCH_VERSION,
+        "workspace_id": samples[0]["workspace_id"],
+        "ts_base": samples[0]["timestamp"],
+        "ts_offsets": [
+            round((datetime.datetime.fromisoformat(s["timestamp"]) - base).total_seconds() * 1000)
+            for s in samples
+        ],
+    }
+    for column in BATCH_COLUMNS:
+        if any(column in s for s in samples):
+            batch[column] = [s.get(column) for s in samples]
+    return batch
+
+
+class TelemetryBatcher:
+    """Collects samples and hands back a packed batch every `max_samples` samples or `max_age` seconds"""
+
+    def __init__(self, max_samples=30, max_age=300):
+        self.max_samples = max_samples
+        self.max_age = max_age
+        self._samples = []
+        self._started = None
+
+    def add(self, sample):
+        """Add a sample; returns a packed batch when one is ready, otherwise None"""
+        if not self._samples:
+            self._started = time.monotonic()
+        self._samples.append(sample)
+        if len(self._samples) >= self.max_samples or time.monotonic() - self._started >= self.max_age:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Pack whatever has been collected so far (None if empty)"""
+        if not self._samples:
+            return None
+        batch = pack_batch(self._samples)
+        self._samples = []
+        self._started = None
+        return batch
+
+    def __len__(self):
+        return len(self._samples)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Store-and-Forward Telemetry Queue
+Persists outbound MQTT messages in a SQLite WAL database so readings taken
+while the connection is down are published once it comes back
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+
+# Defaults
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024  # disk budget for queued payloads
+DEFAULT_DRAIN_RATE = 20.0  # messages per second while catching up
+DEFAULT_BATCH_SIZE = 50  # messages published per drain step
+DEFAULT_ACK_TIMEOUT = 10.0  # seconds to wait for PUBACKs of a batch
+DEFAULT_RESUME_JITTER = 5.0  # max random delay before draining after a reconnect
+
+
+class TelemetryQueue:
+    """Bounded, crash-safe FIFO of (topic, payload) messages backed by SQLite"""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._not_empty = threading.Event()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "topic TEXT NOT NULL, "
+            "payload BLOB NOT NULL, "
+            "created REAL NOT NULL)"
+        )
+        row = self._db.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM outbox").fetchone()
+        self._count, self._bytes = row
+        self.evicted = 0
+        if self._count:
+            print(f"Telemetry queue: recovered {self._count} unsent messages from {path}")
+            self._not_empty.set()
+
+    def put(self, topic, payload):
+        """Append a message, evicting the oldest ones if the disk budget is exceeded"""
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO outbox (topic, payload, created) VALUES (?, ?, ?)",
+                (topic, payload, time.time())
+            )
+            self._count += 1
+            self._bytes += len(payload)
+            if self._bytes > self.max_bytes:
+                self._evict()
+        self._not_empty.set()
+
+    def _evict(self):
+        # Drop the oldest messages in chunks until we are back under budget
+        previous = self.evicted
+        while self._bytes > self.max_bytes and self._count > 1:
+            rows = self._db.execute(
+                "SELECT id, LENGTH(payload) FROM outbox ORDER BY id LIMIT 100"
+            ).fetchall()
+            dropped, freed = [], 0
+            for row_id, size in rows:
+                if self._bytes - freed <= self.max_bytes or self._count - len(dropped) <= 1:
+                    break
+                dropped.append(row_id)
+                freed += size
+            if not dropped:
+                break
+            self._db.execute("DELETE FROM outbox WHERE id <= ?", (dropped[-1],))
+            self._count -= len(dropped)
+            self._bytes -= freed
+            self.evicted += len(dropped)
+        if previous == 0 or previous // 1000 != self.evicted // 1000:
+            print(f"Telemetry queue: disk budget reached, {self.evicted} oldest messages evicted so far")
+
+    def peek(self, limit):
+        """Return up to `limit` of the oldest messages as (id, topic, payload) tuples"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, topic, payload FROM outbox ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+            if not rows:
+                self._not_empty.clear()
+            return rows
+
+    def remove(self, ids):
+        """Delete messages that have been acknowledged by the broker"""
+        if not ids:
+            return
+        with self._lock:
+            placeholders = ",".join("?" * len(ids))
+            freed = self._db.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM outbox WHERE id IN ({placeholders})",
+                ids
+            ).fetchone()
+            self._db.execute(f"DELETE FROM outbox WHERE id IN ({placeholders})", ids)
+            self._count -= freed[0]
+            self._bytes -= freed[1]
+
+    def wait(self, timeout=None):
+        """Block until there is something to send"""
+        return self._not_empty.wait(timeout)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class QueueDrainer(threading.Thread):
+    """Publishes queued messages at a controlled rate while the connection is up
+
+    `publish(topic, payload)` must return a future that resolves once the
+    broker acknowledges the message (the awscrt publish future for QoS1).
+    """
+
+    def __init__(self, queue, publish, rate=DEFAULT_DRAIN_RATE, batch_size=DEFAULT_BATCH_SIZE,
+                 ack_timeout=DEFAULT_ACK_TIMEOUT, resume_jitter=DEFAULT_RESUME_JITTER):
+        super().__init__(name="pczs-queue-drainer", daemon=True)
+        self.queue = queue
+        self.publish = publish
+        self.rate = rate
+        self.batch_size = batch_size
+        self.ack_timeout = ack_timeout
+        self.resume_jitter = resume_jitter
+        self._connected = threading.Event()
+        self._stopped = threading.Event()
+        self._resumed = False
+
+    def connection_up(self, resumed=False):
+        """Called on connect / on_connection_resumed"""
+        self._resumed = resumed
+        self._connected.set()
+
+    def connection_down(self):
+        """Called from on_connection_interrupted"""
+        self._connected.clear()
+
+    def stop(self):
+        self._stopped.set()
+        self._connected.set()
+        if self.is_alive():
+            self.join(timeout=self.ack_timeout)
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._connected.wait()
+            if self._stopped.is_set():
+                break
+            if self._resumed:
+                # Spread reconnecting devices out so they don't all drain at once
+                self._resumed = False
+                self._stopped.wait(random.uniform(0, self.resume_jitter))
+                continue
+            if not self.queue.wait(timeout=1.0):
+                continue
+            started = time.monotonic()
+            batch = self.queue.peek(self.batch_size)
+            if not batch:
+                continue
+            if not self._drain_batch(batch):
+                # Broker didn't ack in time; back off before retrying
+                self._stopped.wait(1.0)
+                continue
+            # Pace catch-up traffic so a backlog goes out at `rate` msgs/s
+            if len(batch) > 1:
+                delay = len(batch) / self.rate - (time.monotonic() - started)
+                if delay > 0:
+                    self._stopped.wait(delay)
+
+    def _drain_batch(self, batch):
+        pending = []
+        for row_id, topic, payload in batch:
+            if not self._connected.is_set():
+                break
+            try:
+                pending.append((row_id, self.publish(topic, payload)))
+            except Exception as e:
+                print(f"Telemetry queue: publish failed: {e}")
+                break
+        acked = []
+        deadline = time.monotonic() + self.ack_timeout
+        for row_id, future in pending:
+            try:
+                future.result(timeout=max(0.0, deadline - time.monotonic()))
+                acked.append(row_id)
+            except Exception as e:
+                print(f"Telemetry queue: no PUBACK for message {row_id}: {e}")
+                break
+        self.queue.remove(acked)
+        return len(acked) == len(batch)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Compact Binary Telemetry
+Packs one read_sensors() sample into 14 bytes instead of ~150 bytes of JSON.
+Published on pczs/<workspace_id>/telemetry/bin; the workspace comes from the
+topic and PCZS_TelemetryHandler decodes it back into the usual table item.
+
+Version 1 layout (big-endian):
+    B  version (1)
+    B  flags: bit 0 occupied, bit 1 fan_state
+    I  epoch seconds (UTC)
+    H  milliseconds
+    h  device UTC offset in minutes (to rebuild the local ISO timestamp)
+    h  temperature, 0.01 °C
+    H  humidity, 0.01 % RH
+"""
+import datetime
+import struct
+
+WIRE_VERSION = 1
+_V1 = struct.Struct(">BBIHhhH")
+
+FLAG_OCCUPIED = 0x01
+FLAG_FAN = 0x02
+
+
+def encode_telemetry(sample):
+    """Pack a telemetry dict (as built by read_sensors()) into bytes"""
+    when = datetime.datetime.fromisoformat(sample["timestamp"])
+    if when.tzinfo is None:
+        when = when.astimezone()  # naive timestamps are device local time
+    epoch = when.timestamp()
+    seconds = int(epoch)
+    offset = int(when.utcoffset().total_seconds() // 60)
+    flags = (FLAG_OCCUPIED if sample["occupied"] else 0) | (FLAG_FAN if sample["fan_state"] else 0)
+    return _V1.pack(
+        WIRE_VERSION,
+        flags,
+        seconds,
+        int((epoch - seconds) * 1000),
+        offset,
+        int(round(sample["temperature"] * 100)),
+        int(round(sample["humidity"] * 100)),
+    )
+
+
+def decode_telemetry(data, workspace_id):
+    """Inverse of encode_telemetry(); the timestamp comes back as the device's local ISO time"""
+    if not data or data[0] != WIRE_VERSION:
+        raise ValueError(f"Unsupported telemetry wire version: {data[0] if data else None}")
+    _, flags, seconds, millis, offset, temperature, humidity = _V1.unpack(data)
+    tz = datetime.timezone(datetime.timedelta(minutes=offset))
+    when = datetime.datetime.fromtimestamp(seconds, tz) + datetime.timedelta(milliseconds=millis)
+    return {
+        "workspace_id": workspace_id,
+        "timestamp": when.replace(tzinfo=None).isoformat(),
+        "temperature": temperature / 100,
+        "humidity": humidity / 100,
+        "occupied": bool(flags & FLAG_OCCUPIED),
+        "fan_state": bool(flags & FLAG_FAN),
+    }
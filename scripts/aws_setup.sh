@@ -22,6 +22,9 @@ THING_NAME="PCZS"
 REGION="us-east-2"
 POLICY_NAME="PCZS_Policy"
 CERT_PATH="./cert"
+# PCZS_Telemetry partition key layout: workspace, day or shard. Set the same value as
+# PCZS_TELEMETRY_KEY_LAYOUT on both Lambda functions.
+TELEMETRY_KEY_LAYOUT="workspace"
 
 # Create IoT Thing
 echo "Creating IoT Thing: $THING_NAME"
@@ -57,6 +60,29 @@ aws dynamodb create-table \
         AttributeName=workspace_id,KeyType=HASH \
         AttributeName=timestamp,KeyType=RANGE \
     --billing-mode PAY_PER_REQUEST \
+    --stream-specification StreamEnabled=true,StreamViewType=NEW_IMAGE \
+    --region $REGION
+
+# Minute/hour rollups maintained from the PCZS_Telemetry stream (series = "<workspace_id>#1m" or "#1h")
+aws dynamodb create-table \
+    --table-name PCZS_TelemetryRollup \
+    --attribute-definitions \
+        AttributeName=series,AttributeType=S \
+        AttributeName=bucket,AttributeType=S \
+    --key-schema \
+        AttributeName=series,KeyType=HASH \
+        AttributeName=bucket,KeyType=RANGE \
+    --billing-mode PAY_PER_REQUEST \
+    --region $REGION
+
+# Newest item per workspace, maintained from the same stream and read by GET /telemetry
+aws dynamodb create-table \
+    --table-name PCZS_TelemetryLatest \
+    --attribute-definitions \
+        AttributeName=workspace_id,AttributeType=S \
+    --key-schema \
+        AttributeName=workspace_id,KeyType=HASH \
+    --billing-mode PAY_PER_REQUEST \
     --region $REGION
 
 aws dynamodb create-table \
@@ -71,11 +97,89 @@ aws dynamodb create-table \
     --region $REGION
 
 # Create IoT rule for storing data in DynamoDB
-echo "Creating IoT rule for DynamoDB"
+if [ "$TELEMETRY_KEY_LAYOUT" = "workspace" ]; then
+    echo "Creating IoT rule for DynamoDB"
+    aws iot create-topic-rule \
+        --rule-name PCZS_DynamoDB_Rule \
+        --topic-rule-payload '{"sql":"SELECT * FROM '"'pczs/+/telemetry'"'","actions":[{"dynamoDBv2":{"roleArn":"arn:aws:iam::ACCOUNT_ID:role/PCZS_DynamoDB_Role","putItem":{"tableName":"PCZS_Telemetry"}}}],"ruleDisabled":false}' \
+        --region $REGION
+else
+    # Sharded keys are computed by the telemetry Lambda, so samples go through it instead of straight to DynamoDB
+    echo "Creating IoT rule for sharded telemetry ($TELEMETRY_KEY_LAYOUT layout)"
+    aws iot create-topic-rule \
+        --rule-name PCZS_DynamoDB_Rule \
+        --topic-rule-payload '{"sql":"SELECT * FROM '"'pczs/+/telemetry'"'","actions":[{"lambda":{"functionArn":"arn:aws:lambda:'"$REGION"':ACCOUNT_ID:function:PCZS_TelemetryHandler"}}],"ruleDisabled":false}' \
+        --region $REGION
+
+    aws lambda add-permission \
+        --function-name PCZS_TelemetryHandler \
+        --statement-id PCZS_DynamoDB_Rule \
+        --action lambda:InvokeFunction \
+        --principal iot.amazonaws.com \
+        --source-arn arn:aws:iot:$REGION:ACCOUNT_ID:rule/PCZS_DynamoDB_Rule \
+        --region $REGION
+fi
+
+# Create IoT rule that hands batched telemetry to the telemetry Lambda for unpacking
+echo "Creating IoT rule for batched telemetry"
+aws iot create-topic-rule \
+    --rule-name PCZS_TelemetryBatch_Rule \
+    --topic-rule-payload '{"sql":"SELECT * FROM '"'pczs/+/telemetry/batch'"'","actions":[{"lambda":{"functionArn":"arn:aws:lambda:'"$REGION"':ACCOUNT_ID:function:PCZS_TelemetryHandler"}}],"ruleDisabled":false}' \
+    --region $REGION
+
+aws lambda add-permission \
+    --function-name PCZS_TelemetryHandler \
+    --statement-id PCZS_TelemetryBatch_Rule \
+    --action lambda:InvokeFunction \
+    --principal iot.amazonaws.com \
+    --source-arn arn:aws:iot:$REGION:ACCOUNT_ID:rule/PCZS_TelemetryBatch_Rule \
+    --region $REGION
+
+# Binary telemetry can't be selected as JSON, so the rule base64-encodes it and adds the workspace from the topic
+echo "Creating IoT rule for binary telemetry"
 aws iot create-topic-rule \
-    --rule-name PCZS_DynamoDB_Rule \
-    --topic-rule-payload '{"sql":"SELECT * FROM '"'pczs/+/telemetry'"'","actions":[{"dynamoDBv2":{"roleArn":"arn:aws:iam::ACCOUNT_ID:role/PCZS_DynamoDB_Role","putItem":{"tableName":"PCZS_Telemetry"}}}],"ruleDisabled":false}' \
+    --rule-name PCZS_TelemetryBinary_Rule \
+    --topic-rule-payload '{"sql":"SELECT encode(*, '"'base64'"') AS data, topic(2) AS workspace_id FROM '"'pczs/+/telemetry/bin'"'","actions":[{"lambda":{"functionArn":"arn:aws:lambda:'"$REGION"':ACCOUNT_ID:function:PCZS_TelemetryHandler"}}],"ruleDisabled":false}' \
+    --region $REGION
+
+aws lambda add-permission \
+    --function-name PCZS_TelemetryHandler \
+    --statement-id PCZS_TelemetryBinary_Rule \
+    --action lambda:InvokeFunction \
+    --principal iot.amazonaws.com \
+    --source-arn arn:aws:iot:$REGION:ACCOUNT_ID:rule/PCZS_TelemetryBinary_Rule \
+    --region $REGION
+
+# Feed new telemetry items to the telemetry Lambda so it can update the rollups
+echo "Connecting the PCZS_Telemetry stream to the rollup/latest-state handler"
+STREAM_ARN=$(aws dynamodb describe-table --table-name PCZS_Telemetry --query 'Table.LatestStreamArn' --output text --region $REGION)
+# Records that still fail after the bounded retries are sent here instead of blocking the shard
+# (PCZS_TelemetryHandler's role needs sqs:SendMessage on it)
+FAILURE_QUEUE_URL=$(aws sqs create-queue --queue-name PCZS_TelemetryStreamFailures --query 'QueueUrl' --output text --region $REGION)
+FAILURE_QUEUE_ARN=$(aws sqs get-queue-attributes --queue-url $FAILURE_QUEUE_URL --attribute-names QueueArn --query 'Attributes.QueueArn' --output text --region $REGION)
+aws lambda create-event-source-mapping \
+    --function-name PCZS_TelemetryHandler \
+    --event-source-arn $STREAM_ARN \
+    --starting-position LATEST \
+    --batch-size 500 \
+    --maximum-batching-window-in-seconds 10 \
+    --function-response-types ReportBatchItemFailures \
+    --bisect-batch-on-function-error \
+    --maximum-retry-attempts 5 \
+    --maximum-record-age-in-seconds 3600 \
+    --destination-config "{\"OnFailure\":{\"Destination\":\"$FAILURE_QUEUE_ARN\"}}" \
+    --region $REGION
+
+# Code shared by both Lambda functions (CORS headers, cached AWS clients, TTL cache)
+echo "Publishing the PCZS_Common Lambda layer"
+(cd ../Cloud/PCZS_Common && zip -qr ../../scripts/pczs_common_layer.zip python)
+aws lambda publish-layer-version \
+    --layer-name PCZS_Common \
+    --zip-file fileb://pczs_common_layer.zip \
+    --compatible-runtimes python3.11 python3.12 \
     --region $REGION
+rm -f pczs_common_layer.zip
 
 echo "AWS Setup completed successfully!"
-echo "Note: You'll need to manually create a Lambda function and API Gateway for the web interface."
\ No newline at end of file
+echo "Note: You'll need to manually create a Lambda function and API Gateway for the web interface."
+echo "Attach the PCZS_Common layer to PCZS_TelemetryHandler and PCZS_PreferncesHandler."
\ No newline at end of file
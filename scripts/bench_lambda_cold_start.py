@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Lambda Cold Start Benchmark
+Measures init (module import), first-request and warm-request times of the
+PCZS Lambda handlers locally. AWS is stubbed at botocore's HTTP layer, so
+request serialization, signing and response parsing still run but nothing
+leaves the machine (and TLS handshakes are not included). Init covers
+importing the handler and botocore; interpreter start-up is excluded.
+
+Each cold start runs in a fresh Python process, like a new Lambda container.
+
+Usage:
+    python bench_lambda_cold_start.py [--runs 10] [--warm 200]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+COMMON_LAYER = os.path.join(ROOT, "Cloud", "PCZS_Common", "python")
+
+HANDLERS = {
+    "telemetry": os.path.join(ROOT, "Cloud", "PCZS_TelemetryHandler"),
+    "preferences": os.path.join(ROOT, "Cloud", "PCZS_PreferncesHandler"),
+}
+
+# (name, handler, API Gateway event)
+ROUTES = [
+    ("GET /telemetry", "telemetry",
+     {"httpMethod": "GET", "path": "/telemetry", "queryStringParameters": {"workspace_id": "workspace_1"}}),
+    ("GET /telemetry/history", "telemetry",
+     {"httpMethod": "GET", "path": "/telemetry/history", "queryStringParameters": {"workspace_id": "workspace_1"}}),
+    ("GET /preferences", "preferences",
+     {"httpMethod": "GET", "path": "/preferences",
+      "queryStringParameters": {"user_id": "user_1", "workspace_id": "workspace_1"}}),
+    ("POST /preferences", "preferences",
+     {"httpMethod": "POST", "path": "/preferences",
+      "body": json.dumps({"user_id": "user_1", "workspace_id": "workspace_1", "preferred_temp": 23,
+                          "temp_threshold": 1, "preferred_humidity": 50, "humidity_threshold": 10})}),
+]
+
+STUB_ITEM = {
+    "workspace_id": {"S": "workspace_1"},
+    "timestamp": {"S": "2026-10-17T09:42:10.121000"},
+    "temperature": {"N": "23.4"},
+    "humidity": {"N": "45.1"},
+    "occupied": {"BOOL": True},
+    "fan_state": {"BOOL": False},
+}
+
+# Canned responses keyed by DynamoDB X-Amz-Target operation
+STUB_RESPONSES = {
+    "GetItem": {"Item": STUB_ITEM},
+    "Query": {"Items": [STUB_ITEM] * 50, "Count": 50, "ScannedCount": 50},
+    "PutItem": {},
+    "UpdateItem": {"Attributes": {}},
+    "BatchWriteItem": {"UnprocessedItems": {}},
+}
+
+
+def install_aws_stub():
+    """Answer every botocore HTTP request locally with a canned response"""
+    from botocore.awsrequest import AWSResponse
+    from botocore.endpoint import Endpoint
+
+    class Body:
+        def __init__(self, data):
+            self.data = data
+
+        def stream(self, **kwargs):
+            yield self.data
+
+    def send(self, request):
+        target = request.headers.get("X-Amz-Target", b"")
+        if isinstance(target, bytes):
+            target = target.decode()
+        if target:
+            payload = STUB_RESPONSES[target.split(".")[-1]]
+        else:
+            payload = {"state": {}, "version": 1}  # iot-data UpdateThingShadow
+        body = json.dumps(payload).encode()
+        return AWSResponse(request.url, 200, {"Content-Type": "application/x-amz-json-1.0"}, Body(body))
+
+    Endpoint._send = send
+
+
+def child(handler, route_index, warm):
+    """Runs inside a fresh interpreter: import the handler, then time requests"""
+    started = time.perf_counter()
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "stub")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stub")
+    sys.path[:0] = [HANDLERS[handler], COMMON_LAYER]
+    install_aws_stub()
+
+    import lambda_function  # noqa: E402
+    imported = time.perf_counter()
+
+    event = ROUTES[route_index][2]
+    response = lambda_function.lambda_handler(event, None)
+    first = time.perf_counter()
+    if response["statusCode"] >= 500:
+        raise SystemExit(f"Handler failed: {response['body']}")
+
+    warm_times = []
+    for _ in range(warm):
+        t = time.perf_counter()
+        lambda_function.lambda_handler(event, None)
+        warm_times.append(time.perf_counter() - t)
+
+    print(json.dumps({
+        "init": imported - started,
+        "first": first - imported,
+        "warm": statistics.median(warm_times) if warm_times else None,
+    }))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PCZS Lambda cold starts with stubbed AWS")
+    parser.add_argument("--runs", type=int, default=10, help="cold starts per route")
+    parser.add_argument("--warm", type=int, default=200, help="warm requests per cold start")
+    parser.add_argument("--child", nargs=2, metavar=("HANDLER", "ROUTE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], int(args.child[1]), args.warm)
+        return
+
+    # Logging is left on; Lambda sends it to CloudWatch, so it is part of the cost
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    print(f"{'route':24} {'init p50':>9} {'1st req p50':>12} {'cold total p50':>15} {'cold total p99':>15} {'warm p50':>9}")
+    for index, (name, handler, _) in enumerate(ROUTES):
+        samples = []
+        for _ in range(args.runs):
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--warm", str(args.warm),
+                                  "--child", handler, str(index)],
+                                 capture_output=True, text=True, env=env, check=True)
+            samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        inits = [s["init"] * 1e3 for s in samples]
+        firsts = [s["first"] * 1e3 for s in samples]
+        warms = [s["warm"] * 1e3 for s in samples]
+        totals = [i + f for i, f in zip(inits, firsts)]
+        print(f"{name:24} {percentile(inits, .5):7.1f}ms {percentile(firsts, .5):10.1f}ms "
+              f"{percentile(totals, .5):13.1f}ms {percentile(totals, .99):13.1f}ms {statistics.median(warms):7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
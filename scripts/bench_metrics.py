@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Metrics Overhead Benchmark
+Measures what the device instrumentation in Sensors/metrics.py costs per
+call, relative to the hot-path work it wraps, and how long a scrape takes.
+
+Usage:
+    python bench_metrics.py [--iterations 200000]
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Sensors"))
+from metrics import MetricsRegistry, MetricsServer  # noqa: E402
+from async_runtime import LoopStats  # noqa: E402
+
+
+def per_call(func, iterations):
+    """Average seconds per call of func()"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PCZS device metrics overhead")
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    metrics = MetricsRegistry()
+    histogram = metrics.histogram("pczs_bench_seconds", "Benchmark histogram")
+    counter = metrics.counter("pczs_bench_total", "Benchmark counter")
+    stats_plain = LoopStats("bench")
+    stats_metrics = LoopStats("bench", metrics=metrics)
+    telemetry = {
+        "workspace_id": "workspace_1",
+        "timestamp": datetime.datetime.now().isoformat(),
+        "temperature": 23.4,
+        "humidity": 45.1,
+        "occupied": True,
+        "fan_state": False
+    }
+
+    def timed_encode():
+        with histogram.time():
+            json.dumps(telemetry)
+
+    results = [
+        ("empty loop", per_call(lambda: None, n)),
+        ("Counter.inc()", per_call(counter.inc, n)),
+        ("Histogram.observe()", per_call(lambda: histogram.observe(0.003), n)),
+        ("with Histogram.time()", per_call(lambda: histogram.time().__enter__().__exit__(), n)),
+        ("LoopStats.record() plain", per_call(lambda: stats_plain.record("x", 0.003), n)),
+        ("LoopStats.record() + metrics", per_call(lambda: stats_metrics.record("x", 0.003), n)),
+        ("json.dumps(telemetry)", per_call(lambda: json.dumps(telemetry), n)),
+        ("json.dumps(telemetry) timed", per_call(timed_encode, n)),
+    ]
+    baseline = results[0][1]
+    print(f"{'operation':32} {'per call':>10} {'net of loop':>12}")
+    for name, seconds in results:
+        print(f"{name:32} {seconds * 1e6:8.2f}us {max(0.0, seconds - baseline) * 1e6:10.2f}us")
+
+    encode, timed = results[-2][1], results[-1][1]
+    print(f"\nTiming the JSON encode adds {(timed - encode) * 1e6:.2f}us "
+          f"({(timed - encode) / encode * 100:.0f}% of the encode itself).")
+    sample_interval = 10.0
+    per_sample = 12 * (timed - encode)  # roughly a dozen observations per sample cycle
+    print(f"At ~12 observations per {sample_interval:.0f}s sample cycle that is "
+          f"{per_sample * 1e6:.0f}us, {per_sample / sample_interval * 100:.4f}% of one core.")
+
+    # Realistic registry size for the scrape
+    for driver in ("dht22", "sensehat"):
+        metrics.histogram("pczs_sensor_read_seconds", "Sensor driver read time", driver=driver).observe(0.002)
+    for command in ("status", "flash", "message"):
+        metrics.histogram("pczs_display_seconds", "SenseHat display command time", command=command).observe(0.5)
+    for stage in ("sample_jitter", "sample_duration", "publish_latency", "control_latency"):
+        stats_metrics.record(stage, 0.01)
+    metrics.gauge("pczs_telemetry_queue_depth", "Queue depth", fn=lambda: 3)
+
+    render = per_call(metrics.render, 2000)
+    server = MetricsServer(metrics, port=0)
+    server.start()
+    url = f"http://127.0.0.1:{server.httpd.server_address[1]}/metrics"
+    scrape = per_call(lambda: urllib.request.urlopen(url).read(), 200)
+    server.stop()
+    print(f"\nrender(): {render * 1e3:.3f}ms for {len(metrics.render())} bytes; "
+          f"HTTP scrape round trip: {scrape * 1e3:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Wire Format Benchmark
+Compares payload size and encode/decode time of the compact binary telemetry
+format (Sensors/wire_format.py) against the JSON payload sent today.
+
+Usage:
+    python bench_wire_format.py [--iterations 200000]
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Sensors"))
+from wire_format import encode_telemetry, decode_telemetry  # noqa: E402
+
+
+def per_call(func, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark binary vs JSON telemetry encoding")
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    sample = {
+        "workspace_id": "workspace_1",
+        "timestamp": datetime.datetime.now().isoformat(),
+        "temperature": 23.4,
+        "humidity": 45.1,
+        "occupied": True,
+        "fan_state": False
+    }
+    json_payload = json.dumps(sample).encode("utf-8")
+    binary_payload = encode_telemetry(sample)
+
+    decoded = decode_telemetry(binary_payload, sample["workspace_id"])
+    for key in ("temperature", "humidity", "occupied", "fan_state"):
+        assert decoded[key] == sample[key], (key, decoded[key], sample[key])
+    assert decoded["timestamp"][:23] == sample["timestamp"][:23]
+
+    results = [
+        ("json encode", per_call(lambda: json.dumps(sample).encode("utf-8"), n)),
+        ("binary encode", per_call(lambda: encode_telemetry(sample), n)),
+        ("json decode", per_call(lambda: json.loads(json_payload), n)),
+        ("binary decode", per_call(lambda: decode_telemetry(binary_payload, "workspace_1"), n)),
+    ]
+    print(f"Payload size: json {len(json_payload)} bytes, binary {len(binary_payload)} bytes "
+          f"({len(json_payload) / len(binary_payload):.1f}x smaller)")
+    for name, seconds in results:
+        print(f"{name:14} {seconds * 1e6:7.2f}us")
+
+    per_day = 86400 // 10
+    print(f"\nPer device per day at one sample every 10s: json {len(json_payload) * per_day / 1024:.0f} KB, "
+          f"binary {len(binary_payload) * per_day / 1024:.0f} KB "
+          f"(payload only; MQTT/TLS framing adds ~30-60 bytes per message)")
+    print("Note: IoT Core bills per 5 KB, so a single sample costs one unit in either format.")
+
+
+if __name__ == "__main__":
+    main()
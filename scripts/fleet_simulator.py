@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+PCZS: Personalized Comfort Zones System - Virtual Device Fleet Simulator
+Spawns thousands of virtual workspaces in one asyncio process, each producing
+the same telemetry payload as Sensors/integrated_sensor.py read_sensors(),
+and publishes them to an in-process MQTT broker stand-in that behaves like
+the pczs/+/telemetry -> PCZS_Telemetry IoT rule. Reports the offered vs
+achieved msg/s, latency percentiles (from each sample's
+scheduled send time to its PUBACK) and dropped messages. Devices publish on a
+fixed schedule without waiting for acks, so an overloaded broker cannot slow
+the offered load down.
+
+Usage:
+    python fleet_simulator.py --devices 2000 --interval 1 --duration 60
+    python fleet_simulator.py --devices 5000 --broker-rate 3000 --batch-size 10
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import random
+import sys
+import time
+
+# Reuse the device-side batch encoder so batched runs send the real wire format
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Sensors"))
+from telemetry_batch import pack_batch  # noqa: E402
+
+
+class LocalBroker:
+    """Minimal stand-in for AWS IoT Core plus the telemetry DynamoDB rule
+
+    Messages wait in a bounded inbound queue (full queue = dropped, like a
+    throttled broker) and are processed at up to `max_rate` msg/s. Each
+    processed message is parsed and "stored" the way the IoT rule's putItem
+    would, then the publisher's PUBACK future is resolved.
+    """
+
+    def __init__(self, max_rate=None, queue_size=10000, service_time=0.0):
+        self.max_rate = max_rate
+        self.service_time = service_time
+        self.queue = asyncio.Queue(queue_size)
+        self.received = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.rows_stored = 0
+        self.bytes_in = 0
+
+    async def publish(self, topic, payload):
+        """Returns a future resolved on PUBACK, or None if the broker dropped the message"""
+        ack = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((topic, payload, ack))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return None
+        return ack
+
+    def _store(self, topic, payload):
+        message = json.loads(payload)
+        if topic.endswith("/batch"):
+            rows = len(message["ts_offsets"])
+        else:
+            # putItem needs both key attributes of PCZS_Telemetry
+            if "workspace_id" not in message or "timestamp" not in message:
+                self.rejected += 1
+                return
+            rows = 1
+        self.rows_stored += rows
+
+    async def run(self):
+        tokens = 0.0
+        last = time.perf_counter()
+        while True:
+            topic, payload, ack = await self.queue.get()
+            if self.max_rate:
+                # Token bucket: sleep until we are allowed to process another message
+                now = time.perf_counter()
+                tokens = min(self.max_rate, tokens + (now - last) * self.max_rate)
+                last = now
+                if tokens < 1.0:
+                    await asyncio.sleep((1.0 - tokens) / self.max_rate)
+                    # Credit any oversleep so timer granularity doesn't lower the capacity
+                    now = time.perf_counter()
+                    tokens = min(self.max_rate, tokens + (now - last) * self.max_rate)
+                    last = now
+                tokens -= 1.0
+            if self.service_time:
+                await asyncio.sleep(self.service_time)
+            self.received += 1
+            self.bytes_in += len(payload)
+            try:
+                self._store(topic, payload)
+            except ValueError:
+                self.rejected += 1
+            if not ack.done():
+                ack.set_result(True)
+
+
+class VirtualDevice:
+    """One simulated workspace with drifting temperature and office-hours occupancy"""
+
+    def __init__(self, index, rng, comfort_temp=23.0):
+        self.workspace_id = f"sim_workspace_{index}"
+        self.rng = rng
+        self.comfort_temp = comfort_temp
+        self.temp_threshold = 1.0
+        self.base_temp = rng.uniform(21.0, 25.0)
+        self.temperature = self.base_temp
+        self.humidity = rng.uniform(35.0, 55.0)
+        self.occupied = False
+        self.fan_state = False
+        # Each person keeps slightly different hours
+        self.arrival_hour = rng.gauss(8.75, 0.75)
+        self.departure_hour = rng.gauss(17.25, 0.75)
+
+    def step(self, now, dt):
+        hour = now.hour + now.minute / 60.0
+        at_work = now.weekday() < 5 and self.arrival_hour <= hour <= self.departure_hour
+        # Occupancy flips like a Markov chain: mostly present during hours, with breaks
+        p_flip = (0.02 if self.occupied else 0.2) if at_work else (0.3 if self.occupied else 0.001)
+        if self.rng.random() < p_flip * dt / 10.0:
+            self.occupied = not self.occupied
+
+        # Diurnal drift + people heat + fan cooling + noise, relaxing toward the base temperature
+        diurnal = 1.5 * math.sin((hour - 9.0) / 24.0 * 2 * math.pi)
+        target = self.base_temp + diurnal + (0.8 if self.occupied else 0.0) - (1.2 if self.fan_state else 0.0)
+        self.temperature += (target - self.temperature) * min(1.0, dt / 600.0) + self.rng.gauss(0, 0.03)
+        self.humidity += (45.0 - self.humidity) * min(1.0, dt / 3600.0) + self.rng.gauss(0, 0.1)
+        self.humidity = min(100.0, max(0.0, self.humidity))
+
+        # Same fan rule as control_fan() in the sensor scripts
+        self.fan_state = self.occupied and self.temperature > self.comfort_temp + self.temp_threshold
+
+    def read_sensors(self, now):
+        return {
+            "workspace_id": self.workspace_id,
+            "timestamp": now.isoformat(),
+            "temperature": round(self.temperature, 1),
+            "humidity": round(self.humidity, 1),
+            "occupied": self.occupied,
+            "fan_state": self.fan_state
+        }
+
+
+class Results:
+    def __init__(self, ack_timeout):
+        self.ack_timeout = ack_timeout
+        self.sent = 0
+        self.acked = 0
+        self.dropped = 0
+        self.timeouts = 0
+        self.samples = 0
+        self.latencies = []
+        self.outstanding = set()
+
+    def track(self, ack, scheduled):
+        """Count the PUBACK when it arrives, measuring from when the message was due"""
+        self.outstanding.add(ack)
+
+        def done(future):
+            self.outstanding.discard(future)
+            latency = time.perf_counter() - scheduled
+            if latency > self.ack_timeout:
+                self.timeouts += 1
+            else:
+                self.acked += 1
+                self.latencies.append(latency)
+
+        ack.add_done_callback(done)
+
+    def percentile(self, p):
+        if not self.latencies:
+            return float("nan")
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def run_device(device, broker, results, args, sim_start, real_start, deadline):
+    """Sample on a fixed schedule, whatever the broker is doing (open loop)
+
+    Publishes never wait for the previous PUBACK, so a slow broker shows up as
+    latency and drops instead of quietly lowering the offered load. If the
+    event loop falls behind, overdue samples are sent at once rather than skipped.
+    """
+    rng = device.rng
+    # Stagger start-up across one interval so devices don't publish in lockstep
+    next_tick = real_start + rng.uniform(0, args.interval)
+    pending = []
+    last_real = next_tick
+    while next_tick < deadline:
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        scheduled = next_tick
+        next_tick += args.interval
+
+        sim_now = sim_start + datetime.timedelta(seconds=(scheduled - real_start) * args.time_scale)
+        device.step(sim_now, (scheduled - last_real) * args.time_scale)
+        last_real = scheduled
+        pending.append(device.read_sensors(sim_now))
+        results.samples += 1
+
+        if len(pending) >= args.batch_size:
+            if args.batch_size > 1:
+                topic = f"pczs/{device.workspace_id}/telemetry/batch"
+                payload = json.dumps(pack_batch(pending))
+            else:
+                topic = f"pczs/{device.workspace_id}/telemetry"
+                payload = json.dumps(pending[0])
+            pending = []
+
+            results.sent += 1
+            ack = await broker.publish(topic, payload)
+            if ack is None:
+                results.dropped += 1
+            else:
+                results.track(ack, scheduled)
+
+
+async def simulate(args):
+    rng = random.Random(args.seed)
+    broker = LocalBroker(max_rate=args.broker_rate, queue_size=args.broker_queue,
+                         service_time=args.service_time)
+    broker_task = asyncio.create_task(broker.run())
+    devices = [VirtualDevice(i, random.Random(rng.random())) for i in range(args.devices)]
+    results = Results(args.ack_timeout)
+
+    sim_start = datetime.datetime(2026, 10, 19, 8, 0, 0)  # a Monday morning
+    real_start = time.perf_counter()
+    deadline = real_start + args.duration
+    print(f"Simulating {args.devices} devices every {args.interval}s for {args.duration}s "
+          f"(batch size {args.batch_size}, broker rate {args.broker_rate or 'unlimited'} msg/s)...")
+    await asyncio.gather(*(run_device(d, broker, results, args, sim_start, real_start, deadline)
+                           for d in devices))
+    elapsed = time.perf_counter() - real_start
+    acked_in_run, rows_in_run = results.acked, broker.rows_stored
+    # Give the last messages their full ack timeout; whatever is still unacknowledged timed out
+    if results.outstanding:
+        await asyncio.wait(set(results.outstanding), timeout=args.ack_timeout)
+    results.timeouts += len(results.outstanding)
+    broker_task.cancel()
+    offered = args.devices / args.interval / args.batch_size
+
+    print()
+    print(f"Devices:              {args.devices}")
+    print(f"Samples generated:    {results.samples}")
+    print(f"Messages published:   {results.sent}")
+    print(f"Messages acked:       {results.acked}")
+    print(f"Dropped (queue full): {results.dropped}")
+    print(f"PUBACK timeouts:      {results.timeouts}")
+    print(f"Rows stored:          {broker.rows_stored} (rejected {broker.rejected})")
+    print(f"Offered load:         {offered:.1f} msg/s scheduled, {results.sent / elapsed:.1f} msg/s sent")
+    print(f"Achieved throughput:  {acked_in_run / elapsed:.1f} msg/s acked, {rows_in_run / elapsed:.1f} rows/s")
+    if broker.received:
+        print(f"Average payload:      {broker.bytes_in / broker.received:.0f} bytes")
+    print("Publish latency:      p50={:.1f}ms p95={:.1f}ms p99={:.1f}ms max={:.1f}ms (from scheduled send)".format(
+        results.percentile(0.50) * 1000, results.percentile(0.95) * 1000,
+        results.percentile(0.99) * 1000, results.percentile(1.0) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PCZS virtual device fleet simulator")
+    parser.add_argument("--devices", type=int, default=1000, help="number of virtual workspaces")
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between samples per device")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to run")
+    parser.add_argument("--time-scale", type=float, default=60.0,
+                        help="simulated seconds per real second (drives drift and occupancy)")
+    parser.add_argument("--batch-size", type=int, default=1, help="samples per message (>1 uses batch topic)")
+    parser.add_argument("--broker-rate", type=float, default=None, help="broker capacity in msg/s")
+    parser.add_argument("--broker-queue", type=int, default=10000, help="broker inbound queue size")
+    parser.add_argument("--service-time", type=float, default=0.0, help="per-message broker processing time (s)")
+    parser.add_argument("--ack-timeout", type=float, default=10.0, help="seconds to wait for PUBACK")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    args = parser.parse_args()
+    asyncio.run(simulate(args))
+
+
+if __name__ == "__main__":
+    main()
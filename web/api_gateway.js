@@ -82,10 +82,36 @@ async function getCurrentTelemetry(workspaceId) {
     }
 }
 
+// Latest telemetry for many workspaces in one request (e.g. a floor or building overview).
+// The response is columnar: workspace_ids plus one array per field, in the same order.
+async function getLatestTelemetryMany(workspaceIds) {
+    try {
+        const response = await fetch(`${API_ENDPOINT}/telemetry/latest`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ workspace_ids: workspaceIds })
+        });
+        
+        if (!response.ok) {
+            throw new Error(`API error: ${response.status}`);
+        }
+        
+        const data = await response.json();
+        console.log(`Retrieved telemetry for ${data.workspace_ids.length} workspaces`);
+        return data;
+    } catch (error) {
+        console.error('Error getting fleet telemetry:', error);
+        return null;
+    }
+}
+
 // NEW FUNCTION: Get historical telemetry data
-async function getHistoricalTelemetry(workspaceId, hours = 24) {
+async function getHistoricalTelemetry(workspaceId, hours = 24, resolution = '5m') {
     try {
-        const response = await fetch(`${API_ENDPOINT}/telemetry/history?workspace_id=${workspaceId}&hours=${hours}`);
+        // Downsampled server-side: one point per `resolution` bucket instead of every sample
+        const response = await fetch(`${API_ENDPOINT}/telemetry/history?workspace_id=${workspaceId}&hours=${hours}&resolution=${resolution}`);
         
         if (!response.ok) {
             throw new Error(`API error: ${response.status}`);
@@ -106,7 +132,8 @@ function processHistoricalData(historyData) {
         timestamps: [],
         temperature: [],
         humidity: [],
-        occupied: []
+        occupied: [],
+        fanState: []
     };
     
     // Sort by timestamp (newest last)
@@ -121,7 +148,9 @@ function processHistoricalData(historyData) {
         processed.timestamps.push(timeString);
         processed.temperature.push(item.temperature);
         processed.humidity.push(item.humidity);
-        processed.occupied.push(item.occupied);
+        // Downsampled buckets carry the share of the bucket occupied / fan on rather than a flag
+        processed.occupied.push('occupied_fraction' in item ? item.occupied_fraction >= 0.5 : item.occupied);
+        processed.fanState.push('fan_duty' in item ? item.fan_duty >= 0.5 : item.fan_state);
     });
     
     return processed;
@@ -150,6 +179,8 @@ async function loadHistoricalData(workspaceId) {
             window.sensorData.timestamps = processedData.timestamps;
             window.sensorData.temperature = processedData.temperature;
             window.sensorData.humidity = processedData.humidity;
+            window.sensorData.occupied = processedData.occupied;
+            window.sensorData.fanState = processedData.fanState;
             
             // Fill preferred values arrays with current preferences
             const prefTemp = parseFloat(document.getElementById('preferred-temp').value);
@@ -168,6 +199,7 @@ async function loadHistoricalData(workspaceId) {
 window.savePreferences = savePreferences;
 window.getPreferences = getPreferences;
 window.getCurrentTelemetry = getCurrentTelemetry;
+window.getLatestTelemetryMany = getLatestTelemetryMany;
 window.getHistoricalTelemetry = getHistoricalTelemetry;
 window.processHistoricalData = processHistoricalData;
 window.loadHistoricalData = loadHistoricalData;
\ No newline at end of file